@@ -29,8 +29,13 @@ import os
 from pyworkflow.utils import Environ, greenStr
 import pwem
 from .constants import (PROTEIN_DOCKING_HOME, ZDOCK_DOCKING_HOME,
-                        ZRANK_DOCKING_HOME, FRODOCKGRID, ZRANK, ZDOCK,
-                        FRODOCKCLUSTER, FRODOCK, SOAP)
+                        ZRANK_DOCKING_HOME, FRODOCK_MAPS_CACHE,
+                        FRODOCK_MAPS_CACHE_SIZE, FRODOCK_VERSION,
+                        ZDOCK_VERSION, ZRANK_VERSION)
+from .cache import MapCache
+from .profiling import recordProgram
+from .runner import runCommand
+from .tools import ToolRegistry
 
 _logo = ""
 _references = ['']
@@ -41,60 +46,92 @@ class Plugin(pwem.Plugin):
     _url = "https://github.com/scipion-em/scipion-protein-docking"
     _homeVar = PROTEIN_DOCKING_HOME
     _pathVars = [PROTEIN_DOCKING_HOME, ZDOCK_DOCKING_HOME, ZRANK_DOCKING_HOME]
+    _toolRegistry = None
+
     @classmethod
     def _defineVariables(cls):
-        cls._defineEmVar(PROTEIN_DOCKING_HOME, 'frodock3-3.12')
-        cls._defineEmVar(ZDOCK_DOCKING_HOME, 'zdock-3.0.2')
-        cls._defineEmVar(ZRANK_DOCKING_HOME, 'zrank-2.0')
+        cls._defineEmVar(PROTEIN_DOCKING_HOME, 'frodock3-' + FRODOCK_VERSION)
+        cls._defineEmVar(ZDOCK_DOCKING_HOME, 'zdock-' + ZDOCK_VERSION)
+        cls._defineEmVar(ZRANK_DOCKING_HOME, 'zrank-' + ZRANK_VERSION)
+        cls._defineVar(FRODOCK_MAPS_CACHE,
+                       os.path.join(os.path.expanduser('~'), '.cache',
+                                    'scipion-protein-docking', 'maps'))
+        cls._defineVar(FRODOCK_MAPS_CACHE_SIZE, 20)
 
     @classmethod
-    def getEnviron(cls):
+    def getEnviron(cls, numberOfThreads=None):
         """ Setup the environment variables needed to launch frodock3. """
         environ = Environ(os.environ)
+        if numberOfThreads is not None:
+            environ['OMP_NUM_THREADS'] = str(numberOfThreads)
         return environ
 
     @classmethod
     def getProgram(cls, program):
-        """ Return the program binary that will be used. """
-        if (program == FRODOCKGRID or program == FRODOCK or
-                program == FRODOCKCLUSTER or program == SOAP):
-            path = cls.getVar(PROTEIN_DOCKING_HOME)
-            if os.path.exists(path):
-                binary = os.path.join(path, 'bin', program)
-        elif program == ZDOCK:
-            path = cls.getVar(ZDOCK_DOCKING_HOME)
-            if os.path.exists(path):
-                binary = os.path.join(path, program)
-        elif program == ZRANK:
-            path = cls.getVar(ZRANK_DOCKING_HOME)
-            if os.path.exists(path):
-                binary = os.path.join(path, program)
+        """ Return the program binary that will be used. Raise
+        ToolNotFoundError if it is not installed. """
+        return cls.getToolRegistry().getTool(program)
 
-        return binary
+    @classmethod
+    def getToolRegistry(cls):
+        """ Return the registry of the docking tools of this process. """
+        if cls._toolRegistry is None:
+            cls._toolRegistry = ToolRegistry(cls.getVar)
+        return cls._toolRegistry
 
     @classmethod
-    def runProgram(cls, program, args):
-        #runJob(None, program, args, env=cls.getEnviron())
-        cmd = '%s %s' % (program, args)
-        print("** Running command: %s" % greenStr(cmd), flush=True)
-        os.system(cmd)
+    def validateTools(cls, programs):
+        """ Return the errors of the programs that are not installed. """
+        return cls.getToolRegistry().validate(programs)
+
+    @classmethod
+    def getFrodockVersion(cls):
+        """ Return the installed frodock3 package name, e.g. frodock3-3.12 """
+        return os.path.basename(cls.getVar(PROTEIN_DOCKING_HOME))
 
+    @classmethod
+    def getMapCache(cls):
+        """ Return the potential maps cache shared across runs. """
+        path = cls.getVar(FRODOCK_MAPS_CACHE)
+        os.makedirs(path, exist_ok=True)
+        maxSize = float(cls.getVar(FRODOCK_MAPS_CACHE_SIZE)) * 1024 ** 3
+        return MapCache(path, maxSize)
+
+    @classmethod
+    def runProgram(cls, program, args, numberOfThreads=None, cwd=None,
+                   outputFile=None):
+        """ Run program with the list of arguments args and return its
+        wall/cpu time, peak memory and io usage, which are also added to
+        the profile of the running step. The program stdout is written to
+        outputFile when given. """
+        cmd = ' '.join([program] + [str(arg) for arg in args])
+        print("** Running command: %s" % greenStr(cmd), flush=True)
+        stats = runCommand(program, args, env=cls.getEnviron(numberOfThreads),
+                           cwd=cwd, outputFile=outputFile)
+        print("** %s finished: wall time %0.2f s, cpu time %0.2f s, "
+              "peak memory %0.1f MB, io %0.1f MB"
+              % (stats['program'], stats['wallTime'], stats['cpuTime'],
+                 stats['maxRss'] / 1024 ** 2,
+                 (stats['readBytes'] + stats['writeBytes']) / 1024 ** 2),
+              flush=True)
+        recordProgram(stats)
+        return stats
 
     @classmethod
     def defineBinaries(cls, env):
         # Add frodock3
-        env.addPackage('frodock3', version='3.12',
+        env.addPackage('frodock3', version=FRODOCK_VERSION,
                        tar='frodock3_linux64.tgz',
                        default=True)
         # Add zdock
-        env.addPackage('zdock', version='3.0.2',
+        env.addPackage('zdock', version=ZDOCK_VERSION,
                        tar='zdock3.0.2_linux_x64.tar.gz',
                        default=True)
         # Add zrank
         env.addPackage('zrank', version='1.0',
                        tar='zrank_linux_64bit.tar.gz',
                        default=False)
-        env.addPackage('zrank', version='2.0',
+        env.addPackage('zrank', version=ZRANK_VERSION,
                        tar='zrank2_linux.tar.gz',
                        default=True)
 
@@ -0,0 +1,162 @@
+# **************************************************************************
+# *
+# * Authors: Yunior C. Fonseca Reyna    (cfonseca@cnb.csic.es)
+# *          Erney Ramirez Aportela     (eramirez@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+
+
+class MapCache:
+    """
+    Content-addressed cache of the potential maps generated by frodockgrid.
+    Every entry is a directory named after the hash of the input pdb contents
+    and the frodockgrid arguments. Entries are shared across runs and the
+    least recently used ones are evicted when the cache exceeds its size.
+    """
+    MAP_FILE = 'map.ccp4'
+    ASA_FILE = 'ASA.pdb'
+
+    def __init__(self, path, maxSize):
+        """
+        :param path: cache root directory
+        :param maxSize: maximum size of the cache in bytes
+        """
+        self.path = path
+        self.maxSize = maxSize
+
+    @staticmethod
+    def getKey(pdbFile, args, version):
+        """ Return the hash identifying a map computed from pdbFile with the
+        given frodockgrid args (list of strings) and binary version. """
+        sha = hashlib.sha256()
+        with open(pdbFile, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                sha.update(chunk)
+        sha.update(('\0'.join([version] + [str(a) for a in args])).encode())
+        return sha.hexdigest()
+
+    def fetch(self, key, mapFile, asaFile):
+        """ Link the cached map (and the _ASA.pdb file when it does not exist
+        yet) to the given destinations. Return False on a cache miss. """
+        entryPath = os.path.join(self.path, key)
+        cachedMap = os.path.join(entryPath, self.MAP_FILE)
+        cachedAsa = os.path.join(entryPath, self.ASA_FILE)
+        try:
+            _linkFile(cachedMap, mapFile)
+            if os.path.exists(cachedAsa) and not os.path.exists(asaFile):
+                _linkFile(cachedAsa, asaFile)
+            # Entry modification time is used as the LRU access time
+            os.utime(entryPath)
+        except FileNotFoundError:  # Missing or evicted meanwhile by other run
+            return False
+        return True
+
+    def store(self, key, mapFile, asaFile=None):
+        """ Add a new entry to the cache and evict old ones if needed. """
+        entryPath = os.path.join(self.path, key)
+        if os.path.exists(entryPath):
+            return
+        # Entries are created in a temporary directory and renamed, so
+        # concurrent runs (or steps of the same run) never see an incomplete
+        # entry. Files are copied: the run files may be rewritten later on
+        os.makedirs(self.path, exist_ok=True)
+        tmpPath = tempfile.mkdtemp(prefix=key + '.tmp-', dir=self.path)
+        shutil.copyfile(mapFile, os.path.join(tmpPath, self.MAP_FILE))
+        if asaFile is not None and os.path.exists(asaFile):
+            shutil.copyfile(asaFile, os.path.join(tmpPath, self.ASA_FILE))
+        try:
+            os.rename(tmpPath, entryPath)
+        except OSError:  # Other run stored the same entry meanwhile
+            shutil.rmtree(tmpPath, ignore_errors=True)
+        self.evict()
+
+    def evict(self):
+        """ Remove the least recently used entries until the cache size is
+        below its maximum. """
+        entries = []
+        totalSize = 0
+        for entry in os.scandir(self.path):
+            if not entry.is_dir() or '.tmp-' in entry.name:
+                continue
+            try:
+                size = sum(f.stat().st_size for f in os.scandir(entry.path))
+            except FileNotFoundError:  # Evicted meanwhile by other run
+                continue
+            entries.append((entry.stat().st_mtime, size, entry.path))
+            totalSize += size
+
+        for _, size, entryPath in sorted(entries):
+            if totalSize <= self.maxSize:
+                break
+            shutil.rmtree(entryPath, ignore_errors=True)
+            totalSize -= size
+
+
+def detachFile(fileName):
+    """ Remove fileName before a program writes it again, so the new
+    contents go to a new file instead of rewriting in place the cache entry
+    it may be linked to. """
+    if os.path.lexists(fileName):
+        os.remove(fileName)
+
+
+def _linkFile(source, dest):
+    """ Hard link source to dest, so the file survives the eviction of its
+    cache entry. Fall back to a copy across filesystems. """
+    tmpDest = '%s.tmp-%d-%d' % (dest, os.getpid(), int(time.time() * 1e6))
+    try:
+        os.link(source, tmpDest)
+    except OSError:
+        shutil.copyfile(source, tmpDest)
+    os.replace(tmpDest, dest)
+
+
+def fileFingerprint(fileName, maxHashSize=64 * 1024 ** 2):
+    """ Return a fingerprint of the contents of fileName: its sha256 hash,
+    or its size and modification time for files larger than maxHashSize
+    (e.g. the docking results) to avoid reading them again. """
+    stat = os.stat(fileName)
+    if stat.st_size > maxHashSize:
+        return 'size:%d,mtime:%d' % (stat.st_size, stat.st_mtime_ns)
+    sha = hashlib.sha256()
+    with open(fileName, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def commandFingerprint(program, args, inputFiles):
+    """ Return a fingerprint of a command: the program, its arguments and
+    the contents of its input files. """
+    sha = hashlib.sha256()
+    for item in [program] + [str(a) for a in args]:
+        sha.update(item.encode() + b'\0')
+    for inputFile in inputFiles:
+        sha.update(fileFingerprint(inputFile).encode() + b'\0')
+    return sha.hexdigest()
@@ -0,0 +1,211 @@
+# **************************************************************************
+# *
+# * Authors: Yunior C. Fonseca Reyna    (cfonseca@cnb.csic.es)
+# *          Erney Ramirez Aportela     (eramirez@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+"""
+Worker of the frodock campaign protocol. Every task of a campaign docks one
+receptor-ligand pair described in the campaign manifest (JSON, written by
+ProtFrodockCampaign): it prepares the two molecules and their potential
+maps (once per molecule, shared by all the tasks), runs the docking search,
+clusters the solutions and writes the best complex and a result.json file.
+
+Tasks run outside the Scipion project, as elements of a queue job array or
+locally:
+
+    python -m proteindocking.campaign manifest.json [taskIndex]
+
+Without taskIndex the index is read from the job array environment.
+"""
+
+import fcntl
+import json
+import os
+import sys
+import traceback
+
+import numpy as np
+
+from proteindocking import Plugin
+from proteindocking.cache import MapCache, detachFile
+from proteindocking.clustering import clusterSolutions
+from proteindocking.convert import (preparePdb, iterDockingSolutions,
+                                    readAtomCoordinates, getPoseCenter,
+                                    writeComplexes)
+from proteindocking.profiling import StepProfile
+from proteindocking.storage import SolutionsFile, writeSolutionsFile
+
+RESULT_FILE = 'result.json'
+FAILED_FILE = 'failed.txt'
+PROFILE_FILE = 'profile.jsonl'
+
+# Job array index variables: (name, index of the first task)
+ARRAY_INDEX_VARIABLES = [('SLURM_ARRAY_TASK_ID', 0), ('PBS_ARRAY_INDEX', 0),
+                         ('PBS_ARRAYID', 0), ('SGE_TASK_ID', 1)]
+
+
+def getArrayTaskIndex():
+    """ Return the 0-based index of the current job array task. """
+    for variable, first in ARRAY_INDEX_VARIABLES:
+        value = os.environ.get(variable)
+        if value not in (None, '', 'undefined'):
+            return int(value) - first
+    raise RuntimeError('No job array task index found in the environment')
+
+
+def loadManifest(manifestFile):
+    with open(manifestFile) as f:
+        return json.load(f)
+
+
+def getTaskStatus(task):
+    """ Return 'done', 'failed' or None (not finished) for a task. """
+    if os.path.exists(os.path.join(task['dir'], RESULT_FILE)):
+        return 'done'
+    if os.path.exists(os.path.join(task['dir'], FAILED_FILE)):
+        return 'failed'
+    return None
+
+
+def _prepareMolecule(manifest, molecule):
+    """ Prepare the pdb and the potential maps of a molecule, unless another
+    task already did. The molecule lock serializes the tasks sharing it. """
+    os.makedirs(molecule['dir'], exist_ok=True)
+    doneFile = os.path.join(molecule['dir'], 'done')
+    with open(os.path.join(molecule['dir'], '.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if os.path.exists(doneFile):
+            return
+        _, chainMap = preparePdb(molecule['input'], molecule['pdb'],
+                                 chains=molecule['chains'],
+                                 keepHetero=molecule['keepHetero'])
+        for chain, newChain in chainMap.items():
+            print('Chain %s of %s is written as chain %s'
+                  % (chain, molecule['input'], newChain), flush=True)
+        cache = manifest['cache'] and MapCache(manifest['cache']['path'],
+                                               manifest['cache']['maxSize'])
+        for mapEntry in molecule['maps']:
+            cacheKey = None
+            if cache:
+                cacheKey = cache.getKey(molecule['pdb'], mapEntry['cacheArgs'],
+                                        manifest['version'])
+                if cache.fetch(cacheKey, mapEntry['file'], molecule['asa']):
+                    print('Reusing cached map %s' % cacheKey, flush=True)
+                    continue
+            # frodockgrid writes the _ASA.pdb file next to its input
+            pdbLink = mapEntry['pdbLink']
+            os.makedirs(os.path.dirname(pdbLink), exist_ok=True)
+            if not os.path.lexists(pdbLink):
+                os.symlink(molecule['pdb'], pdbLink)
+            # The map may be linked to a cache entry
+            detachFile(mapEntry['file'])
+            Plugin.runProgram(mapEntry['program'], mapEntry['args'],
+                              numberOfThreads=1)
+            asaFile = os.path.join(os.path.dirname(pdbLink),
+                                   os.path.basename(molecule['asa']))
+            if cache:
+                cache.store(cacheKey, mapEntry['file'], asaFile)
+            if os.path.exists(asaFile):
+                os.replace(asaFile, molecule['asa'])
+        open(doneFile, 'w').close()
+
+
+def _dockPair(manifest, task):
+    receptor = manifest['molecules'][task['receptor']]
+    ligand = manifest['molecules'][task['ligand']]
+    _prepareMolecule(manifest, receptor)
+    _prepareMolecule(manifest, ligand)
+
+    search = task['search']
+    Plugin.runProgram(search['program'], search['args'],
+                      numberOfThreads=manifest['numberOfThreads'])
+    view = task['view']
+    txtFile = os.path.join(task['dir'], 'dock.txt')
+    Plugin.runProgram(view['program'], view['args'], outputFile=txtFile)
+    dockFile = os.path.join(task['dir'], 'dock.npz')
+    numberOfSolutions = writeSolutionsFile(dockFile, iterDockingSolutions(txtFile))
+    # Only the listing is kept, the solutions are clustered in-process
+    os.remove(txtFile)
+    os.remove(os.path.join(task['dir'], 'dock.dat'))
+
+    coords = readAtomCoordinates(ligand['asa'], 'CA')
+    with SolutionsFile(dockFile) as solutionsFile:
+        clusters = clusterSolutions(solutionsFile.iterBlocks(), coords,
+                                    manifest['clusterRadius'],
+                                    manifest['numberOfClusters'],
+                                    center=getPoseCenter(ligand['asa']))
+    writeSolutionsFile(os.path.join(task['dir'], 'clust_dock.npz'), [clusters])
+
+    result = {'receptor': receptor['name'], 'ligand': ligand['name'],
+              'numberOfSolutions': numberOfSolutions,
+              'numberOfClusters': len(clusters),
+              'score': None, 'complex': None}
+    if len(clusters):
+        best = clusters[np.argsort(-clusters['score'], kind='stable')][:1]
+        result['score'] = float(best['score'][0])
+        result['complex'] = writeComplexes(receptor['asa'], ligand['asa'], best,
+                                           os.path.join(task['dir'],
+                                                        'complex_%04d.pdb'))[0]
+    return result
+
+
+def runTask(manifestFile, taskIndex):
+    """ Dock the pair of a campaign task. Finished tasks are skipped, so a
+    job array can be submitted again to complete the failed ones. """
+    manifest = loadManifest(manifestFile)
+    task = manifest['tasks'][taskIndex]
+    if getTaskStatus(task) == 'done':
+        print('Task %d already done' % taskIndex, flush=True)
+        return
+    os.makedirs(task['dir'], exist_ok=True)
+    failedFile = os.path.join(task['dir'], FAILED_FILE)
+    if os.path.exists(failedFile):
+        os.remove(failedFile)
+
+    try:
+        with StepProfile(os.path.join(task['dir'], PROFILE_FILE),
+                         'campaignTask', [taskIndex]):
+            result = _dockPair(manifest, task)
+    except Exception:
+        with open(failedFile, 'w') as f:
+            f.write(traceback.format_exc())
+        raise
+    resultFile = os.path.join(task['dir'], RESULT_FILE)
+    with open(resultFile + '.tmp', 'w') as f:
+        json.dump(result, f)
+    os.replace(resultFile + '.tmp', resultFile)
+
+
+def main(args):
+    if not 1 <= len(args) <= 2:
+        sys.stderr.write('Usage: python -m proteindocking.campaign '
+                         'manifest.json [taskIndex]\n')
+        return 2
+    taskIndex = int(args[1]) if len(args) == 2 else getArrayTaskIndex()
+    runTask(args[0], taskIndex)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
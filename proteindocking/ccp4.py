@@ -0,0 +1,149 @@
+# **************************************************************************
+# *
+# * Authors: Yunior C. Fonseca Reyna    (cfonseca@cnb.csic.es)
+# *          Erney Ramirez Aportela     (eramirez@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+"""
+Reader of CCP4/MRC maps, such as the potential maps of frodockgrid. The
+voxels are memory mapped, so slices and statistics only read the sections
+they need and whole grids are never loaded in memory.
+"""
+
+import numpy as np
+
+HEADER_SIZE = 1024
+# Voxel types of the map modes
+MODE_DTYPES = {0: np.int8, 1: np.int16, 2: np.float32, 6: np.uint16,
+               12: np.float16}
+AXES = {'x': 0, 'y': 1, 'z': 2}
+
+
+def _getByteOrder(header):
+    """ Return the byte order of a map from its machine stamp, or guess it
+    from the mode if the stamp is missing. """
+    stamp = header[212:214]
+    if stamp in (b'\x44\x41', b'\x44\x44'):
+        return '<'
+    if stamp == b'\x11\x11':
+        return '>'
+    return '<' if int.from_bytes(header[12:16], 'little') in MODE_DTYPES else '>'
+
+
+class Ccp4Map:
+    """
+    Memory mapped CCP4/MRC map. The voxels are available as an array indexed
+    (z, y, x) whatever the axis order of the file, and the statistics are
+    computed on first use, a few sections at a time.
+    """
+    def __init__(self, fileName):
+        self.fileName = fileName
+        with open(fileName, 'rb') as f:
+            header = f.read(HEADER_SIZE)
+        if len(header) < HEADER_SIZE:
+            raise ValueError('%s is not a CCP4/MRC map' % fileName)
+        byteOrder = _getByteOrder(header)
+        words = np.frombuffer(header, dtype=byteOrder + 'i4')
+        floats = np.frombuffer(header, dtype=byteOrder + 'f4')
+        mode = int(words[3])
+        if mode not in MODE_DTYPES:
+            raise ValueError('Unsupported mode %d of map %s' % (mode, fileName))
+
+        # Columns, rows and sections of the file and the x, y, z axis of each
+        nc, nr, ns = (int(n) for n in words[0:3])
+        self._axes = [int(a) - 1 for a in words[16:19]]
+        if sorted(self._axes) != [0, 1, 2]:
+            self._axes = [0, 1, 2]
+        sampling = np.maximum(words[7:10], 1)
+        self._spacing = (floats[10:13] / sampling).astype(np.float64)
+        self._start = np.zeros(3)
+        self._start[self._axes] = words[4:7]
+        self._origin = floats[49:52].astype(np.float64)
+        self._statistics = None
+
+        dtype = np.dtype(MODE_DTYPES[mode]).newbyteorder(byteOrder)
+        data = np.memmap(fileName, dtype=dtype, mode='r',
+                         offset=HEADER_SIZE + int(words[23]),
+                         shape=(ns, nr, nc))
+        # Views (no copies) of the file sections in (z, y, x) order
+        fileAxes = [self._axes[2], self._axes[1], self._axes[0]]
+        self.voxels = data.transpose([fileAxes.index(axis) for axis in (2, 1, 0)])
+
+    def getDimensions(self):
+        """ Return the number of voxels along x, y and z. """
+        return tuple(self.voxels.shape[::-1])
+
+    def getSpacing(self):
+        """ Return the voxel size (A) along x, y and z. """
+        return tuple(float(s) for s in self._spacing)
+
+    def getOrigin(self):
+        """ Return the position (A) of the first voxel: the origin of the
+        header, or the grid start if it is not set. """
+        origin = self._origin if np.any(self._origin) else self._start * self._spacing
+        return tuple(float(x) for x in origin)
+
+    def getSlice(self, axis, index):
+        """ Return a copy of the slice index perpendicular to axis ('x', 'y'
+        or 'z'), indexed (y, x), (z, x) or (z, y). """
+        index = int(index)
+        if axis == 'z':
+            return np.array(self.voxels[index])
+        if axis == 'y':
+            return np.array(self.voxels[:, index, :])
+        return np.array(self.voxels[:, :, index])
+
+    def iterSections(self, sectionsPerChunk=16):
+        """ Yield the voxels a few z sections at a time. """
+        for first in range(0, self.voxels.shape[0], sectionsPerChunk):
+            yield np.asarray(self.voxels[first:first + sectionsPerChunk],
+                             dtype=np.float64)
+
+    def getStatistics(self):
+        """ Return the minimum, maximum, mean and standard deviation of the
+        voxels. They are computed once, reading the map by chunks. """
+        if self._statistics is None:
+            count = 0
+            total = totalSquares = 0.0
+            minimum, maximum = np.inf, -np.inf
+            for chunk in self.iterSections():
+                count += chunk.size
+                total += chunk.sum()
+                totalSquares += (chunk ** 2).sum()
+                minimum = min(minimum, chunk.min())
+                maximum = max(maximum, chunk.max())
+            mean = total / max(count, 1)
+            std = np.sqrt(max(totalSquares / max(count, 1) - mean ** 2, 0.0))
+            self._statistics = (float(minimum), float(maximum), float(mean),
+                                float(std))
+        return self._statistics
+
+    def getHistogram(self, bins=100):
+        """ Return the histogram counts and bin edges of the voxel values. """
+        minimum, maximum, _, _ = self.getStatistics()
+        edges = np.linspace(minimum, maximum if maximum > minimum else minimum + 1,
+                            bins + 1)
+        counts = np.zeros(bins, dtype=np.int64)
+        for chunk in self.iterSections():
+            counts += np.histogram(chunk, edges)[0]
+        return counts, edges
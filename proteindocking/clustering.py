@@ -0,0 +1,160 @@
+# **************************************************************************
+# *
+# * Authors: Yunior C. Fonseca Reyna    (cfonseca@cnb.csic.es)
+# *          Erney Ramirez Aportela     (eramirez@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+import numpy as np
+
+from .convert import SOLUTION_DTYPE, eulerToMatrix, transformPoses
+
+
+def clusterSolutions(solutionChunks, coords, radius, maxClusters, center=None,
+                     batchSize=4096):
+    """
+    Greedy RMSD clustering of docking solutions, as done by frodockcluster:
+    solutions are visited by decreasing score and each one starts a new
+    cluster unless it is closer than radius (RMSD of the transformed coords)
+    to the representative of an existing cluster. It stops when maxClusters
+    clusters are found.
+
+    :param solutionChunks: iterable of SOLUTION_DTYPE arrays, in score order
+    :param coords: representative ligand atoms (n x 3), e.g. the CA atoms
+    :param center: ligand center the poses rotate around (see
+        convert.transformPoses), the centroid of coords by default
+    :return: the cluster representatives as a SOLUTION_DTYPE array
+    """
+    nAtoms = len(coords)
+    # The distance between the centroids of two poses is a lower bound of
+    # their RMSD, used to select the clusters worth comparing with
+    repCoords = np.empty((maxClusters, nAtoms, 3))
+    repCenters = np.empty((maxClusters, 3))
+    representatives = []
+
+    for chunk in solutionChunks:
+        chunk = chunk[np.argsort(-chunk['score'], kind='stable')]
+        for first in range(0, len(chunk), batchSize):
+            batch = chunk[first:first + batchSize]
+            poses = transformPoses(coords, batch, center)
+            centers = poses.mean(axis=1)
+
+            # Discard at once the solutions that fall in existing clusters
+            assigned = _closeToAny(poses, centers, repCoords[:len(representatives)],
+                                   repCenters[:len(representatives)], radius)
+            for i in np.flatnonzero(~assigned):
+                # Check the clusters created by previous solutions of the batch
+                n = len(representatives)
+                if n and _closeToAny(poses[i:i + 1], centers[i:i + 1],
+                                     repCoords[:n], repCenters[:n], radius)[0]:
+                    continue
+                repCoords[n] = poses[i]
+                repCenters[n] = centers[i]
+                representatives.append(batch[i])
+                if len(representatives) == maxClusters:
+                    return _toClusters(representatives)
+    return _toClusters(representatives)
+
+
+def _closeToAny(poses, centers, repCoords, repCenters, radius, maxPairs=1024):
+    """ Return a boolean array telling which poses are closer than radius
+    to any representative. """
+    close = np.zeros(len(poses), dtype=bool)
+    if not len(repCoords):
+        return close
+    centerDist2 = ((centers[:, None, :] - repCenters[None, :, :]) ** 2).sum(axis=2)
+    poseIdx, repIdx = np.nonzero(centerDist2 < radius ** 2)
+    for first in range(0, len(poseIdx), maxPairs):
+        p = poseIdx[first:first + maxPairs]
+        r = repIdx[first:first + maxPairs]
+        msd = ((poses[p] - repCoords[r]) ** 2).sum(axis=2).mean(axis=1)
+        close[p[msd < radius ** 2]] = True
+    return close
+
+
+def _toClusters(representatives):
+    """ Stack the representatives, ranked and numbered by cluster. """
+    clusters = np.array(representatives, dtype=SOLUTION_DTYPE)
+    clusters['rank'] = np.arange(1, len(clusters) + 1)
+    clusters['cluster'] = clusters['rank']
+    return clusters
+
+
+def selectRegions(solutions, maxRegions, minDistance):
+    """ Return the positions (n x 3) of the best scored solutions that are
+    at least minDistance apart, up to maxRegions of them. Used to choose the
+    neighborhoods refined after a coarse search. """
+    solutions = solutions[np.argsort(-solutions['score'], kind='stable')]
+    regions = []
+    for position in solutions['translation'].astype(np.float64):
+        if all(np.sum((position - r) ** 2) >= minDistance ** 2 for r in regions):
+            regions.append(position)
+            if len(regions) == maxRegions:
+                break
+    return np.array(regions).reshape(-1, 3)
+
+
+def filterRestrainedSolutions(solutions, siteCenter, epitope, maxDistance):
+    """ Return the solutions placing the ligand epitope closer than
+    maxDistance to the receptor site center. The epitope is given relative
+    to the ligand center, so with a zero epitope the ligand center itself is
+    restrained. """
+    rotations = eulerToMatrix(solutions['euler'])
+    positions = (rotations @ np.asarray(epitope, dtype=np.float64)
+                 + solutions['translation'])
+    distances2 = ((positions - siteCenter) ** 2).sum(axis=1)
+    return solutions[distances2 <= maxDistance ** 2]
+
+
+def filterSymmetricSolutions(solutions, center, order, angleTolerance=10.0,
+                             maxScrew=3.0):
+    """
+    Return the solutions placing the ligand, a copy of the receptor, as the
+    neighbor subunit of a Cn ring (C2 for a homodimer): the rigid motion
+    from the receptor to the ligand must be a rotation of 360/order degrees
+    (within angleTolerance degrees) with less than maxScrew (A) of
+    translation along its axis. center is the ligand rotation center, the
+    centroid of its atoms.
+    """
+    rotations = eulerToMatrix(solutions['euler'])
+    cosines = np.clip((np.trace(rotations, axis1=1, axis2=2) - 1) / 2, -1.0, 1.0)
+    angles = np.degrees(np.arccos(cosines))
+
+    # The axis u follows from u u' = (R + R' - 2 cos I) / (2 (1 - cos)), also
+    # for half turns where the antisymmetric part of R vanishes
+    outer = ((rotations + rotations.transpose(0, 2, 1)) / 2
+             - cosines[:, None, None] * np.eye(3))
+    outer /= np.maximum(1 - cosines, 1e-8)[:, None, None]
+    diagonal = np.diagonal(outer, axis1=1, axis2=2)
+    column = np.argmax(diagonal, axis=1)
+    index = np.arange(len(solutions))
+    axes = (outer[index, :, column] /
+            np.sqrt(np.maximum(diagonal[index, column], 1e-12))[:, None])
+
+    # Pose x' = R (x - center) + translation, as a motion R x + d
+    shifts = (solutions['translation'] -
+              rotations @ np.asarray(center, dtype=np.float64))
+    screws = np.abs((shifts * axes).sum(axis=1))
+    keep = ((np.abs(angles - 360.0 / order) <= angleTolerance) &
+            (screws <= maxScrew))
+    return solutions[keep]
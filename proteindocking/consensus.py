@@ -0,0 +1,122 @@
+# **************************************************************************
+# *
+# * Authors: Yunior C. Fonseca Reyna    (cfonseca@cnb.csic.es)
+# *          Erney Ramirez Aportela     (eramirez@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+import heapq
+from collections import Counter
+from itertools import count, islice, zip_longest
+
+
+class ConsensusRanker:
+    """
+    Streaming consensus ranking of the poses proposed by several docking
+    engines. Every engine provides its poses in rank order. Poses whose
+    interfaces overlap are grouped in consensus poses, which are scored by
+    reciprocal rank fusion: each engine votes with 1 / (k + rank) of its best
+    ranked pose in the group. Only maxCandidates consensus poses are kept in
+    memory, the lowest scored ones are dropped as the stream goes on.
+    Candidates are indexed by their interface residues, so a pose is only
+    compared with the candidates sharing enough residues with it.
+    """
+    def __init__(self, overlap=0.5, k=60, maxCandidates=1000):
+        """
+        :param overlap: minimum Jaccard index of two interfaces to consider
+            them the same pose
+        :param k: reciprocal rank fusion constant
+        :param maxCandidates: maximum number of consensus poses kept
+        """
+        self.overlap = overlap
+        self.k = k
+        self.maxCandidates = maxCandidates
+        self._candidates = {}
+        self._residueIndex = {}
+        self._ids = count()
+
+    def add(self, engine, rank, interface, pose):
+        """ Add the pose ranked rank by engine, with the given interface
+        (frozenset of receptor residues). """
+        vote = 1.0 / (self.k + rank)
+        candidate = self._findCandidate(interface)
+        if candidate is None:
+            candidate = {'interface': interface, 'pose': pose,
+                         'bestVote': vote, 'votes': {}}
+            self._addCandidate(candidate)
+        elif vote > candidate['bestVote']:
+            candidate['pose'] = pose
+            candidate['bestVote'] = vote
+        candidate['votes'][engine] = max(vote, candidate['votes'].get(engine, 0))
+
+        if len(self._candidates) > 2 * self.maxCandidates:
+            kept = heapq.nlargest(self.maxCandidates,
+                                  self._candidates.values(), key=_score)
+            self._candidates = {}
+            self._residueIndex = {}
+            for candidate in kept:
+                self._addCandidate(candidate)
+
+    def addStreams(self, streams, depth=None):
+        """ Consume several streams of (rank, interface, pose) in
+        round-robin, so the best ranked poses of every engine are grouped
+        first. Only the first depth poses of every stream are read. """
+        streams = [islice(stream, depth) for stream in streams]
+        for items in zip_longest(*streams):
+            for engine, item in enumerate(items):
+                if item is not None:
+                    self.add(engine, *item)
+
+    def top(self, n):
+        """ Return the n best consensus poses as (score, votes, pose). """
+        return [(_score(c), len(c['votes']), c['pose'])
+                for c in heapq.nlargest(n, self._candidates.values(), key=_score)]
+
+    def _addCandidate(self, candidate):
+        candidateId = next(self._ids)
+        self._candidates[candidateId] = candidate
+        for residue in candidate['interface']:
+            self._residueIndex.setdefault(residue, []).append(candidateId)
+
+    def _findCandidate(self, interface):
+        """ Return the consensus pose whose interface overlaps the most with
+        interface, if the overlap is above the threshold. The Jaccard index
+        is at most shared / len(interface), so only the candidates sharing
+        enough residues are compared. """
+        shared = Counter()
+        for residue in interface:
+            shared.update(self._residueIndex.get(residue, ()))
+        best, bestOverlap = None, self.overlap
+        minShared = self.overlap * len(interface)
+        for candidateId, n in sorted(shared.items()):
+            if n < minShared:
+                continue
+            candidate = self._candidates[candidateId]
+            jaccard = n / (len(interface) + len(candidate['interface']) - n)
+            if jaccard >= bestOverlap:
+                best, bestOverlap = candidate, jaccard
+        return best
+
+
+def _score(candidate):
+    return sum(candidate['votes'].values())
@@ -29,10 +29,37 @@ PROTEIN_DOCKING_HOME = 'PROTEIN_DOCKING_HOME'
 ZDOCK_DOCKING_HOME = 'PROTEIN_ZDOCK_HOME'
 ZRANK_DOCKING_HOME = 'PROTEIN_ZRANK_HOME'
 
+# Versions of the packages installed by default, which the plugin expects
+FRODOCK_VERSION = '3.12'
+ZDOCK_VERSION = '3.0.2'
+ZRANK_VERSION = '2.0'
+
 # Programs
 FRODOCKGRID = 'frodockgrid'
 ZRANK = 'zrank'
 ZDOCK = 'zdock'
+MARK_SUR = 'mark_sur'
+CREATE_PL = 'create.pl'
+CREATE_LIG = 'create_lig'
+BLOCK_PL = 'block.pl'
+UNICHARMM = 'uniCHARMM'
 FRODOCK = 'frodock_gcc'
+FRODOCK_MPI = 'frodock_mpi_gcc'
 FRODOCKCLUSTER = 'frodockcluster'
+FRODOCKVIEW = 'frodockview'
 SOAP = 'soap.bin'
+
+# Potential maps generated by frodockgrid: (output suffix, -m value)
+RECEPTOR_MAPS = [('_W.ccp4', None), ('_E.ccp4', 1), ('_DS.ccp4', 3)]
+LIGAND_MAPS = [('_DS.ccp4', 3)]
+MAP_DESCRIPTIONS = {'_W.ccp4': 'vdw potential map',
+                    '_E.ccp4': 'electrostatic potential map',
+                    '_DS.ccp4': 'desolvation potential map'}
+# Name of the Volume output of every map, after the receptor or ligand
+MAP_OUTPUT_NAMES = {'_W.ccp4': 'VdwMap',
+                    '_E.ccp4': 'ElectrostaticMap',
+                    '_DS.ccp4': 'DesolvationMap'}
+
+# Potential maps cache
+FRODOCK_MAPS_CACHE = 'PROTEIN_DOCKING_MAPS_CACHE'
+FRODOCK_MAPS_CACHE_SIZE = 'PROTEIN_DOCKING_MAPS_CACHE_SIZE'  # In GB
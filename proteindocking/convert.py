@@ -0,0 +1,679 @@
+# **************************************************************************
+# *
+# * Authors: Yunior C. Fonseca Reyna    (cfonseca@cnb.csic.es)
+# *          Erney Ramirez Aportela     (eramirez@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+import gzip
+import os
+import re
+import string
+
+import numpy as np
+
+# Docking solutions as listed by frodockview: rank, euler angles (3),
+# ligand translation (3), correlation score and an optional cluster id
+SOLUTION_DTYPE = np.dtype([('rank', np.int32),
+                           ('euler', np.float32, 3),
+                           ('translation', np.float32, 3),
+                           ('score', np.float32),
+                           ('cluster', np.int32)])
+
+
+def _isDataLine(line):
+    """ Return True if the first field of line is a number. """
+    fields = line.split()
+    if not fields:
+        return False
+    try:
+        float(fields[0])
+    except ValueError:
+        return False
+    return True
+
+
+def _toSolutions(values, nCols):
+    """ Convert a flat array of values with nCols columns to the structured
+    SOLUTION_DTYPE. """
+    table = values.reshape(-1, nCols)
+    solutions = np.empty(len(table), dtype=SOLUTION_DTYPE)
+    solutions['rank'] = table[:, 0]
+    solutions['euler'] = table[:, 1:4]
+    solutions['translation'] = table[:, 4:7]
+    solutions['score'] = table[:, 7]
+    solutions['cluster'] = table[:, 8] if nCols > 8 else -1
+    return solutions
+
+
+def iterDockingSolutions(fileName, chunkSize=64 * 1024 ** 2):
+    """
+    Iterate over the solutions of a frodockview table file (dock.dat or
+    clust_dock.dat listing), yielding structured arrays of SOLUTION_DTYPE.
+    The file is parsed in blocks of about chunkSize bytes, so the memory
+    used does not depend on the file size.
+    """
+    with open(fileName) as f:
+        # Skip the header lines
+        line = f.readline()
+        while line and not _isDataLine(line):
+            line = f.readline()
+        if not line:
+            return
+        nCols = len(line.split())
+        if nCols < 8:
+            raise ValueError('Unexpected number of columns (%d) in %s'
+                             % (nCols, fileName))
+
+        lines = [line]
+        while True:
+            lines += f.readlines(chunkSize)
+            if not lines:
+                break
+            values = np.fromstring(''.join(lines), dtype=np.float64, sep=' ')
+            if values.size % nCols:
+                raise ValueError('Malformed solutions table in %s' % fileName)
+            yield _toSolutions(values, nCols)
+            lines = []
+
+
+def loadDockingSolutions(fileName):
+    """ Load all the solutions of a frodockview table file. """
+    chunks = list(iterDockingSolutions(fileName))
+    if not chunks:
+        return np.empty(0, dtype=SOLUTION_DTYPE)
+    return np.concatenate(chunks)
+
+
+def loadTopDockingSolutions(fileName, n):
+    """ Return the n best scored solutions of a frodockview table file,
+    sorted by decreasing score, keeping at most n + chunk rows in memory. """
+    top = np.empty(0, dtype=SOLUTION_DTYPE)
+    for chunk in iterDockingSolutions(fileName):
+        top = np.concatenate([top, chunk])
+        if len(top) > n:
+            top = top[np.argpartition(-top['score'], n)[:n]]
+    return top[np.argsort(-top['score'], kind='stable')]
+
+
+def eulerToMatrix(euler):
+    """ Return the rotation matrices (n x 3 x 3) of an array (n x 3) of
+    ZXZ Euler angles in radians, the convention used by frodock. """
+    euler = np.atleast_2d(euler).astype(np.float64)
+    c = np.cos(euler)
+    s = np.sin(euler)
+    c1, c2, c3 = c[:, 0], c[:, 1], c[:, 2]
+    s1, s2, s3 = s[:, 0], s[:, 1], s[:, 2]
+    matrices = np.empty((len(euler), 3, 3))
+    matrices[:, 0, 0] = c1 * c3 - c2 * s1 * s3
+    matrices[:, 0, 1] = -c1 * s3 - c2 * c3 * s1
+    matrices[:, 0, 2] = s1 * s2
+    matrices[:, 1, 0] = c3 * s1 + c1 * c2 * s3
+    matrices[:, 1, 1] = c1 * c2 * c3 - s1 * s3
+    matrices[:, 1, 2] = -c1 * s2
+    matrices[:, 2, 0] = s2 * s3
+    matrices[:, 2, 1] = c3 * s2
+    matrices[:, 2, 2] = c2
+    return matrices
+
+
+def matrixToEuler(matrices):
+    """ Return the ZXZ Euler angles (n x 3) of rotation matrices
+    (n x 3 x 3), the inverse of eulerToMatrix. """
+    matrices = np.asarray(matrices, dtype=np.float64).reshape(-1, 3, 3)
+    euler = np.empty((len(matrices), 3))
+    euler[:, 1] = np.arccos(np.clip(matrices[:, 2, 2], -1.0, 1.0))
+    euler[:, 0] = np.arctan2(matrices[:, 0, 2], -matrices[:, 1, 2])
+    euler[:, 2] = np.arctan2(matrices[:, 2, 0], matrices[:, 2, 1])
+    # With the second angle 0 or pi only the sum of the others is defined
+    gimbal = np.abs(np.sin(euler[:, 1])) < 1e-8
+    euler[gimbal, 0] = np.arctan2(matrices[gimbal, 1, 0], matrices[gimbal, 0, 0])
+    euler[gimbal, 2] = 0.0
+    return euler
+
+
+class PdbTemplate:
+    """
+    Atom records of a pdb file parsed once: the coordinates are kept as a
+    NumPy array and the rest of every record as a format string, so new
+    coordinates can be written for many poses without parsing it again.
+    """
+    def __init__(self, fileName):
+        prefixes = []
+        suffixes = []
+        coords = []
+        with open(fileName) as f:
+            for line in f:
+                if line.startswith(('ATOM', 'HETATM')):
+                    prefixes.append(line[:30])
+                    suffixes.append(line[54:].rstrip('\n'))
+                    coords.append((line[30:38], line[38:46], line[46:54]))
+        self.coords = np.array(coords, dtype=np.float64).reshape(-1, 3)
+        self._format = ''.join('%s%%8.3f%%8.3f%%8.3f%s\n'
+                               % (p.replace('%', '%%'), s.replace('%', '%%'))
+                               for p, s in zip(prefixes, suffixes))
+
+    def __len__(self):
+        return len(self.coords)
+
+    def format(self, coords):
+        """ Return the atom records with the given coordinates. """
+        return self._format % tuple(coords.ravel())
+
+
+def getPoseCenter(fileName):
+    """ Return the point the ligand of fileName is rotated around in the
+    docking poses (see transformPoses): the centroid of all its atoms. """
+    return PdbTemplate(fileName).coords.mean(axis=0)
+
+
+def transformPoses(coords, solutions, center=None):
+    """ Apply the rigid transforms of the docking solutions to coords
+    (n atoms x 3) in a single batch. The ligand is rotated around its center
+    and moved to the solution translation. When coords are only some of the
+    ligand atoms (e.g. the CA atoms), center must be the ligand center given
+    by getPoseCenter. Return an array of len(solutions) x n atoms x 3. """
+    centered = coords - (coords.mean(axis=0) if center is None else center)
+    rotations = eulerToMatrix(solutions['euler'])
+    return (np.einsum('pij,aj->pai', rotations, centered)
+            + solutions['translation'][:, None, :])
+
+
+def writeComplexes(receptorFile, ligandFile, solutions, outputPattern,
+                   batchSize=100):
+    """
+    Write a pdb file with the receptor and the transformed ligand for every
+    docking solution. The ligand pdb is parsed once and the poses are
+    transformed in batches of batchSize. outputPattern is formatted with the
+    solution rank. Return the list of written files.
+    """
+    with open(receptorFile) as f:
+        receptorLines = ''.join(line for line in f
+                                if line.startswith(('ATOM', 'HETATM')))
+    ligand = PdbTemplate(ligandFile)
+
+    outputFiles = []
+    for first in range(0, len(solutions), batchSize):
+        batch = solutions[first:first + batchSize]
+        poses = transformPoses(ligand.coords, batch)
+        for solution, pose in zip(batch, poses):
+            outputFile = outputPattern % solution['rank']
+            with open(outputFile, 'w') as f:
+                f.write(receptorLines)
+                f.write('TER\n')
+                f.write(ligand.format(pose))
+                f.write('END\n')
+            outputFiles.append(outputFile)
+    return outputFiles
+
+
+def loadZdockOutput(fileName):
+    """
+    Read a ZDOCK output file. Return its header lines (grid, initial
+    rotations and input files) and the predictions as an array of
+    SOLUTION_DTYPE: rotation angles, grid translation and score, ranked in
+    file order.
+    """
+    header = []
+    with open(fileName) as f:
+        line = f.readline()
+        # Predictions are the first lines with 7 fields
+        while line and len(line.split()) != 7:
+            header.append(line)
+            line = f.readline()
+        text = line + f.read()
+
+    table = np.fromstring(text, dtype=np.float64, sep=' ').reshape(-1, 7)
+    solutions = np.empty(len(table), dtype=SOLUTION_DTYPE)
+    solutions['rank'] = np.arange(1, len(table) + 1)
+    solutions['euler'] = table[:, 0:3]
+    solutions['translation'] = table[:, 3:6]
+    solutions['score'] = table[:, 6]
+    solutions['cluster'] = -1
+    return header, solutions
+
+
+def readZdockHeader(header):
+    """ Parse the header lines of a ZDOCK output. Return the grid size, the
+    grid spacing, whether ZDOCK switched the input receptor and ligand, and
+    the initial rotation matrices (identity if not rotated) and centers of
+    the molecules ZDOCK docked as receptor and as ligand, in header order.
+    When switched, the first one is the input ligand. """
+    fields = [line.split() for line in header if line.strip()]
+    gridSize, spacing = int(fields[0][0]), float(fields[0][1])
+    switched = len(fields[0]) > 2 and int(fields[0][2]) != 0
+    # Initial rotations (one line per rotated molecule) precede the files
+    rotations = eulerToMatrix(np.array(fields[1:-2], dtype=np.float64))
+    receptorRotation = rotations[0] if len(rotations) == 2 else np.eye(3)
+    receptorCenter = np.array(fields[-2][1:4], dtype=np.float64)
+    ligandCenter = np.array(fields[-1][1:4], dtype=np.float64)
+    return (gridSize, spacing, switched, receptorRotation, rotations[-1],
+            receptorCenter, ligandCenter)
+
+
+def zdockToPoses(header, solutions, ligandCenter):
+    """
+    Convert ZDOCK predictions to the pose convention of the plugin (see
+    transformPoses): the ligand rotated around ligandCenter, the centroid of
+    its atoms, and moved to the solution translation. As create_lig does,
+    ZDOCK rotates its ligand by its initial rotation, centers it at the
+    origin, rotates it by the prediction angles, moves it by minus the grid
+    translation (wrapped to the grid) and places it in the frame of its
+    unrotated receptor. When ZDOCK switched the input molecules, the input
+    ligand gets the inverse of that transform instead.
+    """
+    (gridSize, spacing, switched, fixedRotation, mobileRotation, fixedCenter,
+     mobileCenter) = readZdockHeader(header)
+    translations = solutions['translation'].astype(np.float64)
+    translations[translations >= gridSize / 2] -= gridSize
+    translations *= -spacing
+    predictions = eulerToMatrix(solutions['euler'])
+    if switched:
+        # The input ligand is the ZDOCK receptor
+        fixedRotation, mobileRotation = mobileRotation, fixedRotation
+        fixedCenter, mobileCenter = mobileCenter, fixedCenter
+        predictions = predictions.transpose(0, 2, 1)
+        translations = -np.einsum('pij,pj->pi', predictions, translations)
+    origin = mobileRotation @ np.asarray(ligandCenter) - mobileCenter
+    poses = solutions.copy()
+    poses['euler'] = matrixToEuler(fixedRotation.T @ predictions @ mobileRotation)
+    poses['translation'] = (predictions @ origin + translations
+                            + fixedCenter) @ fixedRotation
+    return poses
+
+
+def writeZdockOutput(fileName, header, solutions):
+    """ Write solutions in the ZDOCK output format with the given header. """
+    with open(fileName, 'w') as f:
+        f.writelines(header)
+        for row in solutions:
+            f.write('%.6f\t%.6f\t%.6f\t%d\t%d\t%d\t%.3f\n'
+                    % (tuple(row['euler']) + tuple(row['translation'])
+                       + (row['score'],)))
+
+
+def loadZrankScores(fileName):
+    """ Read a ZRANK output file (complex file and score per line). Return
+    a dict with the score of every complex file. """
+    scores = {}
+    with open(fileName) as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) >= 2:
+                scores[fields[0]] = float(fields[-1])
+    return scores
+
+
+def readCaAtoms(fileName):
+    """ Return the (chain, residue number) keys and the coordinates (n x 3)
+    of the CA atoms of a pdb file. """
+    keys = []
+    coords = []
+    with open(fileName) as f:
+        for line in f:
+            if line.startswith('ATOM') and line[12:16].strip() == 'CA':
+                keys.append((line[21].strip(), line[22:26].strip()))
+                coords.append((line[30:38], line[38:46], line[46:54]))
+    return keys, np.array(coords, dtype=np.float64).reshape(-1, 3)
+
+
+def readAtomCoordinates(fileName, atomName=None):
+    """ Return the coordinates (n x 3) of the ATOM records of a pdb file,
+    only those named atomName (e.g. CA) if given. """
+    coords = []
+    with open(fileName) as f:
+        for line in f:
+            if (line.startswith('ATOM') and
+                    (atomName is None or line[12:16].strip() == atomName)):
+                coords.append((line[30:38], line[38:46], line[46:54]))
+    return np.array(coords, dtype=np.float64).reshape(-1, 3)
+
+
+def writeDockingSolutions(fileName, solutions):
+    """ Write solutions as a frodockview-like table with a cluster column,
+    readable by iterDockingSolutions. """
+    table = np.column_stack([solutions['rank'], solutions['euler'],
+                             solutions['translation'], solutions['score'],
+                             solutions['cluster']])
+    np.savetxt(fileName, table,
+               fmt=['%d', '%.6f', '%.6f', '%.6f', '%.3f', '%.3f', '%.3f',
+                    '%.6f', '%d'],
+               header='Rank Euler1 Euler2 Euler3 PosX PosY PosZ Score Cluster')
+
+
+def parseResidues(text):
+    """ Parse a residue selection like 'A:45-50, A:72, B:10' into a set of
+    (chain, residue number) keys. The chain may be omitted ('45-50'). """
+    residues = set()
+    for item in text.replace(';', ',').split(','):
+        item = item.strip()
+        if not item:
+            continue
+        chain, _, numbers = item.rpartition(':')
+        first, _, last = numbers.partition('-')
+        for number in range(int(first), int(last or first) + 1):
+            residues.add((chain.strip(), str(number)))
+    return residues
+
+
+def readResidueCoordinates(fileName, residues):
+    """ Return the coordinates (n x 3) of the ATOM records of fileName that
+    belong to residues, a set of (chain, residue number) keys. Keys with an
+    empty chain match any chain. """
+    coords = []
+    with open(fileName) as f:
+        for line in f:
+            if line.startswith('ATOM'):
+                chain, number = line[21].strip(), line[22:26].strip()
+                if (chain, number) in residues or ('', number) in residues:
+                    coords.append((line[30:38], line[38:46], line[46:54]))
+    return np.array(coords, dtype=np.float64).reshape(-1, 3)
+
+
+def listResidues(fileName):
+    """ Return the (chain, residue number) keys of the ATOM records of
+    fileName, in file order. """
+    residues = []
+    with open(fileName) as f:
+        for line in f:
+            if line.startswith('ATOM'):
+                key = (line[21].strip(), line[22:26].strip())
+                if not residues or residues[-1] != key:
+                    residues.append(key)
+    return residues
+
+
+# Compact atom records of the structures prepared for the docking engines
+ATOM_DTYPE = np.dtype([('hetero', np.bool_),
+                       ('name', 'S4'),
+                       ('resName', 'S3'),
+                       ('chain', 'S4'),
+                       ('resSeq', np.int32),
+                       ('iCode', 'S1'),
+                       ('coords', np.float32, 3),
+                       ('occupancy', np.float32),
+                       ('bFactor', np.float32),
+                       ('element', 'S2')])
+
+# Single character ids given to the longer mmCIF chain ids
+CHAIN_IDS = string.ascii_uppercase + string.ascii_lowercase + string.digits
+
+WATER_NAMES = {'HOH', 'WAT', 'DOD', 'H2O', 'TIP', 'TIP3', 'SOL'}
+STRUCTURE_EXTENSIONS = ['.pdb', '.ent', '.cif', '.mmcif']
+
+_CIF_TOKEN_RE = re.compile(r"'[^']*'|\"[^\"]*\"|\S+")
+
+
+def getStructureName(fileName):
+    """ Return the name of a pdb or mmCIF file without its extensions
+    (compressed too) and with any other dot replaced, e.g.
+    1abc.model.cif.gz -> 1abc_model. """
+    name = os.path.basename(fileName)
+    if name.endswith('.gz'):
+        name = name[:-3]
+    base, ext = os.path.splitext(name)
+    if ext.lower() in STRUCTURE_EXTENSIONS:
+        name = base
+    return name.replace('.', '_')
+
+
+def _openText(fileName):
+    if fileName.endswith('.gz'):
+        return gzip.open(fileName, 'rt')
+    return open(fileName)
+
+
+def _isCif(fileName):
+    name = fileName[:-3] if fileName.endswith('.gz') else fileName
+    return os.path.splitext(name)[1].lower() in ('.cif', '.mmcif')
+
+
+def _iterPdbAtoms(f):
+    """ Yield the atoms of the first model of a pdb file as tuples (hetero,
+    name, altLoc, resName, chain, resSeq, iCode, x, y, z, occupancy,
+    bFactor, element). """
+    for line in f:
+        record = line[:6]
+        if record == 'ENDMDL':
+            return
+        if record != 'ATOM  ' and record != 'HETATM':
+            continue
+        name = line[12:16].strip()
+        element = line[76:78].strip() or name[:1]
+        # Occupancy and B-factor may be blank or missing in truncated lines
+        occupancy = line[54:60].strip()
+        bFactor = line[60:66].strip()
+        yield (record == 'HETATM', name, line[16:17].strip(),
+               line[17:20].strip(), line[21:22].strip(), int(line[22:26]),
+               line[26:27].strip(), float(line[30:38]), float(line[38:46]),
+               float(line[46:54]), float(occupancy) if occupancy else 1.0,
+               float(bFactor) if bFactor else 0.0, element)
+
+
+def _iterCifAtoms(f):
+    """ Yield the atoms of the first model of a mmCIF file as _iterPdbAtoms
+    does. Only the _atom_site loop is parsed, one atom per line. """
+    columns = []
+    inAtomSite = False
+    firstModel = None
+    for line in f:
+        if line.startswith('_atom_site.'):
+            columns.append(line.split('.', 1)[1].strip())
+            inAtomSite = True
+            continue
+        if not inAtomSite or not columns:
+            continue
+        if line.startswith(('_', 'loop_', '#', 'data_')):
+            return
+        values = [v[1:-1] if v[0] in '\'"' else v
+                  for v in _CIF_TOKEN_RE.findall(line)]
+        if len(values) != len(columns):
+            continue
+        row = dict(zip(columns, values))
+        model = row.get('pdbx_PDB_model_num', '1')
+        if firstModel is None:
+            firstModel = model
+        elif model != firstModel:
+            return
+
+        def get(*keys, default=''):
+            for key in keys:
+                value = row.get(key)
+                if value is not None and value not in ('.', '?'):
+                    return value
+            return default
+
+        name = get('auth_atom_id', 'label_atom_id')
+        yield (row.get('group_PDB') == 'HETATM', name,
+               get('label_alt_id'), get('auth_comp_id', 'label_comp_id'),
+               get('auth_asym_id', 'label_asym_id'),
+               int(get('auth_seq_id', 'label_seq_id', default='0')),
+               get('pdbx_PDB_ins_code'),
+               float(row['Cartn_x']), float(row['Cartn_y']),
+               float(row['Cartn_z']), float(get('occupancy', default='1')),
+               float(get('B_iso_or_equiv', default='0')),
+               get('type_symbol', default=name[:1]))
+
+
+def _selectAltLocs(atoms):
+    """ Yield the atoms (as yielded by _iterPdbAtoms) keeping, for every atom
+    name of a residue, only its alternate location of highest occupancy (the
+    first one on ties). Atoms are buffered one residue at a time. """
+    residue = None
+    selected = {}
+    for index, atom in enumerate(atoms):
+        if atom[4:7] != residue:
+            yield from selected.values()
+            residue = atom[4:7]
+            selected = {}
+        # Atoms without alternate locations are all kept
+        key = atom[1] if atom[2] else index
+        kept = selected.get(key)
+        if kept is None or atom[10] > kept[10]:
+            selected[key] = atom
+    yield from selected.values()
+
+
+def iterAtomRecords(fileName, chains=None, keepHetero=False, chunkSize=65536):
+    """
+    Iterate over the atoms of the first model of a pdb or mmCIF file (may be
+    gzipped), read line by line and yielded in arrays of ATOM_DTYPE of at
+    most chunkSize atoms. Waters are always discarded, hetero atoms unless
+    keepHetero, and only the most occupied alternate location of every atom
+    is kept. If chains is given, only the atoms of those chains are kept.
+    """
+    chains = set(chains) if chains else None
+    rows = []
+    with _openText(fileName) as f:
+        atoms = _iterCifAtoms(f) if _isCif(fileName) else _iterPdbAtoms(f)
+        for atom in _selectAltLocs(atoms):
+            hetero, resName, chain = atom[0], atom[3], atom[4]
+            if resName in WATER_NAMES or (hetero and not keepHetero):
+                continue
+            if chains is not None and chain not in chains:
+                continue
+            rows.append((hetero, atom[1], resName, chain, atom[5], atom[6],
+                         atom[7:10], atom[10], atom[11], atom[12]))
+            if len(rows) == chunkSize:
+                yield np.array(rows, dtype=ATOM_DTYPE)
+                rows = []
+    if rows:
+        yield np.array(rows, dtype=ATOM_DTYPE)
+
+
+def _formatAtomName(name, element):
+    """ Align an atom name as in the pdb format: names shorter than four
+    characters of one letter elements start at the second column. """
+    if len(name) < 4 and len(element) == 1:
+        return ' %-3s' % name
+    return '%-4s' % name
+
+
+def writePdbAtoms(fileName, chunks, chainMap=None):
+    """ Write atom records (iterable of ATOM_DTYPE arrays) as a minimal pdb
+    file, renumbering the atoms and closing every chain with TER. Chains
+    are renamed as given by chainMap. Return the number of atoms written. """
+    chainMap = chainMap or {}
+    serial = 0
+    lastChain = None
+    with open(fileName, 'w') as f:
+        for atoms in chunks:
+            for atom in atoms:
+                chain = atom['chain'].decode()
+                chain = chainMap.get(chain, chain) or ' '
+                if lastChain is not None and chain != lastChain:
+                    f.write('TER\n')
+                lastChain = chain
+                serial += 1
+                element = atom['element'].decode()
+                x, y, z = atom['coords']
+                f.write('%-6s%5d %s %3s %1s%4d%1s   %8.3f%8.3f%8.3f%6.2f%6.2f'
+                        '          %2s\n'
+                        % ('HETATM' if atom['hetero'] else 'ATOM',
+                           serial % 100000,
+                           _formatAtomName(atom['name'].decode(), element),
+                           atom['resName'].decode(), chain,
+                           atom['resSeq'] % 10000, atom['iCode'].decode(),
+                           x, y, z, atom['occupancy'], atom['bFactor'], element))
+        f.write('TER\nEND\n')
+    return serial
+
+
+def listChains(chunks):
+    """ Return the chain ids of atom records (iterable of ATOM_DTYPE
+    arrays), in file order. """
+    chains = {}
+    for atoms in chunks:
+        ids, first = np.unique(atoms['chain'], return_index=True)
+        for chain in ids[np.argsort(first)]:
+            chains.setdefault(chain.decode(), None)
+    return list(chains)
+
+
+def getChainMap(chains):
+    """ Return the new ids of the chains that do not fit in the pdb format:
+    every id longer than one character is given the first id of CHAIN_IDS
+    not used by any other chain. Raise ValueError if there are not enough
+    free ids. """
+    free = [chain for chain in CHAIN_IDS if chain not in chains]
+    longChains = [chain for chain in chains if len(chain) > 1]
+    if len(longChains) > len(free):
+        raise ValueError('%d chain ids are longer than one character and only '
+                         '%d single character ids are free. Please select '
+                         'fewer chains.' % (len(longChains), len(free)))
+    return dict(zip(longChains, free))
+
+
+def preparePdb(inputFile, outputFile, chains=None, keepHetero=False):
+    """ Write the atoms of a pdb or mmCIF file that the docking engines need
+    (see iterAtomRecords) as a minimal pdb. mmCIF chain ids longer than one
+    character are renamed (see getChainMap). Return the number of atoms and
+    the map from the renamed chain ids to the new ones. """
+    chainMap = {}
+    if _isCif(inputFile):
+        chainMap = getChainMap(listChains(iterAtomRecords(inputFile, chains,
+                                                          keepHetero)))
+    numberOfAtoms = writePdbAtoms(outputFile, iterAtomRecords(inputFile, chains,
+                                                              keepHetero),
+                                  chainMap)
+    return numberOfAtoms, chainMap
+
+
+def parseChains(text):
+    """ Parse a comma separated list of chain ids. """
+    return [chain.strip() for chain in text.split(',') if chain.strip()]
+
+
+def getBoundingRadius(chunks):
+    """ Return the center and the radius of the sphere centered at the
+    centroid that contains all the atoms (iterable of ATOM_DTYPE arrays). """
+    coords = np.concatenate([atoms['coords'] for atoms in chunks]
+                            or [np.zeros((1, 3), dtype=np.float32)])
+    center = coords.mean(axis=0)
+    return center, float(np.sqrt(((coords - center) ** 2).sum(axis=1).max()))
+
+
+def _nextFftSize(n):
+    """ Return the smallest even number >= n whose only prime factors are 2,
+    3 and 5. """
+    n = max(2, int(np.ceil(n)))
+    while True:
+        if n % 2 == 0:
+            m = n
+            for p in (2, 3, 5):
+                while m % p == 0:
+                    m //= p
+            if m == 1:
+                return n
+        n += 1
+
+
+def getGridSize(extent, spacing, maxSize=256):
+    """ Return the number of voxels per side and the spacing of a cubic grid
+    covering extent (A). The size is rounded up to an FFT friendly number
+    and, if it exceeds maxSize, the spacing is increased instead. """
+    size = _nextFftSize(extent / spacing)
+    if size > maxSize:
+        spacing = np.ceil(extent / maxSize * 20) / 20.0
+        size = _nextFftSize(extent / spacing)
+    return size, float(spacing)
@@ -0,0 +1,322 @@
+# **************************************************************************
+# *
+# * Authors: Yunior C. Fonseca Reyna    (cfonseca@cnb.csic.es)
+# *          Erney Ramirez Aportela     (eramirez@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+"""
+Interface analysis of docked poses. The receptor and ligand atoms are read
+once, the receptor atoms and its solvent exposed surface are indexed in
+cell lists, and the contacts, clashes, interface residues and buried
+surface area of many ligand poses are computed in batches of NumPy
+operations.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .convert import (eulerToMatrix, iterAtomRecords, getPoseCenter, readCaAtoms,
+                      transformPoses)
+
+# Van der Waals radii (A) by element, used for the surface area
+ATOM_RADII = {'H': 1.1, 'C': 1.7, 'N': 1.55, 'O': 1.52, 'S': 1.8, 'P': 1.8,
+              'SE': 1.9}
+DEFAULT_RADIUS = 1.8
+PROBE_RADIUS = 1.4
+
+INTERFACE_DTYPE = np.dtype([('contacts', np.int32),
+                            ('clashes', np.int32),
+                            ('receptorResidues', np.int32),
+                            ('ligandResidues', np.int32),
+                            ('buriedArea', np.float32)])
+
+_NEIGHBOR_OFFSETS = np.array([(i, j, k) for i in (-1, 0, 1)
+                              for j in (-1, 0, 1) for k in (-1, 0, 1)])
+
+
+class CellList:
+    """
+    Spatial index of fixed points (e.g. the receptor atoms) in cubic cells
+    of cellSize. The points closer than cellSize to a query point are in its
+    cell or in the 26 neighbor ones, so many points are queried without
+    comparing all the pairs.
+    """
+    def __init__(self, coords, cellSize):
+        self.coords = np.asarray(coords, dtype=np.float64).reshape(-1, 3)
+        self.cellSize = float(cellSize)
+        self.origin = (self.coords.min(axis=0) if len(self.coords)
+                       else np.zeros(3))
+        cells = ((self.coords - self.origin) // self.cellSize).astype(np.int64)
+        self.shape = cells.max(axis=0) + 1 if len(cells) else np.ones(3, np.int64)
+        ids = np.ravel_multi_index(cells.T, self.shape)
+        # Points sorted by cell: the points of cell i are
+        # order[start[i]:start[i + 1]]
+        self.order = np.argsort(ids, kind='stable')
+        counts = np.bincount(ids, minlength=int(np.prod(self.shape)))
+        self.start = np.concatenate([[0], np.cumsum(counts)])
+
+    def query(self, points, cutoff):
+        """ Return the pairs of query points and indexed points closer than
+        cutoff (not larger than the cell size) as three arrays: query point
+        indexes, indexed point indexes and squared distances. """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        cells = np.floor((points - self.origin) / self.cellSize).astype(np.int64)
+        # Points more than a cell away from the index have no neighbors
+        near = np.all((cells >= -1) & (cells <= self.shape), axis=1)
+        queryIds = np.flatnonzero(near)
+        cells = cells[near]
+
+        pairs = []
+        for offset in _NEIGHBOR_OFFSETS:
+            neighbors = cells + offset
+            inside = np.all((neighbors >= 0) & (neighbors < self.shape), axis=1)
+            ids = np.ravel_multi_index(neighbors[inside].T, self.shape)
+            first = self.start[ids]
+            counts = self.start[ids + 1] - first
+            total = counts.sum()
+            if not total:
+                continue
+            # One candidate pair per point of every neighbor cell
+            ends = np.cumsum(counts)
+            within = np.arange(total) - np.repeat(ends - counts, counts)
+            q = np.repeat(queryIds[inside], counts)
+            p = self.order[np.repeat(first, counts) + within]
+            d2 = ((points[q] - self.coords[p]) ** 2).sum(axis=1)
+            close = d2 < cutoff ** 2
+            pairs.append((q[close], p[close], d2[close]))
+        if not pairs:
+            return (np.empty(0, np.int64), np.empty(0, np.int64),
+                    np.empty(0))
+        return tuple(np.concatenate(arrays) for arrays in zip(*pairs))
+
+
+def _spherePoints(n):
+    """ Return n points evenly spread on the unit sphere (golden spiral). """
+    i = np.arange(n) + 0.5
+    polar = np.arccos(1 - 2 * i / n)
+    azimuth = np.pi * (1 + 5 ** 0.5) * i
+    return np.column_stack([np.cos(azimuth) * np.sin(polar),
+                            np.sin(azimuth) * np.sin(polar), np.cos(polar)])
+
+
+def getAtomRadii(atoms):
+    """ Return the van der Waals radii of atoms (ATOM_DTYPE), from their
+    element or the first letter of their name. """
+    radii = np.full(len(atoms), DEFAULT_RADIUS)
+    for i, (element, name) in enumerate(zip(atoms['element'], atoms['name'])):
+        element = element.decode().strip().upper()
+        if element not in ATOM_RADII:
+            element = name.decode().strip()[:1].upper()
+        radii[i] = ATOM_RADII.get(element, DEFAULT_RADIUS)
+    return radii
+
+
+def getSurfacePoints(coords, radii, probe=PROBE_RADIUS, numberOfPoints=96,
+                     batchSize=2000):
+    """
+    Shrake-Rupley solvent accessible surface of a molecule: every atom
+    sphere (radius plus probe) is sampled with numberOfPoints points, and
+    the points inside the sphere of another atom are discarded. Return the
+    exposed points (m x 3), the atom of every point and the area every
+    point stands for.
+    """
+    expanded = radii + probe
+    sphere = _spherePoints(numberOfPoints)
+    index = CellList(coords, expanded.max())
+    points, owners = [], []
+    for first in range(0, len(coords), batchSize):
+        atoms = np.arange(first, min(first + batchSize, len(coords)))
+        atomPoints = (coords[atoms, None, :] +
+                      expanded[atoms, None, None] * sphere).reshape(-1, 3)
+        atomOwners = np.repeat(atoms, numberOfPoints)
+        q, a, d2 = index.query(atomPoints, expanded.max())
+        buried = (d2 < expanded[a] ** 2) & (a != atomOwners[q])
+        exposed = np.ones(len(atomPoints), dtype=bool)
+        exposed[q[buried]] = False
+        points.append(atomPoints[exposed])
+        owners.append(atomOwners[exposed])
+    owners = np.concatenate(owners) if owners else np.empty(0, np.int64)
+    areas = 4 * np.pi * expanded[owners] ** 2 / numberOfPoints
+    return (np.concatenate(points) if points else np.empty((0, 3)), owners,
+            areas)
+
+
+def _residueKeys(atoms):
+    """ Return the residue keys (chain:number) in file order and the
+    residue of every atom as an index into them. """
+    keyIds = {}
+    residues = np.array([keyIds.setdefault('%s:%d%s' % (atom['chain'].decode(),
+                                                        atom['resSeq'],
+                                                        atom['iCode'].decode()),
+                                           len(keyIds))
+                         for atom in atoms], dtype=np.int64)
+    return list(keyIds), residues
+
+
+class InterfaceAnalyzer:
+    """
+    Contacts and buried surface of many poses of a ligand against a
+    receptor. Poses follow the plugin convention (see transformPoses): the
+    ligand is rotated around the centroid of its atoms and moved to the
+    solution translation.
+    """
+    def __init__(self, receptorFile, ligandFile, contactCutoff=5.0,
+                 clashCutoff=3.0, probe=PROBE_RADIUS):
+        receptor = np.concatenate(list(iterAtomRecords(receptorFile,
+                                                       keepHetero=True)))
+        ligand = np.concatenate(list(iterAtomRecords(ligandFile,
+                                                     keepHetero=True)))
+        self.contactCutoff = contactCutoff
+        self.clashCutoff = clashCutoff
+
+        self.receptorCoords = receptor['coords'].astype(np.float64)
+        self.receptorKeys, self.receptorResidues = _residueKeys(receptor)
+        receptorRadii = getAtomRadii(receptor)
+        self.receptorExpanded = receptorRadii + probe
+        ligandCoords = ligand['coords'].astype(np.float64)
+        self.ligandCoords = ligandCoords - ligandCoords.mean(axis=0)
+        self.ligandKeys, self.ligandResidues = _residueKeys(ligand)
+        ligandRadii = getAtomRadii(ligand)
+        self.ligandExpanded = ligandRadii + probe
+
+        # The surface of each partner is computed once, in its own frame;
+        # docking only buries part of it
+        self.receptorSurface, _, self.receptorAreas = \
+            getSurfacePoints(self.receptorCoords, receptorRadii, probe)
+        self.ligandSurface, _, self.ligandAreas = \
+            getSurfacePoints(self.ligandCoords, ligandRadii, probe)
+        self.atomIndex = CellList(self.receptorCoords,
+                                  max(contactCutoff, self.receptorExpanded.max()))
+        self.surfaceIndex = CellList(self.receptorSurface,
+                                     self.ligandExpanded.max())
+
+    def analyze(self, solutions, numberOfThreads=1, maxPoints=200000):
+        """
+        Return the interface of every solution as an array of
+        INTERFACE_DTYPE and the lists of receptor and ligand interface
+        residue keys of every solution. Solutions are analyzed in batches of
+        at most maxPoints ligand atoms and surface points, the batches in
+        parallel threads (NumPy releases the GIL in the heavy operations).
+        """
+        pointsPerPose = len(self.ligandCoords) + len(self.ligandSurface)
+        batchSize = max(1, maxPoints // max(1, pointsPerPose))
+        batches = [solutions[first:first + batchSize]
+                   for first in range(0, len(solutions), batchSize)]
+        with ThreadPoolExecutor(max(1, numberOfThreads)) as executor:
+            results = list(executor.map(self._analyzeBatch, batches))
+
+        interface = np.zeros(len(solutions), dtype=INTERFACE_DTYPE)
+        receptorResidues, ligandResidues = [], []
+        first = 0
+        for batchInterface, batchReceptor, batchLigand in results:
+            interface[first:first + len(batchInterface)] = batchInterface
+            receptorResidues.extend(batchReceptor)
+            ligandResidues.extend(batchLigand)
+            first += len(batchInterface)
+        return interface, receptorResidues, ligandResidues
+
+    def _transform(self, coords, solutions):
+        rotations = eulerToMatrix(solutions['euler'])
+        return (np.einsum('pij,aj->pai', rotations, coords)
+                + solutions['translation'][:, None, :]).reshape(-1, 3)
+
+    def _analyzeBatch(self, solutions):
+        n = len(solutions)
+        interface = np.zeros(n, dtype=INTERFACE_DTYPE)
+        nLigand = len(self.ligandCoords)
+
+        # Atom contacts and clashes, and the residues in contact
+        ligandAtoms = self._transform(self.ligandCoords, solutions)
+        q, p, d2 = self.atomIndex.query(ligandAtoms, self.contactCutoff)
+        contact = d2 < self.contactCutoff ** 2
+        q, p, d2 = q[contact], p[contact], d2[contact]
+        poses, ligandAtomIds = np.divmod(q, nLigand)
+        interface['contacts'] = np.bincount(poses, minlength=n)
+        interface['clashes'] = np.bincount(poses[d2 < self.clashCutoff ** 2],
+                                           minlength=n)
+        receptorPairs = np.unique(poses * len(self.receptorKeys)
+                                  + self.receptorResidues[p])
+        ligandPairs = np.unique(poses * len(self.ligandKeys)
+                                + self.ligandResidues[ligandAtomIds])
+        receptorResidues = self._splitResidues(receptorPairs, self.receptorKeys, n)
+        ligandResidues = self._splitResidues(ligandPairs, self.ligandKeys, n)
+        interface['receptorResidues'] = [len(r) for r in receptorResidues]
+        interface['ligandResidues'] = [len(r) for r in ligandResidues]
+
+        # Receptor surface points inside the expanded ligand atoms
+        q, s, d2 = self.surfaceIndex.query(ligandAtoms, self.ligandExpanded.max())
+        poses, ligandAtomIds = np.divmod(q, nLigand)
+        inside = d2 < self.ligandExpanded[ligandAtomIds] ** 2
+        buried = np.unique(poses[inside] * len(self.receptorSurface) + s[inside])
+        buriedArea = np.bincount(buried // len(self.receptorSurface),
+                                 self.receptorAreas[buried % len(self.receptorSurface)],
+                                 minlength=n)
+
+        # Ligand surface points inside the expanded receptor atoms
+        nSurface = len(self.ligandSurface)
+        if nSurface:
+            ligandPoints = self._transform(self.ligandSurface, solutions)
+            q, p, d2 = self.atomIndex.query(ligandPoints,
+                                            self.receptorExpanded.max())
+            buried = np.unique(q[d2 < self.receptorExpanded[p] ** 2])
+            buriedArea += np.bincount(buried // nSurface,
+                                      self.ligandAreas[buried % nSurface],
+                                      minlength=n)
+        interface['buriedArea'] = buriedArea
+        return interface, receptorResidues, ligandResidues
+
+    def _splitResidues(self, pairs, keys, n):
+        """ Return the residue keys of every pose from the sorted
+        pose * len(keys) + residue pairs. """
+        poses, residues = np.divmod(pairs, len(keys))
+        bounds = np.searchsorted(poses, np.arange(n + 1))
+        return [[keys[r] for r in residues[bounds[i]:bounds[i + 1]]]
+                for i in range(n)]
+
+
+class InterfaceResidues:
+    """
+    Receptor residues at the interface of many ligand poses, computed from
+    the CA atoms without writing the complexes: a receptor residue belongs
+    to the interface if its CA is closer than cutoff to a ligand CA.
+    """
+    def __init__(self, receptorFile, ligandFile, cutoff=10.0):
+        self.cutoff = cutoff
+        self.receptorKeys, receptorCoords = readCaAtoms(receptorFile)
+        _, self.ligandCoords = readCaAtoms(ligandFile)
+        self.center = getPoseCenter(ligandFile)
+        self.cells = CellList(receptorCoords, cutoff)
+
+    def getInterfaces(self, solutions):
+        """ Return the interface of every solution as a frozenset of receptor
+        (chain, residue number) keys. """
+        poses = transformPoses(self.ligandCoords, solutions, self.center)
+        q, p, _ = self.cells.query(poses.reshape(-1, 3), self.cutoff)
+        pairs = np.unique(q // max(1, len(self.ligandCoords))
+                          * len(self.receptorKeys) + p)
+        poseIds, residueIds = np.divmod(pairs, max(1, len(self.receptorKeys)))
+        bounds = np.searchsorted(poseIds, np.arange(len(solutions) + 1))
+        return [frozenset(self.receptorKeys[r]
+                          for r in residueIds[bounds[i]:bounds[i + 1]])
+                for i in range(len(solutions))]
@@ -0,0 +1,158 @@
+# **************************************************************************
+# *
+# * Authors: Yunior C. Fonseca Reyna    (cfonseca@cnb.csic.es)
+# *          Erney Ramirez Aportela     (eramirez@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+import numpy as np
+
+import pyworkflow.object as pwobj
+from pwem.objects import EMObject, EMSet
+
+from .convert import SOLUTION_DTYPE
+from .storage import SolutionsFile
+
+
+class DockingSolution(EMObject):
+    """ Rigid body placement of the ligand found by a docking search.
+    Solutions of several ligands docked in one run carry the id and the file
+    of their ligand. """
+    def __init__(self, **kwargs):
+        EMObject.__init__(self, **kwargs)
+        self._rank = pwobj.Integer(kwargs.get('rank', None))
+        self._euler1 = pwobj.Float()
+        self._euler2 = pwobj.Float()
+        self._euler3 = pwobj.Float()
+        self._posX = pwobj.Float()
+        self._posY = pwobj.Float()
+        self._posZ = pwobj.Float()
+        self._score = pwobj.Float(kwargs.get('score', None))
+        self._cluster = pwobj.Integer(kwargs.get('cluster', None))
+        self._ligandId = pwobj.Integer(kwargs.get('ligandId', None))
+        self._ligandFile = pwobj.String(kwargs.get('ligandFile', None))
+
+    def getRank(self):
+        return self._rank.get()
+
+    def setRank(self, rank):
+        self._rank.set(rank)
+
+    def getEulerAngles(self):
+        return self._euler1.get(), self._euler2.get(), self._euler3.get()
+
+    def setEulerAngles(self, euler1, euler2, euler3):
+        self._euler1.set(euler1)
+        self._euler2.set(euler2)
+        self._euler3.set(euler3)
+
+    def getTranslation(self):
+        return self._posX.get(), self._posY.get(), self._posZ.get()
+
+    def setTranslation(self, x, y, z):
+        self._posX.set(x)
+        self._posY.set(y)
+        self._posZ.set(z)
+
+    def getScore(self):
+        return self._score.get()
+
+    def setScore(self, score):
+        self._score.set(score)
+
+    def getCluster(self):
+        return self._cluster.get()
+
+    def setCluster(self, cluster):
+        self._cluster.set(cluster)
+
+    def getLigandId(self):
+        return self._ligandId.get()
+
+    def setLigandId(self, ligandId):
+        self._ligandId.set(ligandId)
+
+    def getLigandFile(self):
+        return self._ligandFile.get()
+
+    def setLigandFile(self, ligandFile):
+        self._ligandFile.set(ligandFile)
+
+
+class SetOfDockingSolutions(EMSet):
+    """ Set of docking solutions of a ligand against a receptor. The
+    solutions are referred to the receptor and ligand files used in the
+    search; sets of several ligands have no ligand file and every solution
+    refers to its own. Engines with their own pose convention (ZDOCK) also
+    provide the solutions in the plugin convention as a .npz listing. """
+    ITEM_TYPE = DockingSolution
+
+    def __init__(self, **kwargs):
+        EMSet.__init__(self, **kwargs)
+        self._receptorFile = pwobj.String()
+        self._ligandFile = pwobj.String()
+        self._posesFile = pwobj.String()
+
+    def getReceptorFile(self):
+        return self._receptorFile.get()
+
+    def setReceptorFile(self, receptorFile):
+        self._receptorFile.set(receptorFile)
+
+    def getLigandFile(self):
+        return self._ligandFile.get()
+
+    def setLigandFile(self, ligandFile):
+        self._ligandFile.set(ligandFile)
+
+    def getPosesFile(self):
+        return self._posesFile.get()
+
+    def setPosesFile(self, posesFile):
+        self._posesFile.set(posesFile)
+
+    def getPoses(self):
+        """ Return the solutions in the plugin pose convention (see
+        convert.transformPoses) as an array of SOLUTION_DTYPE. """
+        blocks = list(self.iterPoses())
+        return (np.concatenate(blocks) if blocks
+                else np.empty(0, dtype=SOLUTION_DTYPE))
+
+    def iterPoses(self, blockSize=65536):
+        """ Iterate over the solutions in the plugin pose convention, ranked
+        first, as SOLUTION_DTYPE arrays of up to blockSize solutions. """
+        if self.getPosesFile():
+            with SolutionsFile(self.getPosesFile()) as solutionsFile:
+                yield from solutionsFile.iterBlocks()
+            return
+        rows = []
+        for solution in self.iterItems(orderBy='_rank'):
+            rows.append((solution.getRank(), solution.getEulerAngles(),
+                         solution.getTranslation(), solution.getScore(),
+                         -1 if solution.getCluster() is None
+                         else solution.getCluster()))
+            if len(rows) == blockSize:
+                yield np.array(rows, dtype=SOLUTION_DTYPE)
+                rows = []
+        if rows:
+            yield np.array(rows, dtype=SOLUTION_DTYPE)
@@ -0,0 +1,190 @@
+# **************************************************************************
+# *
+# * Authors: Yunior C. Fonseca Reyna    (cfonseca@cnb.csic.es)
+# *          Erney Ramirez Aportela     (eramirez@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+import functools
+import json
+import os
+import resource
+import threading
+import time
+
+# Report of every profiled step and program run, one JSON record per line
+PROFILE_FILE = 'profile.jsonl'
+
+_local = threading.local()
+_lock = threading.Lock()
+
+
+def _threadUsage():
+    """ Return the cpu time and the bytes read and written by the calling
+    thread (the whole process where per-thread accounting is missing). """
+    who = getattr(resource, 'RUSAGE_THREAD', resource.RUSAGE_SELF)
+    usage = resource.getrusage(who)
+    stats = {'cpuTime': usage.ru_utime + usage.ru_stime,
+             'readBytes': usage.ru_inblock * 512,
+             'writeBytes': usage.ru_oublock * 512}
+    try:
+        with open('/proc/thread-self/io') as f:
+            io = dict(line.split(':') for line in f)
+        stats['readBytes'] = int(io['read_bytes'])
+        stats['writeBytes'] = int(io['write_bytes'])
+    except (OSError, KeyError, ValueError):
+        pass
+    return stats
+
+
+def _appendRecord(reportFile, record):
+    with _lock:
+        with open(reportFile, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+
+
+class StepProfile:
+    """ Context manager recording the wall time, cpu time, peak memory and
+    io bytes of a step, and of every program it runs through
+    Plugin.runProgram, to a report file. """
+    def __init__(self, reportFile, stepName, stepArgs=()):
+        self.reportFile = reportFile
+        self.stepName = stepName
+        self.stepArgs = [str(arg) for arg in stepArgs]
+
+    def __enter__(self):
+        self._start = time.time()
+        self._startUsage = _threadUsage()
+        self._parent = getattr(_local, 'profile', None)
+        _local.profile = self
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        _local.profile = self._parent
+        usage = _threadUsage()
+        record = {'type': 'step', 'step': self.stepName, 'args': self.stepArgs,
+                  'start': self._start, 'wallTime': time.time() - self._start,
+                  # Peak memory of the whole protocol process
+                  'maxRss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+                  'failed': excType is not None}
+        for key, value in usage.items():
+            record[key] = value - self._startUsage[key]
+        _appendRecord(self.reportFile, record)
+        return False
+
+    def addProgram(self, stats):
+        record = {'type': 'program', 'step': self.stepName, 'args': self.stepArgs}
+        record.update(stats)
+        _appendRecord(self.reportFile, record)
+
+
+class ProgramProfile:
+    """ Context manager recording, like Plugin.runProgram does, a program
+    run by other means, e.g. through mpirun by the protocol runJob. The
+    usage is taken from the child processes waited for meanwhile, so it
+    includes the programs of concurrent steps that end in the same time, and
+    the peak memory is the largest of any child so far. """
+    def __init__(self, program):
+        self.program = os.path.basename(program)
+
+    def __enter__(self):
+        self._start = time.time()
+        self._startUsage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        if excType is None:
+            usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+            start = self._startUsage
+            recordProgram({'program': self.program,
+                           'wallTime': time.time() - self._start,
+                           'cpuTime': (usage.ru_utime + usage.ru_stime -
+                                       start.ru_utime - start.ru_stime),
+                           'maxRss': usage.ru_maxrss * 1024,
+                           'readBytes': (usage.ru_inblock - start.ru_inblock) * 512,
+                           'writeBytes': (usage.ru_oublock - start.ru_oublock) * 512})
+        return False
+
+
+def recordProgram(stats):
+    """ Add the stats of a program run to the report of the current step,
+    if it is profiled. """
+    profile = getattr(_local, 'profile', None)
+    if profile is not None:
+        profile.addProgram(stats)
+
+
+def profileStep(func):
+    """ Decorator of protocol step methods writing their profile to the
+    protocol extra directory. """
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        with StepProfile(self._getExtraPath(PROFILE_FILE), func.__name__, args):
+            return func(self, *args, **kwargs)
+    return wrapper
+
+
+def loadProfile(reportFile):
+    """ Return the records of a profile report. """
+    if not os.path.exists(reportFile):
+        return []
+    with open(reportFile) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def summarizeProfile(reportFile):
+    """ Return the summary of a profile report: one line per profiled step
+    method, with the totals of its runs and of the programs they ran. """
+    steps = {}
+    for record in loadProfile(reportFile):
+        stats = steps.setdefault(record['step'],
+                                 {'runs': 0, 'wallTime': 0.0, 'cpuTime': 0.0,
+                                  'maxRss': 0, 'programs': 0,
+                                  'programCpuTime': 0.0, 'programMaxRss': 0,
+                                  'ioBytes': 0})
+        stats['ioBytes'] += record['readBytes'] + record['writeBytes']
+        if record['type'] == 'step':
+            stats['runs'] += 1
+            stats['wallTime'] += record['wallTime']
+            stats['cpuTime'] += record['cpuTime']
+            stats['maxRss'] = max(stats['maxRss'], record['maxRss'])
+        else:
+            stats['programs'] += 1
+            stats['programCpuTime'] += record['cpuTime']
+            stats['programMaxRss'] = max(stats['programMaxRss'], record['maxRss'])
+
+    if not steps:
+        return []
+    lines = ['Profile (%s):' % os.path.basename(reportFile)]
+    for stepName, stats in steps.items():
+        line = ('%s (%d runs): wall time %0.1f s, python cpu time %0.1f s, '
+                'peak memory %0.0f MB' % (stepName, stats['runs'],
+                                          stats['wallTime'], stats['cpuTime'],
+                                          stats['maxRss'] / 1024 ** 2))
+        if stats['programs']:
+            line += (', %d programs: cpu time %0.1f s, peak memory %0.0f MB'
+                     % (stats['programs'], stats['programCpuTime'],
+                        stats['programMaxRss'] / 1024 ** 2))
+        line += ', io %0.1f MB' % (stats['ioBytes'] / 1024 ** 2)
+        lines.append(line)
+    return lines
@@ -25,6 +25,29 @@
 # *
 # **************************************************************************
 
-from .protocol_frodock import ProtFrodockProtein
-from .protocol_zdock import ProtZdockProtein
-from .protocol_zrank import ProtZrankProtein
+import importlib
+
+# Protocol classes and the modules defining them. The modules are imported
+# the first time one of their classes is requested.
+_PROTOCOLS = {'ProtFrodockProtein': 'protocol_frodock',
+              'ProtZdockProtein': 'protocol_zdock',
+              'ProtZrankProtein': 'protocol_zrank',
+              'ProtFrodockBatch': 'protocol_frodock_batch',
+              'ProtDockingConsensus': 'protocol_consensus',
+              'ProtFrodockCampaign': 'protocol_frodock_campaign',
+              'ProtDockingInterface': 'protocol_interface'}
+
+__all__ = list(_PROTOCOLS)
+
+
+def __getattr__(name):
+    if name not in _PROTOCOLS:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    module = importlib.import_module('.' + _PROTOCOLS[name], __name__)
+    protocol = getattr(module, name)
+    globals()[name] = protocol
+    return protocol
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_PROTOCOLS))
@@ -0,0 +1,195 @@
+# **************************************************************************
+# *
+# * Authors: Yunior C. Fonseca Reyna    (cfonseca@cnb.csic.es)
+# *
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+import os
+
+import numpy as np
+
+from pwem.objects import AtomStruct, SetOfAtomStructs
+from pwem.protocols import EMProtocol
+from pyworkflow.object import Float, Integer
+from pyworkflow.protocol import (MultiPointerParam, IntParam, FloatParam,
+                                 LEVEL_ADVANCED)
+import pyworkflow.utils as pwutils
+
+from proteindocking.consensus import ConsensusRanker
+from proteindocking.convert import SOLUTION_DTYPE, readCaAtoms, writeComplexes
+from proteindocking.interface import InterfaceResidues
+from proteindocking.profiling import PROFILE_FILE, profileStep, summarizeProfile
+
+
+class ProtDockingConsensus(EMProtocol):
+    """
+    Protocol to build a consensus ranking of the solutions produced by the
+    FRODOCK, ZDOCK and ZRANK protocols. Solutions with overlapping
+    interfaces are grouped and ranked by reciprocal rank fusion, so poses
+    supported by several engines come first. Interfaces are computed from
+    the solution transforms and only the complexes of the best consensus
+    poses are written.
+    """
+    _label = 'docking consensus'
+
+    def _defineParams(self, form):
+        form.addSection(label='Input')
+        form.addParam('inputSolutions', MultiPointerParam,
+                      pointerClass='SetOfDockingSolutions',
+                      label="Docking solutions", important=True,
+                      help='Ranked solutions of the FRODOCK, ZDOCK or ZRANK '
+                           'protocols')
+        form.addParam('topK', IntParam, default=100,
+                      label="Number of output complexes",
+                      help='Number of best consensus complexes kept')
+        form.addParam('depth', IntParam, default=0,
+                      label="Solutions read per input",
+                      help='Only the best ranked solutions of every input '
+                           'are considered. Use 0 to read all of them.')
+        form.addParam('overlap', FloatParam, default=0.5,
+                      expertLevel=LEVEL_ADVANCED,
+                      label="Interface overlap",
+                      help='Minimum fraction of shared interface residues '
+                           '(Jaccard index) of two poses to consider them '
+                           'the same pose')
+        form.addParam('interfaceCutoff', FloatParam, default=10.0,
+                      expertLevel=LEVEL_ADVANCED,
+                      label="Interface cutoff (A)",
+                      help='Receptor residues with a CA closer than this '
+                           'distance to a ligand CA belong to the interface')
+        form.addParam('rrfK', IntParam, default=60,
+                      expertLevel=LEVEL_ADVANCED,
+                      label="Rank fusion constant",
+                      help='Every engine votes a pose with 1 / (k + rank)')
+
+    def _insertAllSteps(self):
+        self._insertFunctionStep(self.consensusStep)
+        self._insertFunctionStep(self.createOutputStep)
+
+    @profileStep
+    def consensusStep(self):
+        print(pwutils.yellowStr('Computing the consensus ranking'), flush=True)
+        topK = self.topK.get()
+        ranker = ConsensusRanker(overlap=self.overlap.get(), k=self.rrfK.get(),
+                                 maxCandidates=max(10 * topK, 1000))
+        depth = self.depth.get() or None
+        ranker.addStreams([self._iterSolutions(index, pointer.get())
+                           for index, pointer in enumerate(self.inputSolutions)],
+                          depth=depth)
+
+        with open(self._getConsensusPath(), 'w') as f:
+            f.write('# Rank\tInput\tInputRank\tScore\tVotes'
+                    '\tEuler1\tEuler2\tEuler3\tX\tY\tZ\n')
+            for rank, (score, votes, (index, row)) in enumerate(ranker.top(topK), 1):
+                f.write('%d\t%d\t%d\t%.6f\t%d\t%s\n'
+                        % (rank, index, row['rank'], score, votes,
+                           '\t'.join('%.6f' % value for value in
+                                     np.concatenate([row['euler'],
+                                                     row['translation']]))))
+
+    @profileStep
+    def createOutputStep(self):
+        table = np.loadtxt(self._getConsensusPath(), ndmin=2)
+        complexesDir = self._getExtraPath('complexes')
+        pwutils.cleanPath(complexesDir)
+        pwutils.makePath(complexesDir)
+        # Only the complexes of the best consensus poses are written, each
+        # one with the receptor and ligand files of its input
+        inputSets = [pointer.get() for pointer in self.inputSolutions]
+        complexFiles = {}
+        for index in np.unique(table[:, 1]).astype(int):
+            rows = table[table[:, 1] == index]
+            solutions = np.zeros(len(rows), dtype=SOLUTION_DTYPE)
+            solutions['rank'] = rows[:, 0]
+            solutions['euler'] = rows[:, 5:8]
+            solutions['translation'] = rows[:, 8:11]
+            files = writeComplexes(inputSets[index].getReceptorFile(),
+                                   inputSets[index].getLigandFile(), solutions,
+                                   os.path.join(complexesDir, 'complex_%04d.pdb'))
+            complexFiles.update(zip(solutions['rank'], files))
+
+        outputSet = SetOfAtomStructs.create(self._getPath(), prefix='complexes')
+        for row in table:
+            atomStruct = AtomStruct(filename=complexFiles[int(row[0])])
+            atomStruct._consensusScore = Float(float(row[3]))
+            atomStruct._consensusVotes = Integer(int(row[4]))
+            outputSet.append(atomStruct)
+        self._defineOutputs(outputComplexes=outputSet)
+        for pointer in self.inputSolutions:
+            self._defineSourceRelation(pointer, outputSet)
+
+    # --------------------------- INFO functions -----------------------------
+
+    def _summary(self):
+        return summarizeProfile(self._getExtraPath(PROFILE_FILE))
+
+    def _validate(self):
+        errors = []
+        reference = None
+        for index, pointer in enumerate(self.inputSolutions, 1):
+            solutionsSet = pointer.get()
+            if not solutionsSet.getLigandFile():
+                errors.append('The solutions of input %d belong to several '
+                              'ligands. Please, select the solutions of a '
+                              'single ligand.' % index)
+                continue
+            structures = self._readStructures(solutionsSet)
+            if reference is None:
+                reference = index, structures
+            elif not all(self._isSameStructure(a, b)
+                         for a, b in zip(structures, reference[1])):
+                errors.append('The solutions of input %d dock another receptor '
+                              'or ligand than those of input %d. Please, '
+                              'select solutions of the same structures.'
+                              % (index, reference[0]))
+        return errors
+
+    # -----------------------Utils functions-------------------------------
+
+    def _readStructures(self, solutionsSet):
+        """ Return the CA atoms of the receptor and the ligand of a set of
+        solutions, as read by readCaAtoms. """
+        return [readCaAtoms(solutionsSet.getReceptorFile()),
+                readCaAtoms(solutionsSet.getLigandFile())]
+
+    def _isSameStructure(self, caAtoms, otherCaAtoms):
+        """ Every engine prepares its own copy of the input structures, so
+        the copies are compared by the residues and the positions of their
+        CA atoms. """
+        (keys, coords), (otherKeys, otherCoords) = caAtoms, otherCaAtoms
+        return keys == otherKeys and np.allclose(coords, otherCoords, atol=1e-3)
+
+    def _getConsensusPath(self):
+        return self._getExtraPath('consensus.txt')
+
+    def _iterSolutions(self, index, solutionsSet, blockSize=1000):
+        """ Stream (rank, interface, (index, solution)) of a set of ranked
+        solutions. Interfaces are computed by blocks of solutions. """
+        interfaces = InterfaceResidues(solutionsSet.getReceptorFile(),
+                                       solutionsSet.getLigandFile(),
+                                       cutoff=self.interfaceCutoff.get())
+        for block in solutionsSet.iterPoses():
+            for first in range(0, len(block), blockSize):
+                poses = block[first:first + blockSize]
+                for row, interface in zip(poses, interfaces.getInterfaces(poses)):
+                    yield int(row['rank']), interface, (index, row)
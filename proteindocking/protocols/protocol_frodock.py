@@ -24,16 +24,58 @@
 # *  e-mail address 'scipion@cnb.csic.es'
 # *
 # **************************************************************************
+import fcntl
 import os
-import shutil
+import zlib
 
-from proteindocking.constants import FRODOCKGRID, FRODOCK, FRODOCKCLUSTER, SOAP
+import numpy as np
+
+from proteindocking.constants import (FRODOCKGRID, FRODOCK, FRODOCK_MPI,
+                                      FRODOCKCLUSTER, FRODOCKVIEW, SOAP,
+                                      RECEPTOR_MAPS, LIGAND_MAPS, MAP_DESCRIPTIONS,
+                                      MAP_OUTPUT_NAMES)
+from proteindocking.ccp4 import Ccp4Map
+from proteindocking.cache import commandFingerprint, detachFile
+from proteindocking.clustering import (clusterSolutions, selectRegions,
+                                       filterRestrainedSolutions,
+                                       filterSymmetricSolutions)
+from proteindocking.convert import (SOLUTION_DTYPE, iterDockingSolutions,
+                                    readAtomCoordinates, parseResidues,
+                                    parseChains, preparePdb, getStructureName,
+                                    iterAtomRecords, getBoundingRadius, getGridSize,
+                                    readResidueCoordinates, writeComplexes,
+                                    getPoseCenter)
+from proteindocking.objects import DockingSolution, SetOfDockingSolutions
+from proteindocking.storage import SolutionsFile, writeSolutionsFile
+from proteindocking.profiling import (PROFILE_FILE, ProgramProfile, profileStep,
+                                      summarizeProfile)
+from pwem.objects import AtomStruct, SetOfAtomStructs, Volume, Transform
 from pwem.protocols import EMProtocol
-from pyworkflow.protocol import PointerParam, EnumParam
+from pyworkflow.protocol import (PointerParam, EnumParam, BooleanParam, IntParam,
+                                 FloatParam, StringParam, LEVEL_ADVANCED,
+                                 STEPS_PARALLEL)
 
 from proteindocking import Plugin
 import pyworkflow.utils as pwutils
 
+# Grid modes
+GRID_AUTO = 0
+GRID_MANUAL = 1
+# Distance (A) added around the molecules covered by the automatic grids
+GRID_PADDING = 8.0
+MAX_GRID_SIZE = 256
+
+# Clustering modes
+CLUSTERING_FRODOCK = 0
+CLUSTERING_IN_PROCESS = 1
+
+# Search modes
+SEARCH_EXHAUSTIVE = 0
+SEARCH_COARSE_TO_FINE = 1
+
+# Best solutions of every refinement clustered by the pipelined mode
+PIPELINE_POOL_SIZE = 20000
+
 
 class ProtFrodockProtein(EMProtocol):
     """
@@ -46,8 +88,40 @@ class ProtFrodockProtein(EMProtocol):
                       pointerClass='AtomStruct',
                       label="Receptor pdb", important=True,
                       help='The receptor pdb')
+        form.addParam('symmetric', BooleanParam, default=False,
+                      label="Homo-oligomer?",
+                      help='Dock the receptor against a copy of itself to '
+                           'build a homodimer or a Cn ring. The potential '
+                           'maps are computed once and only the solutions '
+                           'related to the receptor by the Cn symmetry are '
+                           'refined, clustered and written. It requires the '
+                           'in-process clustering, which filters the '
+                           'solutions before clustering them.\n'
+                           'frodock cannot restrict its rotational search to '
+                           'the symmetric rotations, whose axis is unknown, so '
+                           'the search still samples every rotation and takes '
+                           'as long as the docking of two different '
+                           'molecules.')
+        form.addParam('symmetryOrder', IntParam, default=2,
+                      condition='symmetric',
+                      label="Symmetry order (Cn)",
+                      help='Number of subunits of the ring, 2 for a '
+                           'homodimer. The ligand must be rotated 360/n '
+                           'degrees around an axis to reach the receptor '
+                           'position.')
+        form.addParam('symmetryTolerance', FloatParam, default=10.0,
+                      condition='symmetric', expertLevel=LEVEL_ADVANCED,
+                      label="Symmetry angle tolerance (deg)",
+                      help='Maximum difference between the rotation of a '
+                           'solution and the 360/n degrees of the symmetry')
+        form.addParam('symmetryScrew', FloatParam, default=3.0,
+                      condition='symmetric', expertLevel=LEVEL_ADVANCED,
+                      label="Symmetry axis tolerance (A)",
+                      help='Maximum translation of a solution along its '
+                           'rotation axis. A Cn ring closes only if the '
+                           'ligand is a pure rotation of the receptor.')
         form.addParam('inputPdbLigand', PointerParam,
-                      pointerClass='AtomStruct',
+                      pointerClass='AtomStruct', condition='not symmetric',
                       label="ligand pdb", important=True,
                       help='The ligand pdb')
         form.addParam('interactionType', EnumParam,
@@ -55,109 +129,931 @@ class ProtFrodockProtein(EMProtocol):
                       default=2,
                       label="Type of interaction",
                       help='Type of interaction')
+        form.addParam('searchMode', EnumParam,
+                      choices=['Exhaustive', 'Coarse-to-fine'], default=0,
+                      label="Search mode",
+                      help='Exhaustive: a single search with the default '
+                           'rotational sampling.\n'
+                           'Coarse-to-fine: a first search with a coarse '
+                           'rotational sampling (lower bandwidth) and then a '
+                           'fine search restricted around the positions of the '
+                           'best coarse solutions. The refined solutions are '
+                           'merged and clustered in-process.')
+        form.addParam('coarseBandwidth', IntParam, default=16,
+                      condition='searchMode == 1',
+                      label="Coarse bandwidth",
+                      help='Spherical harmonics bandwidth of the coarse '
+                           'rotational search (frodock --bw)')
+        form.addParam('numberOfRegions', IntParam, default=20,
+                      condition='searchMode == 1',
+                      label="Number of refined regions",
+                      help='Number of best coarse solution positions whose '
+                           'neighborhood is searched with the fine sampling. '
+                           'The refinements run in parallel.')
+        form.addParam('refinementRadius', FloatParam, default=8.0,
+                      condition='searchMode == 1',
+                      label="Refinement radius (A)",
+                      help='Radius of the translational search around every '
+                           'refined position (frodock --rd)')
+        form.addParam('pipelined', BooleanParam, default=False,
+                      condition='searchMode == 1',
+                      label="Pipelined clustering?",
+                      help='Cluster the refined solutions as soon as every '
+                           'refinement finishes, while the others are still '
+                           'running, and write the complexes of the top '
+                           'clusters that did not change between two updates '
+                           'to extra/early_complexes. The first good models '
+                           'are available before the search ends. The final '
+                           'outputs are the same and reuse the early '
+                           'complexes.')
+        form.addParam('clusteringMode', EnumParam,
+                      choices=['frodockcluster', 'In-process'], default=0,
+                      label="Clustering",
+                      help='Cluster the docking solutions with frodockcluster '
+                           'or with the plugin in-process implementation. The '
+                           'in-process clustering keeps the listing of all the '
+                           'solutions, so re-clustering with other parameters '
+                           'does not need to read the frodock results again.')
+        form.addParam('numberOfClusters', IntParam, default=100,
+                      label="Number of clusters",
+                      help='Number of solution clusters (frodockcluster --nc)')
+        form.addParam('clusterRadius', FloatParam, default=5.0,
+                      label="Cluster radius (A)",
+                      help='Solutions closer than this RMSD belong to the '
+                           'same cluster (frodockcluster -d)')
+        form.addParam('clusterAtoms', EnumParam,
+                      choices=['CA atoms', 'Centroid'], default=0,
+                      condition='clusteringMode == 1',
+                      label="Ligand atoms for RMSD",
+                      help='Ligand atoms used to compute the RMSD between '
+                           'solutions. The centroid only compares the ligand '
+                           'positions and is the fastest.')
+        form.addParam('numberOfPoses', IntParam, default=10,
+                      label="Number of output complexes",
+                      help='Number of best scored solutions written as '
+                           'receptor-ligand complexes')
+        form.addParam('gridMode', EnumParam,
+                      choices=['Auto', 'Manual'], default=GRID_AUTO,
+                      expertLevel=LEVEL_ADVANCED,
+                      label="Map grid",
+                      help='Auto: the grid of every potential map is sized '
+                           'from the bounding radius of the molecule (plus '
+                           'the ligand radius for the receptor maps), so '
+                           'small proteins get small maps and large proteins '
+                           'keep the grid spacing.\n'
+                           'Manual: use the given grid size and spacing.')
+        form.addParam('gridSpacing', FloatParam, default=1.0,
+                      expertLevel=LEVEL_ADVANCED,
+                      label="Grid spacing (A)",
+                      help='Spacing of the map grids. In auto mode it is '
+                           'increased for molecules too large for a %d '
+                           'voxels grid.' % MAX_GRID_SIZE)
+        form.addParam('gridSize', IntParam, default=128,
+                      condition='gridMode == %d' % GRID_MANUAL,
+                      expertLevel=LEVEL_ADVANCED,
+                      label="Grid size (voxels)",
+                      help='Number of voxels per side of the map grids')
+        form.addParam('useMapCache', BooleanParam, default=True,
+                      expertLevel=LEVEL_ADVANCED,
+                      label="Reuse cached potential maps?",
+                      help='Potential maps are cached across runs, indexed by '
+                           'the contents of the input pdb and the frodockgrid '
+                           'parameters. If the same map was already computed '
+                           'it is reused instead of being generated again.')
+        form.addSection(label='Preprocessing')
+        form.addParam('receptorChains', StringParam, default='',
+                      label="Receptor chains",
+                      help='Chains of the receptor to dock, separated by '
+                           'commas, e.g. A, B. Leave empty to keep all of '
+                           'them.')
+        form.addParam('ligandChains', StringParam, default='',
+                      condition='not symmetric',
+                      label="Ligand chains",
+                      help='Chains of the ligand to dock, separated by '
+                           'commas. Leave empty to keep all of them.')
+        form.addParam('keepHetero', BooleanParam, default=False,
+                      label="Keep hetero atoms?",
+                      help='Waters and alternate locations (but the most '
+                           'occupied one) are always removed before docking. Hetero '
+                           'atoms (ligands, ions...) are removed too unless '
+                           'this option is set. Smaller structures make the '
+                           'map generation and the docking search faster.')
+        form.addSection(label='Restraints')
+        form.addParam('receptorResidues', StringParam, default='',
+                      label="Receptor interface residues",
+                      help='Known receptor residues at the interface, e.g. '
+                           'A:45-50, A:72. The search is restricted to place '
+                           'the ligand around them and solutions violating '
+                           'the restraint are discarded. Leave empty for an '
+                           'unrestricted search.')
+        form.addParam('ligandResidues', StringParam, default='',
+                      label="Ligand interface residues",
+                      help='Known ligand residues at the interface, e.g. '
+                           'H:100-110. Only used together with the receptor '
+                           'interface residues.')
+        form.addParam('restraintMargin', FloatParam, default=5.0,
+                      expertLevel=LEVEL_ADVANCED,
+                      label="Restraint margin (A)",
+                      help='Distance added to the extent of the interface '
+                           'residues when restricting the search')
         form.addParallelSection(threads=4, mpi=1)
 
+    def __init__(self, **kwargs):
+        EMProtocol.__init__(self, **kwargs)
+        self.stepsExecutionMode = STEPS_PARALLEL
+
     def _insertAllSteps(self):
-        self._insertFunctionStep(self.mapGenerationStep)
-        self._insertFunctionStep(self.dockingSearchStep)
-        self._insertFunctionStep(self.clusteringStep)
-        self._insertFunctionStep(self.createOutputStep)
+        # The four potential maps are independent, so they are inserted as
+        # parallel steps and the docking search waits for all of them
+        mapStepIds = self._insertMapSteps('receptor', RECEPTOR_MAPS)
+        # A symmetric ligand is the receptor itself, so it shares its maps
+        if not self.symmetric:
+            mapStepIds += self._insertMapSteps('ligand', LIGAND_MAPS)
+        clustStepId = self._insertDockingSteps('ligand', mapStepIds)
+        self._insertFunctionStep(self.createOutputStep,
+                                 prerequisites=[clustStepId])
+
+    def _insertMapSteps(self, pdbKey, maps):
+        """ Insert the steps preparing pdbKey and generating its potential
+        maps. """
+        chainsParam = (self.receptorChains if pdbKey == 'receptor'
+                       else self.ligandChains)
+        prepareStepId = self._insertFunctionStep(self.preparePdbStep, pdbKey,
+                                                 chainsParam.get() or '',
+                                                 self.keepHetero.get(),
+                                                 prerequisites=[])
+        interactionDict = ['E', 'A', None]
+        stepIds = []
+        for outputSuffix, mValue in maps:
+            tValue = None
+            if mValue == 1:
+                tValue = interactionDict[self.interactionType.get()]
+            stepIds.append(self._insertFunctionStep(self.mapGenerationStep, pdbKey,
+                                                    outputSuffix, mValue, tValue,
+                                                    self.gridMode.get(),
+                                                    self.gridSize.get(),
+                                                    self.gridSpacing.get(),
+                                                    prerequisites=[prepareStepId]))
+        return stepIds
+
+    def _insertDockingSteps(self, ligandKey, prerequisites):
+        """ Insert the search and clustering steps of a ligand. The clustering
+        parameters are step arguments, so continuing the protocol after
+        changing them only repeats the clustering. The restraint parameters
+        change the search and the filtered solutions, so they are arguments
+        of both, and the symmetry ones of the steps filtering solutions. """
+        restraintParams = self._getRestraintParams()
+        symmetryParams = self._getSymmetryParams()
+        if self.searchMode.get() == SEARCH_COARSE_TO_FINE:
+            numberOfRegions = self.numberOfRegions.get()
+            coarseStepId = self._insertFunctionStep(self.coarseSearchStep, ligandKey,
+                                                    self.coarseBandwidth.get(),
+                                                    numberOfRegions,
+                                                    self.refinementRadius.get(),
+                                                    restraintParams, symmetryParams,
+                                                    prerequisites=prerequisites)
+            refineStepIds = [self._insertFunctionStep(self.refineSearchStep,
+                                                      ligandKey, region,
+                                                      self.refinementRadius.get(),
+                                                      prerequisites=[coarseStepId])
+                             for region in range(numberOfRegions)]
+            searchStepId = self._insertFunctionStep(self.mergeSearchStep, ligandKey,
+                                                    numberOfRegions,
+                                                    prerequisites=refineStepIds)
+        else:
+            # frodockcluster reads the binary results, otherwise only their
+            # listing is kept
+            keepResults = self.clusteringMode.get() == CLUSTERING_FRODOCK
+            searchStepId = self._insertFunctionStep(self.dockingSearchStep, ligandKey,
+                                                    keepResults, restraintParams,
+                                                    prerequisites=prerequisites)
+        return self._insertFunctionStep(self.clusteringStep, ligandKey,
+                                        self.clusteringMode.get(),
+                                        self.numberOfClusters.get(),
+                                        self.clusterRadius.get(),
+                                        self.clusterAtoms.get(),
+                                        restraintParams, symmetryParams,
+                                        prerequisites=[searchStepId])
 
-    def mapGenerationStep(self):
+    @profileStep
+    def preparePdbStep(self, pdbKey, chains, keepHetero):
+        """ Write the atoms of the receptor or ligand that are docked (no
+        waters, alternate locations, hetero atoms or unselected chains) as a
+        minimal pdb, which is also the input of mmCIF structures. """
+        print(pwutils.yellowStr('Preparing the %s structure' % pdbKey), flush=True)
+        inputPath = self._getInputPdbPath(pdbKey)
+        numberOfAtoms, chainMap = preparePdb(inputPath, self._getPdbPath(pdbKey),
+                                             chains=parseChains(chains),
+                                             keepHetero=keepHetero)
+        if not numberOfAtoms:
+            raise ValueError('No atoms left in %s after removing waters, '
+                             'hetero atoms and unselected chains' % inputPath)
+        for chain, newChain in chainMap.items():
+            print('Chain %s of %s is written as chain %s' % (chain, inputPath,
+                                                              newChain),
+                  flush=True)
+        print('%d atoms kept from %s' % (numberOfAtoms, inputPath), flush=True)
+
+    @profileStep
+    def mapGenerationStep(self, pdbKey, outputSuffix, mValue, tValue=None,
+                          gridMode=GRID_AUTO, gridSize=128, gridSpacing=1.0):
         """
         All necessary potential maps must be pre-computed using FRODOCKGRID.
         Although vdw and electrostatics maps could be computed on the fly
         during the docking search, it is recommendable to create the maps
         beforehand in order to visualize them and check that they are consistent
         with the original structure. The precomputation of desolvation potential
-        maps for receptor and ligand is always required
+        maps for receptor and ligand is always required.
+        Each map is generated by its own step so they can run concurrently.
         """
-        receptorPdbPath = os.path.abspath(self.inputPdbReceptor.get().getFileName())
-        ligandPdbPath = os.path.abspath(self.inputPdbLigand.get().getFileName())
-        interactionDict = ['E', 'A', None]
-        interactionType = interactionDict[self.interactionType.get()]
-        program = self._getProgram(FRODOCKGRID)
-
-        # Creation of receptor vdw potential map
-        print(pwutils.yellowStr('Creation of receptor vdw potential map'), flush=True)
-        program, args = self.getFrodockGridCommand(program=program,
-                                                   pdbFile=receptorPdbPath,
-                                                   outputSuffix='_W.ccp4')
-        Plugin.runProgram(program, args)
-
-        # Creation of the receptor electrostatic potential map
-        print(pwutils.yellowStr('Creation of the receptor electrostatic potential map'),
+        print(pwutils.yellowStr('Creation of the %s %s'
+                                % (pdbKey, MAP_DESCRIPTIONS[outputSuffix])),
               flush=True)
-        program, args = self.getFrodockGridCommand(program=program,
-                                                   pdbFile=receptorPdbPath,
-                                                   outputSuffix='_E.ccp4',
-                                                   mValue=1,
-                                                   tValue=interactionType)
 
-        Plugin.runProgram(program, args)
+        # frodockgrid writes the _ASA.pdb file next to its input, so every
+        # map is computed from a private link to the input pdb to avoid
+        # concurrent steps writing the same file
+        pdbPath = self._getPdbPath(pdbKey)
+        workingDir = self._getTmpPath(pdbKey + os.path.splitext(outputSuffix)[0])
+        pwutils.makePath(workingDir)
+        pdbLink = os.path.join(workingDir, os.path.basename(pdbPath))
+        pwutils.createLink(pdbPath, pdbLink)
 
-        # Creation of the receptor desolvation potential map
-        print(pwutils.yellowStr('Creation of the receptor desolvation potential map'), flush=True)
-        program, args = self.getFrodockGridCommand(program=program,
-                                                   pdbFile=receptorPdbPath,
-                                                   outputSuffix='_DS.ccp4',
-                                                   mValue=3)
+        outputDir = self._getOutputDir(pdbKey)
+        asaFileName = getStructureName(pdbPath) + '_ASA.pdb'
+        asaFilePath = os.path.join(workingDir, asaFileName)
+        mapFilePath = os.path.join(outputDir, getStructureName(pdbPath) + outputSuffix)
 
-        Plugin.runProgram(program, args)
+        if gridMode == GRID_AUTO:
+            gridSize, gridSpacing = self._getAutoGrid(pdbKey, gridSpacing)
+        print('Map grid: %d voxels per side, %0.2f A spacing'
+              % (gridSize, gridSpacing), flush=True)
+        program, args = self.getFrodockGridCommand(program=self._getProgram(FRODOCKGRID),
+                                                   pdbFile=pdbLink,
+                                                   outputDir=outputDir,
+                                                   outputSuffix=outputSuffix,
+                                                   mValue=mValue,
+                                                   tValue=tValue,
+                                                   gridSize=gridSize,
+                                                   gridSpacing=gridSpacing)
+        stepKey = pdbKey + os.path.splitext(outputSuffix)[0]
+        fingerprint = commandFingerprint(program, args, [pdbPath])
+        if self._isUpToDate(stepKey, fingerprint,
+                            [mapFilePath, os.path.join(outputDir, asaFileName)]):
+            return
 
-        # Creation of the ligand desolvation potential map
-        print(pwutils.yellowStr('Creation of the ligand desolvation potential map'),
-              flush=True)
-        program, args = self.getFrodockGridCommand(program=program,
-                                                   pdbFile=ligandPdbPath,
-                                                   outputSuffix='_DS.ccp4',
-                                                   mValue=3)
-
-        Plugin.runProgram(program, args)
-        
-        # Moving receptorPdb and ligandPdb files
-        receptorPdbPath = os.path.abspath(self.inputPdbReceptor.get().getFileName().split('.')[0]+'_ASA.pdb')
-        shutil.move(receptorPdbPath, self._getExtraPath())
-        ligandPdbPath = os.path.abspath(self.inputPdbLigand.get().getFileName().split('.')[0]+'_ASA.pdb')
-        shutil.move(ligandPdbPath, self._getExtraPath())
-
-    def dockingSearchStep(self):
+        if self.useMapCache:
+            cache = Plugin.getMapCache()
+            cacheKey = cache.getKey(pdbPath, [mValue, tValue, gridSize, gridSpacing],
+                                    Plugin.getFrodockVersion())
+            if cache.fetch(cacheKey, mapFilePath,
+                           os.path.join(outputDir, asaFileName)):
+                print('Reusing cached map %s' % cacheKey, flush=True)
+                self._storeFingerprint(stepKey, fingerprint)
+                return
+
+        # The map may be linked to a cache entry
+        detachFile(mapFilePath)
+        # Maps are generated concurrently, one thread each
+        Plugin.runProgram(program, args, numberOfThreads=1)
+
+        if self.useMapCache:
+            cache.store(cacheKey, mapFilePath, asaFilePath)
+
+        # Moving the receptor or ligand _ASA.pdb file
+        if os.path.exists(asaFilePath):
+            os.replace(asaFilePath, os.path.join(outputDir, asaFileName))
+        self._storeFingerprint(stepKey, fingerprint)
+
+    @profileStep
+    def dockingSearchStep(self, ligandKey='ligand', keepResults=True,
+                          restraintParams=()):
         """Executing docking step"""
         print(pwutils.yellowStr('Executing docking search step'), flush=True)
+        outputFilePath = os.path.join(self._getOutputDir(ligandKey), 'dock.dat')
+        self._runSearch(ligandKey, outputFilePath, ligandKey + '_search',
+                        extraArgs=self._getRestraintArgs(ligandKey),
+                        listResults=not keepResults)
+
+    @profileStep
+    def coarseSearchStep(self, ligandKey, coarseBandwidth, numberOfRegions,
+                         refinementRadius, restraintParams=(), symmetryParams=()):
+        """ Search with a coarse rotational sampling and select the regions
+        to refine around the best solutions. """
+        print(pwutils.yellowStr('Executing coarse docking search step'), flush=True)
+        ligandDir = self._getOutputDir(ligandKey)
+        # Early complexes of previous runs may come from other inputs
+        pwutils.cleanPath(self._getEarlyComplexesDir(ligandKey))
+        coarseFilePath = os.path.join(ligandDir, 'dock_coarse.dat')
+        self._runSearch(ligandKey, coarseFilePath, ligandKey + '_coarse',
+                        extraArgs=(['--bw', coarseBandwidth] +
+                                   self._getRestraintArgs(ligandKey)),
+                        listResults=True)
+
+        solutions = self._loadSolutions(self._getListingPath(coarseFilePath))
+        solutionsFilter = self._getSolutionsFilter(ligandKey)
+        if solutionsFilter is not None:
+            solutions = solutionsFilter(solutions)
+        regions = selectRegions(solutions, numberOfRegions, refinementRadius)
+        regionsFilePath = os.path.join(ligandDir, 'regions.txt')
+        self._cleanRefinements(ligandKey, regions, regionsFilePath)
+        np.savetxt(regionsFilePath, regions, fmt='%.3f')
+
+    @profileStep
+    def refineSearchStep(self, ligandKey, region, refinementRadius):
+        """ Search with the default (fine) sampling around a region found by
+        the coarse search. Refinements run concurrently, one thread each, and
+        list their own solutions. """
+        ligandDir = self._getOutputDir(ligandKey)
+        regions = np.loadtxt(os.path.join(ligandDir, 'regions.txt'), ndmin=2)
+        if region >= len(regions):
+            print('The coarse search found less than %d regions' % (region + 1),
+                  flush=True)
+            return
+        print(pwutils.yellowStr('Refining docking search around region %d'
+                                % region), flush=True)
+        position = ','.join('%.3f' % x for x in regions[region])
+        refinedFilePath = self._getRefinedFilePath(ligandKey, region)
+        self._runSearch(ligandKey, refinedFilePath,
+                        '%s_refine_%02d' % (ligandKey, region),
+                        extraArgs=['-p', position, '--rd', refinementRadius],
+                        numberOfThreads=1, numberOfMpi=1, listResults=True)
+        if self.pipelined:
+            self._updatePipeline(ligandKey, len(regions))
+
+    @profileStep
+    def mergeSearchStep(self, ligandKey, numberOfRegions):
+        """ Merge the refined solutions, sorted by score, into dock.npz. """
+        print(pwutils.yellowStr('Merging refined docking solutions'), flush=True)
+        regions = np.loadtxt(os.path.join(self._getOutputDir(ligandKey),
+                                          'regions.txt'), ndmin=2)
+        chunks = []
+        for region in range(min(numberOfRegions, len(regions))):
+            listing = self._getListingPath(self._getRefinedFilePath(ligandKey, region))
+            if os.path.exists(listing):
+                chunks.append(self._loadSolutions(listing))
+        solutions = np.concatenate(chunks) if chunks else np.empty(0, dtype=SOLUTION_DTYPE)
+        solutions = solutions[np.argsort(-solutions['score'], kind='stable')]
+        solutions['rank'] = np.arange(1, len(solutions) + 1)
+        solutions['cluster'] = -1
+        writeSolutionsFile(self._getDockFilePath(ligandKey), [solutions])
+
+    def _cleanRefinements(self, ligandKey, regions, regionsFilePath):
+        """ Remove the refinements of a previous run whose region is not
+        among the new regions, so they are neither reused nor merged. """
+        previous = (np.loadtxt(regionsFilePath, ndmin=2)
+                    if os.path.exists(regionsFilePath) else np.empty((0, 3)))
+        ligandDir = self._getOutputDir(ligandKey)
+        for fileName in os.listdir(ligandDir):
+            if not fileName.startswith('dock_fine_'):
+                continue
+            region = int(os.path.splitext(fileName)[0].split('_')[-1])
+            if (region >= min(len(regions), len(previous)) or
+                    not np.allclose(regions[region], previous[region], atol=1e-3)):
+                pwutils.cleanPath(os.path.join(ligandDir, fileName))
+
+    def _runSearch(self, ligandKey, outputFilePath, stepKey, extraArgs=(),
+                   numberOfThreads=None, numberOfMpi=None, listResults=False):
+        """ Run frodock for a ligand, unless the same search already ran.
+        With listResults only the .npz listing of the results is kept. """
+        numberOfThreads = numberOfThreads or self._getSearchThreads()
+        numberOfMpi = numberOfMpi or self.numberOfMpi.get()
+        # The MPI build distributes the rotational search when mpi > 1
+        program = self._getProgram(FRODOCK_MPI if numberOfMpi > 1 else FRODOCK)
+        receptorPdbPath = self._getPdbPath('receptor')
+        ligandPdbPath = self._getPdbPath(ligandKey)
+        ligandDir = self._getOutputDir(ligandKey)
+        outputFilePath = os.path.abspath(outputFilePath)
 
-        program = self._getProgram(FRODOCK)
-        receptorPdbPath = os.path.abspath(self.inputPdbReceptor.get().getFileName())
-        ligandPdbPath = os.path.abspath(self.inputPdbLigand.get().getFileName())
-        outputFilePath = os.path.abspath(self._getExtraPath('dock.dat'))
-        
         program, args = self.getFrodockCommand(program=program,
                                                recFile=receptorPdbPath,
                                                ligFile=ligandPdbPath,
+                                               recDir=self._getOutputDir('receptor'),
+                                               ligDir=ligandDir,
+                                               numberOfThreads=numberOfThreads,
                                                outputFile=outputFilePath)
+        args += list(extraArgs)
 
-        Plugin.runProgram(program, args)
+        # The number of threads does not change the results
+        inputFiles = [arg for arg in args
+                      if arg != outputFilePath and os.path.isfile(str(arg))]
+        # Both desolvation maps are given in a single argument
+        inputFiles += args[args.index('-d') + 1].split(',')
+        threadsIndex = args.index('--th')
+        fingerprint = commandFingerprint(program,
+                                         args[:threadsIndex] + args[threadsIndex + 2:],
+                                         inputFiles)
+        outputFiles = [self._getListingPath(outputFilePath) if listResults
+                       else outputFilePath]
+        if listResults and self._isUpToDate(stepKey, fingerprint, [outputFilePath]):
+            # Results kept by a previous run for frodockcluster are only
+            # listed
+            self._listSolutions(outputFilePath, removeResults=True)
+        elif not self._isUpToDate(stepKey, fingerprint, outputFiles):
+            if numberOfMpi > 1:
+                # Scipion MPI runner, using the host mpirun configuration
+                with ProgramProfile(program):
+                    self.runJob(program, ' '.join(str(arg) for arg in args),
+                                numberOfMpi=numberOfMpi,
+                                env=Plugin.getEnviron(numberOfThreads))
+            else:
+                Plugin.runProgram(program, args, numberOfThreads=numberOfThreads)
+            if listResults:
+                self._listSolutions(outputFilePath, removeResults=True)
+            self._storeFingerprint(stepKey, fingerprint)
 
-    def clusteringStep(self):
+    @profileStep
+    def clusteringStep(self, ligandKey='ligand', clusteringMode=CLUSTERING_FRODOCK,
+                       numberOfClusters=100, clusterRadius=5.0, clusterAtoms=0,
+                       restraintParams=(), symmetryParams=()):
         """Executing clustering step"""
         print(pwutils.yellowStr('Executing clustering step'), flush=True)
+        ligandPdbPath = self._getPdbPath(ligandKey)
+        ligandDir = self._getOutputDir(ligandKey)
+        dockFilePath = self._getDockFilePath(ligandKey)
+
+        if clusteringMode == CLUSTERING_IN_PROCESS:
+            clustFilePath = os.path.abspath(os.path.join(ligandDir, 'clust_dock.npz'))
+            program = 'in-process'
+            args = [numberOfClusters, clusterRadius, clusterAtoms]
+        else:
+            clustFilePath = os.path.abspath(os.path.join(ligandDir, 'clust_dock.dat'))
+            program, args = self.getFrodockclusterCommand(program=self._getProgram(FRODOCKCLUSTER),
+                                                          ligFile=ligandPdbPath,
+                                                          dockFile=dockFilePath,
+                                                          numberOfClusters=numberOfClusters,
+                                                          clusterRadius=clusterRadius,
+                                                          outputFile=clustFilePath)
 
-        program = self._getProgram(FRODOCKCLUSTER)
-        ligandPdbPath = os.path.abspath(self.inputPdbLigand.get().getFileName())
-        dockFilePath = os.path.abspath(self._getExtraPath('dock.dat'))
-        clustFilePath = os.path.abspath(self._getExtraPath('clust_dock.dat'))
-        
-        program, args = self.getFrodockclusterCommand(program=program,
-                                                      ligFile=ligandPdbPath,
-                                                      dockFile=dockFilePath,
-                                                      outputFile=clustFilePath)
+        # The restraint and the symmetry filter the clustered solutions
+        fingerprint = commandFingerprint(program, list(args) + list(restraintParams) +
+                                         list(symmetryParams),
+                                         [dockFilePath, ligandPdbPath])
+        if self._isUpToDate(ligandKey + '_clustering', fingerprint, [clustFilePath]):
+            return
 
-        Plugin.runProgram(program, args)
+        if clusteringMode == CLUSTERING_IN_PROCESS:
+            self._clusterInProcess(ligandKey, numberOfClusters, clusterRadius,
+                                   clusterAtoms)
+        else:
+            Plugin.runProgram(program, args,
+                              numberOfThreads=self._getSearchThreads())
+        self._storeFingerprint(ligandKey + '_clustering', fingerprint)
 
+    @profileStep
     def createOutputStep(self):
-        pass
+        solutions = self._readSolutions('ligand')
+        outputSet = self._createSolutionsSet('ligand', solutions)
+        complexesSet = self._createComplexesSet('ligand', solutions)
+        self._defineOutputs(outputSolutions=outputSet,
+                            outputComplexes=complexesSet)
+        inputPdbs = [self.inputPdbReceptor]
+        if not self.symmetric:
+            inputPdbs.append(self.inputPdbLigand)
+        for output in [outputSet, complexesSet]:
+            for inputPdb in inputPdbs:
+                self._defineSourceRelation(inputPdb, output)
+        self._defineMapOutputs('receptor', RECEPTOR_MAPS, self.inputPdbReceptor)
+        if not self.symmetric:
+            self._defineMapOutputs('ligand', LIGAND_MAPS, self.inputPdbLigand)
+
+    # --------------------------- INFO functions -----------------------------
+
+    def _summary(self):
+        summary = []
+        if self.symmetric:
+            summary.append('C%d homo-oligomer: the search sampled every '
+                           'rotation and the solutions breaking the symmetry '
+                           'were filtered out afterwards'
+                           % self.symmetryOrder.get())
+        return summary + summarizeProfile(self._getExtraPath(PROFILE_FILE))
+
+    def _validate(self):
+        errors = []
+        for param in [self.receptorResidues, self.ligandResidues]:
+            try:
+                parseResidues(param.get() or '')
+            except ValueError:
+                errors.append('Wrong residue selection: %s. Please use '
+                              'chain:first-last items separated by commas, '
+                              'e.g. A:45-50, A:72' % param.get())
+        if (self.searchMode.get() == SEARCH_COARSE_TO_FINE and
+                self.clusteringMode.get() != CLUSTERING_IN_PROCESS):
+            errors.append('The coarse-to-fine search merges the refined '
+                          'solutions in a listing that frodockcluster '
+                          'cannot read. Please use the in-process clustering.')
+        if self.symmetric and self.symmetryOrder.get() < 2:
+            errors.append('The symmetry order must be at least 2')
+        if (self.symmetric and
+                self.clusteringMode.get() != CLUSTERING_IN_PROCESS):
+            errors.append('frodockcluster keeps only the best clusters, most '
+                          'of them not symmetric. Please use the in-process '
+                          'clustering, which filters the symmetric solutions '
+                          'before clustering them.')
+        errors.extend(Plugin.validateTools(self._getRequiredPrograms()))
+        return errors
 
     # -----------------------Utils functions-------------------------------
 
+    def _getRequiredPrograms(self):
+        """ Return the frodock tools used by the current parameters. """
+        programs = [FRODOCKGRID, FRODOCKVIEW, SOAP,
+                    FRODOCK_MPI if self.numberOfMpi.get() > 1 else FRODOCK]
+        if self.clusteringMode.get() == CLUSTERING_FRODOCK:
+            programs.append(FRODOCKCLUSTER)
+        return programs
+
+    def _getSearchThreads(self):
+        """ Return the threads of a frodock search or clustering. """
+        return self.numberOfThreads.get()
+
+    def _getMoleculeKey(self, pdbKey):
+        """ Return the molecule docked as pdbKey: in symmetric mode the
+        ligand is the receptor and shares its prepared pdb and maps. """
+        if pdbKey == 'ligand' and self.symmetric:
+            return 'receptor'
+        return pdbKey
+
+    def _getInputPdbPath(self, pdbKey):
+        """ Return the absolute path of the receptor or ligand pdb. """
+        pdbKey = self._getMoleculeKey(pdbKey)
+        inputPdb = (self.inputPdbReceptor if pdbKey == 'receptor'
+                    else self.inputPdbLigand)
+        return os.path.abspath(inputPdb.get().getFileName())
+
+    def _clusterInProcess(self, ligandKey, numberOfClusters, clusterRadius,
+                          clusterAtoms):
+        """ Cluster the solutions of a ligand with the in-process greedy RMSD
+        clustering and write them to clust_dock.npz. """
+        ligandDir = self._getOutputDir(ligandKey)
+        solutionsPath = self._getDockFilePath(ligandKey)
+
+        coords, center = self._getClusterCoords(ligandKey, clusterAtoms)
+        solutionsFilter = self._getSolutionsFilter(ligandKey)
+        with SolutionsFile(solutionsPath) as solutionsFile:
+            chunks = solutionsFile.iterBlocks()
+            if solutionsFilter is not None:
+                chunks = (solutionsFilter(chunk) for chunk in chunks)
+            clusters = clusterSolutions(chunks, coords, clusterRadius,
+                                        numberOfClusters, center=center)
+        writeSolutionsFile(os.path.join(ligandDir, 'clust_dock.npz'), [clusters])
+
+    def _getClusterCoords(self, ligandKey, clusterAtoms):
+        """ Return the ligand atoms compared by the in-process clustering
+        and the ligand center the poses rotate around. """
+        ligandFile = self._getPdbOutputPath(ligandKey, '_ASA.pdb')
+        center = getPoseCenter(ligandFile)
+        if clusterAtoms == 0:
+            return readAtomCoordinates(ligandFile, 'CA'), center
+        return center.reshape(1, 3), center
+
+    def _updatePipeline(self, ligandKey, numberOfRegions):
+        """ Cluster the best solutions of the refinements finished so far and
+        write the complexes of the top clusters already found by the previous
+        update (all of them once every refinement finished). The greedy
+        clustering visits solutions by score, so its top clusters only change
+        if a pending refinement finds better solutions. Refinements call it
+        concurrently, the lock serializes the updates. """
+        earlyDir = self._getEarlyComplexesDir(ligandKey)
+        pwutils.makePath(earlyDir)
+        with open(os.path.join(earlyDir, '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            chunks = []
+            for region in range(numberOfRegions):
+                listing = self._getListingPath(self._getRefinedFilePath(ligandKey,
+                                                                        region))
+                if os.path.exists(listing):
+                    with SolutionsFile(listing) as solutionsFile:
+                        chunks.append(solutionsFile.getTop(PIPELINE_POOL_SIZE))
+            pool = np.concatenate(chunks)
+            solutionsFilter = self._getSolutionsFilter(ligandKey)
+            if solutionsFilter is not None:
+                pool = solutionsFilter(pool)
+            coords, center = self._getClusterCoords(ligandKey,
+                                                    self.clusterAtoms.get())
+            clusters = clusterSolutions([pool], coords, self.clusterRadius.get(),
+                                        self.numberOfClusters.get(), center=center)
+            top = clusters[:self.numberOfPoses.get()]
+
+            topFile = os.path.join(earlyDir, 'top.txt')
+            previous = set()
+            if os.path.exists(topFile):
+                with open(topFile) as f:
+                    previous = set(f.read().split())
+            finished = len(chunks) == numberOfRegions
+            earlyPoses = [self._getEarlyPosePath(ligandKey, solution)
+                          for solution in top]
+            stable = [i for i, posePath in enumerate(earlyPoses)
+                      if (finished or os.path.basename(posePath) in previous) and
+                      not os.path.exists(posePath)]
+            # Complexes are written aside and renamed, so they are complete
+            # when they appear
+            complexFiles = writeComplexes(self._getPdbOutputPath('receptor', '_ASA.pdb'),
+                                          self._getPdbOutputPath(ligandKey, '_ASA.pdb'),
+                                          top[stable],
+                                          os.path.join(earlyDir, 'tmp_%04d.pdb'))
+            for i, complexFile in zip(stable, complexFiles):
+                os.replace(complexFile, earlyPoses[i])
+            with open(topFile, 'w') as f:
+                f.write('\n'.join(os.path.basename(p) for p in earlyPoses))
+        print('Pipelined clustering: %d of %d refinements, %d early complexes'
+              % (len(chunks), numberOfRegions,
+                 sum(os.path.exists(p) for p in earlyPoses)), flush=True)
+
+    def _getEarlyComplexesDir(self, ligandKey):
+        return os.path.join(self._getOutputDir(ligandKey), 'early_complexes')
+
+    def _getEarlyPosePath(self, ligandKey, solution):
+        """ Return the early complex of a solution, named after its rigid
+        transform so it does not depend on the cluster ranks. """
+        transform = solution['euler'].tobytes() + solution['translation'].tobytes()
+        return os.path.join(self._getEarlyComplexesDir(ligandKey),
+                            'complex_%08x.pdb' % zlib.crc32(transform))
+
+    def _getRestraintParams(self):
+        """ Return the parameters of the interface restraint. """
+        return [self.receptorResidues.get() or '',
+                self.ligandResidues.get() or '',
+                self.restraintMargin.get()]
+
+    def _getSymmetryParams(self):
+        """ Return the parameters of the Cn symmetry filter, empty if the
+        docking is not symmetric. """
+        if not self.symmetric:
+            return []
+        return [self.symmetryOrder.get(), self.symmetryTolerance.get(),
+                self.symmetryScrew.get()]
+
+    def _getRestraint(self, ligandKey):
+        """ Return the interface restraint of a ligand as the receptor site
+        center, the ligand epitope (relative to the ligand center), the
+        maximum distance between them and the search radius of the ligand
+        center. Return None if no receptor residues are given. """
+        receptorResidues = parseResidues(self.receptorResidues.get() or '')
+        if not receptorResidues:
+            return None
+        siteCoords = readResidueCoordinates(self._getPdbPath('receptor'),
+                                            receptorResidues)
+        if not len(siteCoords):
+            raise ValueError('The receptor interface residues were not found '
+                             'in the receptor pdb')
+        siteCenter = siteCoords.mean(axis=0)
+        maxDistance = (np.sqrt(((siteCoords - siteCenter) ** 2).sum(axis=1).max())
+                       + self.restraintMargin.get())
+
+        ligandPdbPath = self._getPdbPath(ligandKey)
+        ligandCoords = readAtomCoordinates(ligandPdbPath)
+        ligandCenter = ligandCoords.mean(axis=0)
+        ligandResidues = parseResidues(self.ligandResidues.get() or '')
+        epitopeCoords = readResidueCoordinates(ligandPdbPath, ligandResidues)
+        if len(epitopeCoords):
+            epitope = epitopeCoords.mean(axis=0) - ligandCenter
+        else:
+            # Any ligand atom may be at the interface
+            epitope = np.zeros(3)
+            maxDistance += np.sqrt(((ligandCoords - ligandCenter) ** 2).sum(axis=1).max())
+        searchRadius = np.linalg.norm(epitope) + maxDistance
+        return siteCenter, epitope, maxDistance, searchRadius
+
+    def _getSolutionsFilter(self, ligandKey):
+        """ Return a function keeping the solutions of a ligand that satisfy
+        the interface restraint and, in symmetric mode, the Cn symmetry. Return
+        None if there is nothing to filter. """
+        restraint = self._getRestraint(ligandKey)
+        symmetric = self.symmetric.get()
+        if restraint is None and not symmetric:
+            return None
+        if symmetric:
+            # Poses are rotations around the centroid of the ligand atoms
+            center = getPoseCenter(self._getPdbOutputPath(ligandKey, '_ASA.pdb'))
+
+        def filterSolutions(solutions):
+            if restraint is not None:
+                siteCenter, epitope, maxDistance, _ = restraint
+                solutions = filterRestrainedSolutions(solutions, siteCenter,
+                                                      epitope, maxDistance)
+            if symmetric:
+                solutions = filterSymmetricSolutions(solutions, center,
+                                                     self.symmetryOrder.get(),
+                                                     self.symmetryTolerance.get(),
+                                                     self.symmetryScrew.get())
+            return solutions
+        return filterSolutions
+
+    def _getRestraintArgs(self, ligandKey):
+        """ Return the frodock arguments restricting the ligand position. """
+        restraint = self._getRestraint(ligandKey)
+        if restraint is None:
+            return []
+        siteCenter, _, _, searchRadius = restraint
+        return ['-p', ','.join('%.3f' % x for x in siteCenter),
+                '--rd', '%.3f' % searchRadius]
+
+    def _getDockFilePath(self, ligandKey):
+        """ Return the search results of a ligand: dock.dat for
+        frodockcluster, otherwise the dock.npz listing (of the merged
+        refinements in coarse-to-fine mode). """
+        fileName = ('dock.dat' if self.clusteringMode.get() == CLUSTERING_FRODOCK
+                    else 'dock.npz')
+        return os.path.abspath(os.path.join(self._getOutputDir(ligandKey), fileName))
+
+    def _getRefinedFilePath(self, ligandKey, region):
+        return os.path.abspath(os.path.join(self._getOutputDir(ligandKey),
+                                            'dock_fine_%02d.dat' % region))
+
+    def _getListingPath(self, dockFilePath):
+        """ Return the .npz listing of a binary frodock results file. """
+        return os.path.splitext(os.path.abspath(dockFilePath))[0] + '.npz'
+
+    def _listSolutions(self, dockFilePath, removeResults=False):
+        """ List a binary frodock results file with frodockview and store the
+        listing as a compressed .npz file; the text table is removed once
+        converted, and the results too with removeResults. The listing is
+        reused while it is newer than the results. Return the path of the
+        listing. """
+        dockFilePath = os.path.abspath(dockFilePath)
+        npzFilePath = self._getListingPath(dockFilePath)
+        if os.path.exists(dockFilePath) and (
+                not os.path.exists(npzFilePath) or
+                os.path.getmtime(npzFilePath) < os.path.getmtime(dockFilePath)):
+            txtFilePath = os.path.splitext(dockFilePath)[0] + '.txt'
+            program, args = self.getFrodockviewCommand(program=self._getProgram(FRODOCKVIEW),
+                                                       dockFile=dockFilePath)
+            Plugin.runProgram(program, args, outputFile=txtFilePath)
+            writeSolutionsFile(npzFilePath, iterDockingSolutions(txtFilePath))
+            os.remove(txtFilePath)
+        if removeResults and os.path.exists(dockFilePath):
+            os.remove(dockFilePath)
+        return npzFilePath
+
+    def _loadSolutions(self, fileName):
+        """ Return all the solutions stored in a .npz listing. """
+        with SolutionsFile(fileName) as solutionsFile:
+            return solutionsFile.getAll()
+
+    def _readSolutions(self, ligandKey):
+        """ Return the clustered solutions of a ligand as a NumPy array. """
+        ligandDir = self._getOutputDir(ligandKey)
+        if self.clusteringMode.get() == CLUSTERING_IN_PROCESS:
+            return self._loadSolutions(os.path.join(ligandDir, 'clust_dock.npz'))
+        # frodock results are binary, frodockview lists them as a table
+        solutions = self._loadSolutions(self._listSolutions(os.path.join(ligandDir,
+                                                                         'clust_dock.dat')))
+        # frodockcluster cannot filter, the restraint is applied to its
+        # clusters
+        solutionsFilter = self._getSolutionsFilter(ligandKey)
+        if solutionsFilter is not None:
+            solutions = solutionsFilter(solutions)
+        return solutions
+
+    def _createSolutionsSet(self, ligandKey, solutions):
+        """ Convert the clustered solutions of a ligand to a
+        SetOfDockingSolutions. """
+        outputSet = SetOfDockingSolutions.create(self._getPath(), prefix='docking_solutions')
+        outputSet.setReceptorFile(self._getPdbOutputPath('receptor', '_ASA.pdb'))
+        outputSet.setLigandFile(self._getPdbOutputPath(ligandKey, '_ASA.pdb'))
+        self._appendSolutions(outputSet, solutions)
+        return outputSet
+
+    def _appendSolutions(self, outputSet, solutions, ligandId=None,
+                         ligandFile=None):
+        """ Add the clustered solutions of a ligand to a
+        SetOfDockingSolutions, tagged with the ligand id and file when the
+        set holds several ligands. """
+        solution = DockingSolution(ligandId=ligandId, ligandFile=ligandFile)
+        for row in solutions:
+            solution.setObjId(None)
+            solution.setRank(int(row['rank']))
+            solution.setEulerAngles(*row['euler'].tolist())
+            solution.setTranslation(*row['translation'].tolist())
+            solution.setScore(float(row['score']))
+            # Every clustered solution is the representative of its cluster
+            cluster = int(row['cluster'])
+            solution.setCluster(cluster if cluster >= 0 else int(row['rank']))
+            outputSet.append(solution)
+
+    def _createComplexesSet(self, ligandKey, solutions):
+        """ Write the complexes of the best scored solutions of a ligand and
+        return them as a SetOfAtomStructs. """
+        complexesSet = SetOfAtomStructs.create(self._getPath(), prefix='complexes')
+        for complexFile in self._writeComplexes(ligandKey, solutions):
+            complexesSet.append(AtomStruct(filename=complexFile))
+        return complexesSet
+
+    def _writeComplexes(self, ligandKey, solutions):
+        """ Write the complexes of the best scored solutions of a ligand and
+        return their file names. """
+        complexesDir = os.path.join(self._getOutputDir(ligandKey), 'complexes')
+        pwutils.cleanPath(complexesDir)
+        pwutils.makePath(complexesDir)
+        topSolutions = solutions[np.argsort(-solutions['score'],
+                                            kind='stable')][:self.numberOfPoses.get()]
+        outputPattern = os.path.join(complexesDir, 'complex_%04d.pdb')
+        # Complexes already written by the pipelined clustering are linked
+        earlyPoses = [self._getEarlyPosePath(ligandKey, solution)
+                      for solution in topSolutions]
+        missing = [i for i, posePath in enumerate(earlyPoses)
+                   if not os.path.exists(posePath)]
+        writeComplexes(self._getPdbOutputPath('receptor', '_ASA.pdb'),
+                       self._getPdbOutputPath(ligandKey, '_ASA.pdb'),
+                       topSolutions[missing], outputPattern)
+        complexFiles = []
+        for i, solution in enumerate(topSolutions):
+            complexFile = outputPattern % solution['rank']
+            if i not in missing:
+                pwutils.createLink(earlyPoses[i], complexFile)
+            complexFiles.append(complexFile)
+        return complexFiles
+
+    def _defineMapOutputs(self, pdbKey, maps, inputPdb):
+        """ Register the potential maps of the receptor or the ligand as
+        Volume outputs, e.g. outputReceptorVdwMap. Only the map header is
+        read. """
+        role = 'Receptor' if pdbKey == 'receptor' else 'Ligand'
+        outputs = {}
+        for outputSuffix, _ in maps:
+            outputs['output%s%s' % (role, MAP_OUTPUT_NAMES[outputSuffix])] = \
+                self._createMapVolume(self._getPdbOutputPath(pdbKey, outputSuffix))
+        self._defineOutputs(**outputs)
+        for volume in outputs.values():
+            self._defineSourceRelation(inputPdb, volume)
+
+    def _createMapVolume(self, mapFile):
+        """ Return a potential map as a Volume with its sampling and origin. """
+        ccp4Map = Ccp4Map(mapFile)
+        volume = Volume()
+        volume.setFileName(mapFile + ':mrc')
+        volume.setSamplingRate(ccp4Map.getSpacing()[0])
+        origin = Transform()
+        origin.setShifts(*ccp4Map.getOrigin())
+        volume.setOrigin(origin)
+        return volume
+
+    def _getPdbOutputPath(self, pdbKey, suffix):
+        """ Return the path of a file derived from the receptor or ligand
+        pdb, e.g. its _ASA.pdb or its potential maps. """
+        pdbKey = self._getMoleculeKey(pdbKey)
+        fileName = getStructureName(self._getInputPdbPath(pdbKey))
+        if (pdbKey != 'receptor' and
+                fileName == getStructureName(self._getInputPdbPath('receptor'))):
+            # e.g. chains of the same structure docked against each other
+            fileName += '_' + pdbKey
+        return os.path.abspath(os.path.join(self._getOutputDir(pdbKey),
+                                            fileName + suffix))
+
+    def _getRadius(self, pdbKey):
+        """ Return the bounding radius of the atoms of the receptor or
+        ligand that are docked. """
+        pdbKey = self._getMoleculeKey(pdbKey)
+        chainsParam = (self.receptorChains if pdbKey == 'receptor'
+                       else self.ligandChains)
+        _, radius = getBoundingRadius(iterAtomRecords(self._getInputPdbPath(pdbKey),
+                                                      parseChains(chainsParam.get() or ''),
+                                                      self.keepHetero.get()))
+        return radius
+
+    def _getLigandKeys(self):
+        return ['ligand']
+
+    def _getAutoGrid(self, pdbKey, spacing):
+        """ Return the grid size and spacing of the maps of pdbKey: the maps
+        cover the molecule and, for the receptor, every ligand around it. """
+        extent = self._getRadius(pdbKey) + GRID_PADDING
+        if pdbKey == 'receptor':
+            extent += max(self._getRadius(ligandKey)
+                          for ligandKey in self._getLigandKeys())
+        return getGridSize(2 * extent, spacing, MAX_GRID_SIZE)
+
+    def _getPdbPath(self, pdbKey):
+        """ Return the prepared pdb of the receptor or ligand, the one given
+        to the docking programs. """
+        return self._getPdbOutputPath(pdbKey, '.pdb')
+
+    def _isUpToDate(self, stepKey, fingerprint, outputFiles):
+        """ Return True if the step identified by stepKey already ran with
+        the same fingerprint and its outputs still exist. """
+        fingerprintFile = self._getExtraPath('fingerprints', stepKey)
+        if (os.path.exists(fingerprintFile) and
+                all(os.path.exists(f) for f in outputFiles)):
+            with open(fingerprintFile) as f:
+                if f.read().strip() == fingerprint:
+                    print('Inputs of %s are unchanged, skipping it' % stepKey,
+                          flush=True)
+                    return True
+        return False
+
+    def _storeFingerprint(self, stepKey, fingerprint):
+        """ Record the fingerprint of a step after running it. """
+        fingerprintDir = self._getExtraPath('fingerprints')
+        pwutils.makePath(fingerprintDir)
+        with open(os.path.join(fingerprintDir, stepKey), 'w') as f:
+            f.write(fingerprint)
+
+    def _getOutputDir(self, pdbKey):
+        """ Return the directory where the maps and docking results of the
+        receptor or ligand are written. """
+        return self._getExtraPath()
+
     def _getProgram(self, programName):
         """ Return program binary. """
         return Plugin.getProgram(programName)
@@ -167,14 +1063,23 @@ class ProtFrodockProtein(EMProtocol):
         pdbInputFile = kwargs.get('pdbFile')
         mValue = kwargs.get('mValue', None)
         tValue = kwargs.get('tValue')
-        mValue = ' -m %s' % mValue if mValue is not None else ''
-        tValue = ' -t %s' % tValue if tValue is not None else ''
         outputSuffix = kwargs.get('outputSuffix')
+        outputDir = kwargs.get('outputDir', self._getExtraPath())
+        gridSize = kwargs.get('gridSize')
+        gridSpacing = kwargs.get('gridSpacing')
 
-        outputFileName = os.path.basename(pdbInputFile).split('.')[0] + outputSuffix
-        outputPdbFilePath = os.path.abspath(self._getExtraPath(outputFileName))
+        outputFileName = getStructureName(pdbInputFile) + outputSuffix
+        outputPdbFilePath = os.path.abspath(os.path.join(outputDir, outputFileName))
 
-        params = '%s -o %s%s%s' % (pdbInputFile, outputPdbFilePath, mValue, tValue)
+        params = [pdbInputFile, '-o', outputPdbFilePath]
+        if mValue is not None:
+            params += ['-m', mValue]
+        if tValue is not None:
+            params += ['-t', tValue]
+        if gridSize is not None:
+            params += ['-w', gridSize]
+        if gridSpacing is not None:
+            params += ['-s', gridSpacing]
         return program,  params
     
     def getFrodockCommand(self,  **kwargs):
@@ -182,24 +1087,28 @@ class ProtFrodockProtein(EMProtocol):
         recInputFile = kwargs.get('recFile')
         ligInputFile = kwargs.get('ligFile')
         outFile = kwargs.get('outputFile')
+        recDir = kwargs.get('recDir', self._getExtraPath())
+        ligDir = kwargs.get('ligDir', self._getExtraPath())
+        numberOfThreads = kwargs.get('numberOfThreads', self.numberOfThreads.get())
         soap = self._getProgram(SOAP)
 
-        recFileName = os.path.basename(recInputFile).split('.')[0] + '_ASA.pdb'
-        recFilePath = os.path.abspath(self._getExtraPath(recFileName))        
-        ligFileName = os.path.basename(ligInputFile).split('.')[0] + '_ASA.pdb'
-        ligFilePath = os.path.abspath(self._getExtraPath(ligFileName))
-    
-        vdwFileName = os.path.basename(recInputFile).split('.')[0] + '_W.ccp4'
-        vdwFilePath = os.path.abspath(self._getExtraPath(vdwFileName))         
-        eleFileName = os.path.basename(recInputFile).split('.')[0] + '_E.ccp4'
-        eleFilePath = os.path.abspath(self._getExtraPath(eleFileName))     
-        dsRecName = os.path.basename(recInputFile).split('.')[0] + '_DS.ccp4'
-        dsRecPath = os.path.abspath(self._getExtraPath(dsRecName))  
-        dsLigName = os.path.basename(ligInputFile).split('.')[0] + '_DS.ccp4'
-        dsLigPath = os.path.abspath(self._getExtraPath(dsLigName))       
-
-        params = '%s %s -w %s -e %s --th 10 -d %s,%s -s %s -o %s' % (recFilePath, ligFilePath, 
-                                                               vdwFilePath, eleFilePath, dsRecPath, dsLigPath, soap, outFile)
+        recFileName = getStructureName(recInputFile) + '_ASA.pdb'
+        recFilePath = os.path.abspath(os.path.join(recDir, recFileName))
+        ligFileName = getStructureName(ligInputFile) + '_ASA.pdb'
+        ligFilePath = os.path.abspath(os.path.join(ligDir, ligFileName))
+
+        vdwFileName = getStructureName(recInputFile) + '_W.ccp4'
+        vdwFilePath = os.path.abspath(os.path.join(recDir, vdwFileName))
+        eleFileName = getStructureName(recInputFile) + '_E.ccp4'
+        eleFilePath = os.path.abspath(os.path.join(recDir, eleFileName))
+        dsRecName = getStructureName(recInputFile) + '_DS.ccp4'
+        dsRecPath = os.path.abspath(os.path.join(recDir, dsRecName))
+        dsLigName = getStructureName(ligInputFile) + '_DS.ccp4'
+        dsLigPath = os.path.abspath(os.path.join(ligDir, dsLigName))
+
+        params = [recFilePath, ligFilePath, '-w', vdwFilePath, '-e', eleFilePath,
+                  '--th', numberOfThreads, '-d', '%s,%s' % (dsRecPath, dsLigPath),
+                  '-s', soap, '-o', outFile]
         return program,  params
     
     def getFrodockclusterCommand(self,  **kwargs):
@@ -208,5 +1117,16 @@ class ProtFrodockProtein(EMProtocol):
         inputDockFile = kwargs.get('dockFile')
         outFile = kwargs.get('outputFile')
    
-        params = '%s %s --nc 100 -d 5.0 -o %s' % (inputDockFile, ligInputFile, outFile)
-        return program,  params
\ No newline at end of file
+        numberOfClusters = kwargs.get('numberOfClusters', self.numberOfClusters.get())
+        clusterRadius = kwargs.get('clusterRadius', self.clusterRadius.get())
+
+        params = [inputDockFile, ligInputFile, '--nc', numberOfClusters,
+                  '-d', clusterRadius, '-o', outFile]
+        return program,  params
+
+    def getFrodockviewCommand(self, **kwargs):
+        program = kwargs.get('program')
+        inputDockFile = kwargs.get('dockFile')
+
+        params = [inputDockFile]
+        return program, params
@@ -0,0 +1,154 @@
+# **************************************************************************
+# *
+# * Authors: Yunior C. Fonseca Reyna    (cfonseca@cnb.csic.es)
+# *
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+import os
+
+from pwem.objects import AtomStruct, SetOfAtomStructs, SetOfVolumes
+from pyworkflow.object import Integer
+import pyworkflow.utils as pwutils
+
+from proteindocking.constants import MAP_OUTPUT_NAMES
+from proteindocking.objects import SetOfDockingSolutions
+from proteindocking.profiling import profileStep
+
+from .protocol_frodock import ProtFrodockProtein, RECEPTOR_MAPS, LIGAND_MAPS
+
+
+class ProtFrodockBatch(ProtFrodockProtein):
+    """
+    Protocol to dock a set of ligands against a single receptor using the
+    FRODOCK docking tool. The receptor potential maps are computed once and
+    every ligand is searched and clustered in independent steps.
+    """
+    _label = 'frodock batch'
+
+    def _defineParams(self, form):
+        ProtFrodockProtein._defineParams(self, form)
+        inputLigands = form.getParam('inputPdbLigand')
+        inputLigands.pointerClass.set('SetOfAtomStructs')
+        inputLigands.label.set('Ligand pdbs')
+        inputLigands.help.set('Set of ligand pdbs docked against the receptor')
+        # Every ligand is a different molecule
+        form.getParam('symmetric').condition.set('False')
+
+    def _insertAllSteps(self):
+        receptorStepIds = self._insertMapSteps('receptor', RECEPTOR_MAPS)
+        clustStepIds = []
+        for ligandKey in self._getLigandKeys():
+            mapStepIds = self._insertMapSteps(ligandKey, LIGAND_MAPS)
+            clustStepIds.append(self._insertDockingSteps(ligandKey,
+                                                         receptorStepIds + mapStepIds))
+        self._insertFunctionStep(self.createOutputStep,
+                                 prerequisites=clustStepIds)
+
+    @profileStep
+    def createOutputStep(self):
+        """ Register the solutions and the complexes of all the ligands as
+        single sets, every item tagged with the id of its ligand. """
+        solutionsSet = SetOfDockingSolutions.create(self._getPath(), prefix='docking_solutions')
+        solutionsSet.setReceptorFile(self._getPdbOutputPath('receptor', '_ASA.pdb'))
+        complexesSet = SetOfAtomStructs.create(self._getPath(), prefix='complexes')
+        # Reading the ligand files while iterating the set would restart
+        # the iteration
+        for ligandId in self._getLigandIds():
+            ligandKey = 'ligand_%d' % ligandId
+            solutions = self._readSolutions(ligandKey)
+            self._appendSolutions(solutionsSet, solutions, ligandId=ligandId,
+                                  ligandFile=self._getPdbOutputPath(ligandKey,
+                                                                    '_ASA.pdb'))
+            for complexFile in self._writeComplexes(ligandKey, solutions):
+                atomStruct = AtomStruct(filename=complexFile)
+                atomStruct._ligandId = Integer(ligandId)
+                complexesSet.append(atomStruct)
+        self._defineOutputs(outputSolutions=solutionsSet,
+                            outputComplexes=complexesSet)
+        for output in [solutionsSet, complexesSet]:
+            self._defineSourceRelation(self.inputPdbReceptor, output)
+            self._defineSourceRelation(self.inputPdbLigand, output)
+        self._defineMapOutputs('receptor', RECEPTOR_MAPS, self.inputPdbReceptor)
+        self._defineLigandMapOutputs()
+
+    def _defineLigandMapOutputs(self):
+        """ Register the potential maps of the ligands as one SetOfVolumes
+        per map, e.g. outputLigandDesolvationMaps. """
+        outputs = {}
+        for outputSuffix, _ in LIGAND_MAPS:
+            volumes = SetOfVolumes.create(self._getPath(), prefix='volumes',
+                                         suffix=MAP_OUTPUT_NAMES[outputSuffix])
+            for ligandId in self._getLigandIds():
+                volume = self._createMapVolume(
+                    self._getPdbOutputPath('ligand_%d' % ligandId, outputSuffix))
+                volume._ligandId = Integer(ligandId)
+                if not volumes.getSize():
+                    volumes.setSamplingRate(volume.getSamplingRate())
+                volumes.append(volume)
+            outputs['outputLigand%ss' % MAP_OUTPUT_NAMES[outputSuffix]] = volumes
+        self._defineOutputs(**outputs)
+        for volumes in outputs.values():
+            self._defineSourceRelation(self.inputPdbLigand, volumes)
+
+    # -----------------------Utils functions-------------------------------
+
+    def _getInputPdbPath(self, pdbKey):
+        """ Return the absolute path of the receptor or the ligand pdb
+        identified by ligand_<objId>. """
+        if pdbKey == 'receptor':
+            return ProtFrodockProtein._getInputPdbPath(self, pdbKey)
+        return self._getLigandFiles()[int(pdbKey.split('_')[1])]
+
+    def _getLigandFiles(self):
+        """ Return the absolute path of every input ligand by its id. The
+        set is read once, when the steps are inserted: the steps of
+        different ligands run in parallel threads and can not query its
+        database concurrently. """
+        if not hasattr(self, '_ligandFiles'):
+            self._ligandFiles = {ligand.getObjId(): os.path.abspath(ligand.getFileName())
+                                 for ligand in self.inputPdbLigand.get()}
+        return self._ligandFiles
+
+    def _getLigandIds(self):
+        return list(self._getLigandFiles())
+
+    def _getLigandKeys(self):
+        return ['ligand_%d' % ligandId for ligandId in self._getLigandIds()]
+
+    def _getSearchThreads(self):
+        """ The steps of different ligands run concurrently, one per thread
+        of the step executor (all the threads but the main one), so every
+        search gets its share of the threads instead of all of them. """
+        numberOfThreads = self.numberOfThreads.get()
+        concurrentSearches = min(len(self._getLigandFiles()),
+                                 max(1, numberOfThreads - 1))
+        return max(1, numberOfThreads // concurrentSearches)
+
+    def _getOutputDir(self, pdbKey):
+        """ Receptor maps are shared in the extra folder while every ligand
+        gets its own subfolder. """
+        if pdbKey == 'receptor':
+            return self._getExtraPath()
+        outputDir = self._getExtraPath(pdbKey)
+        pwutils.makePath(outputDir)
+        return outputDir
@@ -0,0 +1,433 @@
+# **************************************************************************
+# *
+# * Authors: Yunior C. Fonseca Reyna    (cfonseca@cnb.csic.es)
+# *          Erney Ramirez Aportela     (eramirez@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from pwem.objects import AtomStruct, SetOfAtomStructs
+from pyworkflow.object import Float, String
+from pyworkflow.protocol import (PointerParam, EnumParam, BooleanParam, IntParam,
+                                 FloatParam, StringParam, LEVEL_ADVANCED)
+import pyworkflow.utils as pwutils
+
+from proteindocking import Plugin
+from proteindocking.campaign import (getTaskStatus, loadManifest, FAILED_FILE,
+                                     RESULT_FILE)
+from proteindocking.constants import (FRODOCKGRID, FRODOCK, FRODOCKVIEW, SOAP,
+                                      RECEPTOR_MAPS, LIGAND_MAPS,
+                                      FRODOCK_MAPS_CACHE, FRODOCK_MAPS_CACHE_SIZE)
+from proteindocking.convert import (getStructureName, iterAtomRecords,
+                                    getBoundingRadius, getGridSize, parseChains)
+from proteindocking.profiling import profileStep, summarizeProfile, PROFILE_FILE
+from proteindocking.runner import runCommand
+
+from .protocol_frodock import ProtFrodockProtein, GRID_PADDING, MAX_GRID_SIZE
+
+# Task executors
+EXECUTOR_LOCAL = 0
+EXECUTOR_QUEUE = 1
+
+# Seconds between checks of the job array progress
+POLL_INTERVAL = 30
+
+
+class ProtFrodockCampaign(ProtFrodockProtein):
+    """
+    Protocol to dock every receptor against every ligand with FRODOCK as a
+    single job array. Each task docks one pair outside the project database
+    (maps of every molecule are computed once and shared by its tasks) and
+    a final step ranks the best complex of all the pairs.
+    """
+    _label = 'frodock campaign'
+
+    def _defineParams(self, form):
+        form.addSection(label='Input')
+        form.addParam('inputReceptors', PointerParam,
+                      pointerClass='SetOfAtomStructs,AtomStruct',
+                      label="Receptor pdbs", important=True,
+                      help='Receptor or set of receptors')
+        form.addParam('inputLigands', PointerParam,
+                      pointerClass='SetOfAtomStructs,AtomStruct',
+                      label="Ligand pdbs", important=True,
+                      help='Ligand or set of ligands. Every ligand is docked '
+                           'against every receptor.')
+        form.addParam('interactionType', EnumParam,
+                      choices=['Enzyme-Substrate', 'Antigen-Antibody', 'Unknown'],
+                      default=2,
+                      label="Type of interaction",
+                      help='Type of interaction')
+        form.addParam('numberOfClusters', IntParam, default=100,
+                      label="Number of clusters",
+                      help='Number of solution clusters of every pair')
+        form.addParam('clusterRadius', FloatParam, default=5.0,
+                      label="Cluster radius (A)",
+                      help='Solutions closer than this RMSD belong to the '
+                           'same cluster')
+        form.addParam('receptorChains', StringParam, default='',
+                      label="Receptor chains",
+                      help='Chains of the receptors to dock, separated by '
+                           'commas. Leave empty to keep all of them.')
+        form.addParam('ligandChains', StringParam, default='',
+                      label="Ligand chains",
+                      help='Chains of the ligands to dock, separated by '
+                           'commas. Leave empty to keep all of them.')
+        form.addParam('keepHetero', BooleanParam, default=False,
+                      label="Keep hetero atoms?",
+                      help='Waters and alternate locations (but the most '
+                           'occupied one) are always removed before docking. Hetero '
+                           'atoms are removed too unless this option is set.')
+        form.addParam('gridSpacing', FloatParam, default=1.0,
+                      expertLevel=LEVEL_ADVANCED,
+                      label="Grid spacing (A)",
+                      help='Spacing of the map grids, sized automatically '
+                           'from the molecules')
+        form.addParam('useMapCache', BooleanParam, default=True,
+                      expertLevel=LEVEL_ADVANCED,
+                      label="Reuse cached potential maps?",
+                      help='Potential maps are cached across runs and reused '
+                           'when the same map was already computed')
+        form.addSection(label='Execution')
+        form.addParam('executor', EnumParam,
+                      choices=['Local', 'Queue job array'],
+                      default=EXECUTOR_LOCAL,
+                      label="Run tasks on",
+                      help='Local: the tasks run on this machine, as many at '
+                           'a time as threads.\n'
+                           'Queue job array: a single job array with one '
+                           'task per pair is submitted to the queue system of '
+                           'the execution host (SLURM, PBS or SGE submit '
+                           'templates in hosts.conf).')
+        form.addParam('threadsPerTask', IntParam, default=1,
+                      label="Threads per task",
+                      help='Threads of the docking search of every pair')
+        form.addParam('maxRunningTasks', IntParam, default=0,
+                      condition='executor == %d' % EXECUTOR_QUEUE,
+                      label="Maximum running tasks",
+                      help='Maximum number of array tasks running at the same '
+                           'time (0 for no limit)')
+        form.addParallelSection(threads=4, mpi=0)
+
+    def _insertAllSteps(self):
+        manifestStepId = self._insertFunctionStep(self.createManifestStep)
+        runStepId = self._insertFunctionStep(self.runTasksStep,
+                                             self.executor.get(),
+                                             prerequisites=[manifestStepId])
+        self._insertFunctionStep(self.gatherStep, prerequisites=[runStepId])
+
+    @profileStep
+    def createManifestStep(self):
+        """ Describe every molecule (prepared pdb and map commands) and every
+        pair task (search commands) in the campaign manifest. """
+        receptors = self._describeMolecules('receptor', self.inputReceptors,
+                                            self.receptorChains)
+        ligands = self._describeMolecules('ligand', self.inputLigands,
+                                          self.ligandChains)
+        maxLigandRadius = max(ligand['radius'] for ligand in ligands)
+        for receptor in receptors:
+            self._addMapCommands(receptor, RECEPTOR_MAPS,
+                                 receptor['radius'] + maxLigandRadius)
+        for ligand in ligands:
+            self._addMapCommands(ligand, LIGAND_MAPS, ligand['radius'])
+        molecules = receptors + ligands
+
+        tasks = []
+        for r, receptor in enumerate(receptors):
+            for l, ligand in enumerate(ligands, len(receptors)):
+                taskDir = self._getCampaignPath('tasks', '%06d' % len(tasks))
+                program, args = self.getFrodockCommand(program=self._getProgram(FRODOCK),
+                                                       recFile=receptor['pdb'],
+                                                       ligFile=ligand['pdb'],
+                                                       recDir=receptor['dir'],
+                                                       ligDir=ligand['dir'],
+                                                       numberOfThreads=self.threadsPerTask.get(),
+                                                       outputFile=os.path.join(taskDir, 'dock.dat'))
+                viewProgram, viewArgs = self.getFrodockviewCommand(program=self._getProgram(FRODOCKVIEW),
+                                                                   dockFile=os.path.join(taskDir, 'dock.dat'))
+                tasks.append({'receptor': r, 'ligand': l, 'dir': taskDir,
+                              'search': {'program': program, 'args': args},
+                              'view': {'program': viewProgram, 'args': viewArgs}})
+
+        cache = None
+        if self.useMapCache:
+            cache = {'path': Plugin.getVar(FRODOCK_MAPS_CACHE),
+                     'maxSize': float(Plugin.getVar(FRODOCK_MAPS_CACHE_SIZE)) * 1024 ** 3}
+        manifest = {'version': Plugin.getFrodockVersion(),
+                    'cache': cache,
+                    'numberOfThreads': self.threadsPerTask.get(),
+                    'numberOfClusters': self.numberOfClusters.get(),
+                    'clusterRadius': self.clusterRadius.get(),
+                    'molecules': molecules,
+                    'tasks': tasks}
+        pwutils.makePath(self._getCampaignPath())
+        with open(self._getManifestPath(), 'w') as f:
+            json.dump(manifest, f)
+        print('%d receptors, %d ligands: %d docking tasks'
+              % (len(receptors), len(ligands), len(tasks)), flush=True)
+
+    @profileStep
+    def runTasksStep(self, executor):
+        """ Run the tasks that are not done yet and wait for all of them. """
+        manifestFile = self._getManifestPath()
+        tasks = loadManifest(manifestFile)['tasks']
+        pending = [i for i, task in enumerate(tasks) if getTaskStatus(task) != 'done']
+        print('%d of %d tasks to run' % (len(pending), len(tasks)), flush=True)
+        if not pending:
+            return
+        if executor == EXECUTOR_QUEUE:
+            self._runJobArray(manifestFile, tasks, pending)
+        else:
+            with ThreadPoolExecutor(max_workers=self.numberOfThreads.get()) as pool:
+                list(pool.map(lambda i: self._runLocalTask(manifestFile, tasks[i], i),
+                              pending))
+
+    @profileStep
+    def gatherStep(self):
+        """ Rank the best complex of every pair by score. """
+        tasks = loadManifest(self._getManifestPath())['tasks']
+        results = []
+        failed = []
+        for i, task in enumerate(tasks):
+            if getTaskStatus(task) == 'done':
+                with open(os.path.join(task['dir'], RESULT_FILE)) as f:
+                    result = json.load(f)
+                if result['complex'] is not None:
+                    results.append(result)
+            else:
+                failed.append(i)
+        results.sort(key=lambda result: -result['score'])
+
+        with open(self._getExtraPath('campaign_ranking.txt'), 'w') as f:
+            f.write('# rank\treceptor\tligand\tscore\tclusters\tsolutions\tcomplex\n')
+            for rank, result in enumerate(results, 1):
+                f.write('%d\t%s\t%s\t%.3f\t%d\t%d\t%s\n'
+                        % (rank, result['receptor'], result['ligand'],
+                           result['score'], result['numberOfClusters'],
+                           result['numberOfSolutions'], result['complex']))
+        if failed:
+            with open(self._getExtraPath('campaign_failed.txt'), 'w') as f:
+                f.write('\n'.join(tasks[i]['dir'] for i in failed) + '\n')
+            print('%d tasks failed, see campaign_failed.txt' % len(failed),
+                  flush=True)
+        if not results:
+            raise RuntimeError('No docking task of the campaign succeeded')
+
+        outputSet = SetOfAtomStructs.create(self._getPath(), prefix='complexes')
+        for result in results:
+            atomStruct = AtomStruct(filename=result['complex'])
+            atomStruct._dockingScore = Float(result['score'])
+            atomStruct._receptorName = String(result['receptor'])
+            atomStruct._ligandName = String(result['ligand'])
+            outputSet.append(atomStruct)
+        self._defineOutputs(outputComplexes=outputSet)
+        self._defineSourceRelation(self.inputReceptors, outputSet)
+        self._defineSourceRelation(self.inputLigands, outputSet)
+
+    # --------------------------- INFO functions -----------------------------
+
+    def _summary(self):
+        summary = []
+        rankingFile = self._getExtraPath('campaign_ranking.txt')
+        if os.path.exists(rankingFile):
+            with open(rankingFile) as f:
+                summary.append('%d docked pairs ranked in %s'
+                               % (sum(1 for line in f if not line.startswith('#')),
+                                  os.path.basename(rankingFile)))
+        return summary + summarizeProfile(self._getExtraPath(PROFILE_FILE))
+
+    def _validate(self):
+        return Plugin.validateTools([FRODOCKGRID, FRODOCK, FRODOCKVIEW, SOAP])
+
+    # -----------------------Utils functions-------------------------------
+
+    def _getCampaignPath(self, *paths):
+        return os.path.abspath(self._getExtraPath('campaign', *paths))
+
+    def _getManifestPath(self):
+        return self._getCampaignPath('manifest.json')
+
+    def _describeMolecules(self, role, pointer, chainsParam):
+        """ Return the manifest entries of the receptors or the ligands. """
+        inputs = pointer.get()
+        atomStructs = [inputs] if isinstance(inputs, AtomStruct) else inputs
+        chains = parseChains(chainsParam.get() or '')
+        molecules = []
+        for atomStruct in atomStructs:
+            inputPath = os.path.abspath(atomStruct.getFileName())
+            name = getStructureName(inputPath)
+            moleculeDir = self._getCampaignPath('molecules', '%s_%d'
+                                                % (role, atomStruct.getObjId()))
+            _, radius = getBoundingRadius(iterAtomRecords(inputPath, chains,
+                                                          self.keepHetero.get()))
+            molecules.append({'name': name, 'input': inputPath,
+                              'chains': chains,
+                              'keepHetero': self.keepHetero.get(),
+                              'radius': radius, 'dir': moleculeDir,
+                              'pdb': os.path.join(moleculeDir, name + '.pdb'),
+                              'asa': os.path.join(moleculeDir, name + '_ASA.pdb'),
+                              'maps': []})
+        return molecules
+
+    def _addMapCommands(self, molecule, maps, radius):
+        """ Add the frodockgrid commands of the maps of a molecule, with a
+        grid covering radius. """
+        gridSize, gridSpacing = getGridSize(2 * (radius + GRID_PADDING),
+                                            self.gridSpacing.get(), MAX_GRID_SIZE)
+        interactionDict = ['E', 'A', None]
+        for outputSuffix, mValue in maps:
+            tValue = interactionDict[self.interactionType.get()] if mValue == 1 else None
+            pdbLink = os.path.join(molecule['dir'], 'tmp' + os.path.splitext(outputSuffix)[0],
+                                   os.path.basename(molecule['pdb']))
+            program, args = self.getFrodockGridCommand(program=self._getProgram(FRODOCKGRID),
+                                                       pdbFile=pdbLink,
+                                                       outputDir=molecule['dir'],
+                                                       outputSuffix=outputSuffix,
+                                                       mValue=mValue,
+                                                       tValue=tValue,
+                                                       gridSize=gridSize,
+                                                       gridSpacing=gridSpacing)
+            molecule['maps'].append({'file': os.path.join(molecule['dir'],
+                                                          molecule['name'] + outputSuffix),
+                                     'pdbLink': pdbLink,
+                                     'program': program, 'args': args,
+                                     'cacheArgs': [mValue, tValue, gridSize, gridSpacing]})
+
+    def _getWorkerCommand(self, manifestFile, taskIndex=None):
+        args = ['-m', 'proteindocking.campaign', manifestFile]
+        if taskIndex is not None:
+            args.append(taskIndex)
+        return sys.executable, args
+
+    def _runLocalTask(self, manifestFile, task, taskIndex):
+        """ Run a task in its own process, the local stand-in of a job array
+        task. Failures are reported by the task status. """
+        pwutils.makePath(task['dir'])
+        program, args = self._getWorkerCommand(manifestFile, taskIndex)
+        try:
+            runCommand(program, args, env=Plugin.getEnviron(),
+                       outputFile=os.path.join(task['dir'], 'task.log'))
+        except RuntimeError as e:
+            print('Task %d failed: %s' % (taskIndex, e), flush=True)
+            if getTaskStatus(task) is None:
+                with open(os.path.join(task['dir'], FAILED_FILE), 'w') as f:
+                    f.write(str(e))
+
+    def _runJobArray(self, manifestFile, tasks, pending):
+        """ Submit the pending tasks as a job array with the queue system of
+        the execution host and wait until all of them finish. """
+        hostConfig = self.getHostConfig()
+        submitCommand = hostConfig.getSubmitCommand()
+        template = hostConfig.getSubmitTemplate()
+        if not submitCommand or not template:
+            raise RuntimeError('The execution host has no queue system '
+                               'configured in hosts.conf')
+
+        # Pending tasks are listed in a file indexed by the array task id,
+        # so a resubmission only runs the unfinished ones
+        pendingFile = self._getCampaignPath('pending.txt')
+        with open(pendingFile, 'w') as f:
+            f.write('\n'.join(str(i) for i in pending) + '\n')
+        program, args = self._getWorkerCommand(manifestFile)
+        command = ('%s %s $(sed -n "$((%s + 1))p" %s)'
+                   % (program, ' '.join(args), self._getArrayIndexExpression(template),
+                      pendingFile))
+
+        queueName, queueParams = self.getQueueParams()
+        threads = self.threadsPerTask.get()
+        params = {'JOB_NAME': 'frodock_campaign_%s' % self.getObjId(),
+                  'JOB_SCRIPT': self._getCampaignPath('job_array.sh'),
+                  'JOB_LOGS': self._getCampaignPath('job_array'),
+                  'JOB_NODES': 1, 'JOB_THREADS': threads, 'JOB_CORES': threads,
+                  'JOB_HOURS': 24, 'JOB_MEMORY': '', 'QUEUE_NAME': queueName,
+                  'JOB_COMMAND': command}
+        params.update(queueParams)
+        lines = (template % params).splitlines()
+        lines.insert(1, self._getArrayDirective(template, len(pending)))
+        with open(params['JOB_SCRIPT'], 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+
+        output = subprocess.check_output(submitCommand % params, shell=True,
+                                         universal_newlines=True)
+        match = re.search(r'\d+', output)
+        jobId = match.group(0) if match else None
+        print('Submitted job array %s with %d tasks' % (jobId, len(pending)),
+              flush=True)
+
+        while True:
+            unfinished = [i for i in pending if getTaskStatus(tasks[i]) is None]
+            if not unfinished:
+                break
+            if jobId is not None and self._isJobDone(hostConfig, jobId):
+                # Tasks killed by the queue system leave no status
+                for i in pending:
+                    if getTaskStatus(tasks[i]) is None:
+                        with open(os.path.join(tasks[i]['dir'], FAILED_FILE), 'w') as f:
+                            f.write('The job array ended without finishing the task\n')
+                break
+            time.sleep(POLL_INTERVAL)
+
+    def _getArrayDirective(self, template, numberOfTasks):
+        """ Return the job array directive for the queue system of the
+        submit template. """
+        throttle = self.maxRunningTasks.get()
+        if '#SBATCH' in template:
+            return '#SBATCH --array=0-%d%s' % (numberOfTasks - 1,
+                                               '%%%d' % throttle if throttle else '')
+        if '#PBS' in template:
+            return '#PBS -J 0-%d' % (numberOfTasks - 1)
+        if '#$' in template:
+            return '#$ -t 1-%d%s' % (numberOfTasks,
+                                     ' -tc %d' % throttle if throttle else '')
+        raise RuntimeError('Job arrays are only supported with SLURM, PBS or '
+                           'SGE submit templates')
+
+    @staticmethod
+    def _getArrayIndexExpression(template):
+        """ Return the shell expression of the 0-based array task index. """
+        if '#SBATCH' in template:
+            return '$SLURM_ARRAY_TASK_ID'
+        if '#PBS' in template:
+            return '$PBS_ARRAY_INDEX'
+        return '$SGE_TASK_ID - 1'
+
+    @staticmethod
+    def _isJobDone(hostConfig, jobId):
+        """ Return True if the queue system no longer runs the job. """
+        checkCommand = hostConfig.getCheckCommand()
+        if not checkCommand:
+            return False
+        result = subprocess.run(checkCommand % {'JOB_ID': jobId}, shell=True,
+                                stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                universal_newlines=True)
+        doneRegex = hostConfig.getJobDoneRegex()
+        if doneRegex:
+            return re.search(doneRegex, result.stdout) is not None
+        return result.returncode != 0
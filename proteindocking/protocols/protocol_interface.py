@@ -0,0 +1,197 @@
+# **************************************************************************
+# *
+# * Authors: Yunior C. Fonseca Reyna    (cfonseca@cnb.csic.es)
+# *          Erney Ramirez Aportela     (eramirez@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+import numpy as np
+
+from pwem.protocols import EMProtocol
+from pyworkflow.object import Float, Integer, String
+from pyworkflow.protocol import (PointerParam, IntParam, FloatParam,
+                                 LEVEL_ADVANCED)
+import pyworkflow.utils as pwutils
+
+from proteindocking.interface import InterfaceAnalyzer, PROBE_RADIUS
+from proteindocking.objects import DockingSolution, SetOfDockingSolutions
+from proteindocking.profiling import PROFILE_FILE, profileStep, summarizeProfile
+from proteindocking.storage import SolutionsFile, writeSolutionsFile
+
+
+class ProtDockingInterface(EMProtocol):
+    """
+    Protocol to annotate docking solutions with their interface: atom
+    contacts and clashes, interface residues and buried surface area. The
+    poses are analyzed in batches against a cell list of the receptor, so
+    thousands of them are annotated without writing their complexes, and
+    implausible poses can be filtered out.
+    """
+    _label = 'docking interface'
+
+    def _defineParams(self, form):
+        form.addSection(label='Input')
+        form.addParam('inputSolutions', PointerParam,
+                      pointerClass='SetOfDockingSolutions',
+                      label="Docking solutions", important=True,
+                      help='Solutions of the FRODOCK or ZDOCK protocols')
+        form.addParam('numberOfPoses', IntParam, default=1000,
+                      label="Number of analyzed poses",
+                      help='Only the best scored solutions are analyzed. Use '
+                           '0 to analyze all of them.')
+        form.addParam('contactCutoff', FloatParam, default=5.0,
+                      label="Contact cutoff (A)",
+                      help='Receptor and ligand atoms closer than this '
+                           'distance are in contact, and their residues '
+                           'belong to the interface')
+        form.addParam('clashCutoff', FloatParam, default=3.0,
+                      expertLevel=LEVEL_ADVANCED,
+                      label="Clash cutoff (A)",
+                      help='Receptor and ligand atoms closer than this '
+                           'distance clash')
+        form.addParam('probeRadius', FloatParam, default=PROBE_RADIUS,
+                      expertLevel=LEVEL_ADVANCED,
+                      label="Probe radius (A)",
+                      help='Solvent probe radius of the accessible surface '
+                           'used for the buried surface area')
+        form.addSection(label='Filters')
+        form.addParam('minContacts', IntParam, default=0,
+                      label="Minimum contacts",
+                      help='Poses with fewer atom contacts are discarded')
+        form.addParam('maxClashes', IntParam, default=-1,
+                      label="Maximum clashes",
+                      help='Poses with more clashing atom pairs are '
+                           'discarded. Use -1 to keep all of them.')
+        form.addParam('minBuriedArea', FloatParam, default=0.0,
+                      label="Minimum buried area (A^2)",
+                      help='Poses burying less solvent accessible surface '
+                           '(receptor plus ligand) are discarded')
+        form.addParallelSection(threads=4, mpi=0)
+
+    def _insertAllSteps(self):
+        # The filters are arguments of the output step, so changing them
+        # does not repeat the analysis
+        self._insertFunctionStep(self.analyzeStep, self.numberOfPoses.get(),
+                                 self.contactCutoff.get(),
+                                 self.clashCutoff.get(),
+                                 self.probeRadius.get())
+        self._insertFunctionStep(self.createOutputStep, self.minContacts.get(),
+                                 self.maxClashes.get(),
+                                 self.minBuriedArea.get())
+
+    @profileStep
+    def analyzeStep(self, numberOfPoses, contactCutoff, clashCutoff,
+                    probeRadius):
+        """ Compute the interface of the best scored solutions. """
+        print(pwutils.yellowStr('Analyzing docking interfaces'), flush=True)
+        inputSet = self.inputSolutions.get()
+        solutions = inputSet.getPoses()
+        solutions = solutions[np.argsort(-solutions['score'], kind='stable')]
+        if numberOfPoses > 0:
+            solutions = solutions[:numberOfPoses]
+
+        analyzer = InterfaceAnalyzer(inputSet.getReceptorFile(),
+                                     inputSet.getLigandFile(),
+                                     contactCutoff=contactCutoff,
+                                     clashCutoff=clashCutoff, probe=probeRadius)
+        interface, receptorResidues, ligandResidues = \
+            analyzer.analyze(solutions, numberOfThreads=self.numberOfThreads.get())
+
+        writeSolutionsFile(self._getExtraPath('solutions.npz'), [solutions])
+        np.save(self._getExtraPath('interface.npy'), interface)
+        with open(self._getExtraPath('interface.txt'), 'w') as f:
+            f.write('# Rank\tScore\tContacts\tClashes\tBuriedArea'
+                    '\tReceptorResidues\tLigandResidues\n')
+            for row, values, receptorKeys, ligandKeys in zip(solutions, interface,
+                                                             receptorResidues,
+                                                             ligandResidues):
+                f.write('%d\t%.3f\t%d\t%d\t%.1f\t%s\t%s\n'
+                        % (row['rank'], row['score'], values['contacts'],
+                           values['clashes'], values['buriedArea'],
+                           ','.join(receptorKeys) or '-',
+                           ','.join(ligandKeys) or '-'))
+        print('%d poses analyzed' % len(solutions), flush=True)
+
+    @profileStep
+    def createOutputStep(self, minContacts, maxClashes, minBuriedArea):
+        inputSet = self.inputSolutions.get()
+        with SolutionsFile(self._getExtraPath('solutions.npz')) as solutionsFile:
+            solutions = solutionsFile.getAll()
+        interface = np.load(self._getExtraPath('interface.npy'))
+        residues = self._readInterfaceResidues()
+
+        keep = ((interface['contacts'] >= minContacts) &
+                (interface['buriedArea'] >= minBuriedArea))
+        if maxClashes >= 0:
+            keep &= interface['clashes'] <= maxClashes
+
+        outputSet = SetOfDockingSolutions.create(self._getPath(), prefix='docking_solutions')
+        outputSet.setReceptorFile(inputSet.getReceptorFile())
+        outputSet.setLigandFile(inputSet.getLigandFile())
+        solution = DockingSolution()
+        for i in np.flatnonzero(keep):
+            row, values = solutions[i], interface[i]
+            solution.setObjId(None)
+            solution.setRank(int(row['rank']))
+            solution.setEulerAngles(*row['euler'].tolist())
+            solution.setTranslation(*row['translation'].tolist())
+            solution.setScore(float(row['score']))
+            solution.setCluster(int(row['cluster']))
+            solution._interfaceContacts = Integer(int(values['contacts']))
+            solution._interfaceClashes = Integer(int(values['clashes']))
+            solution._buriedArea = Float(float(values['buriedArea']))
+            solution._receptorInterface = String(residues[i][0])
+            solution._ligandInterface = String(residues[i][1])
+            outputSet.append(solution)
+        print('%d of %d poses kept' % (keep.sum(), len(keep)), flush=True)
+        self._defineOutputs(outputSolutions=outputSet)
+        self._defineSourceRelation(self.inputSolutions, outputSet)
+
+    # --------------------------- INFO functions -----------------------------
+
+    def _summary(self):
+        summary = []
+        if self.hasAttribute('outputSolutions'):
+            summary.append('%d poses kept after the interface filters'
+                           % self.outputSolutions.getSize())
+        return summary + summarizeProfile(self._getExtraPath(PROFILE_FILE))
+
+    def _validate(self):
+        errors = []
+        if not self.inputSolutions.get().getLigandFile():
+            errors.append('The input solutions belong to several ligands. '
+                          'Please, select the solutions of a single ligand.')
+        return errors
+
+    # -----------------------Utils functions-------------------------------
+
+    def _readInterfaceResidues(self):
+        """ Return the receptor and ligand interface residues of every
+        analyzed pose, as written to interface.txt. """
+        residues = []
+        with open(self._getExtraPath('interface.txt')) as f:
+            for line in f:
+                if not line.startswith('#'):
+                    fields = line.rstrip('\n').split('\t')
+                    residues.append((fields[5], fields[6]))
+        return residues
@@ -24,9 +24,56 @@
 # *  e-mail address 'scipion@cnb.csic.es'
 # *
 # **************************************************************************
+import itertools
+import os
+import shutil
 
+import numpy as np
+
+from pwem.objects import AtomStruct, SetOfAtomStructs
 from pwem.protocols import EMProtocol
-from pyworkflow.protocol import PointerParam, EnumParam
+from pyworkflow.protocol import (PointerParam, BooleanParam, IntParam,
+                                 StringParam, STEPS_PARALLEL)
+import pyworkflow.utils as pwutils
+
+from proteindocking import Plugin
+from proteindocking.constants import (ZDOCK, MARK_SUR, CREATE_PL, CREATE_LIG,
+                                      BLOCK_PL, UNICHARMM)
+from proteindocking.convert import (loadZdockOutput, writeZdockOutput,
+                                    getStructureName, preparePdb, parseChains,
+                                    parseResidues, listResidues, getPoseCenter,
+                                    zdockToPoses, eulerToMatrix, matrixToEuler,
+                                    PdbTemplate)
+from proteindocking.objects import DockingSolution, SetOfDockingSolutions
+from proteindocking.storage import writeSolutionsFile
+from proteindocking.profiling import (PROFILE_FILE, ProgramProfile, profileStep,
+                                      summarizeProfile)
+
+# Angle (degrees) of the ligand rotations offsetting the chunks of a split
+# dense sampling, the spacing of the ZDOCK dense sampling
+CHUNK_OFFSET_ANGLE = 6.0
+
+
+def getChunkOffsets():
+    """ Return the rotations of the ligand searched by the chunks of a split
+    dense sampling: the identity and rotations of CHUNK_OFFSET_ANGLE around
+    the 14 neighbour directions of a body-centered cubic lattice. Each chunk
+    samples the 3600 rotations of the default ZDOCK sampling (15 degrees),
+    so the 15 chunks sample 54000 rotations, as the dense one does. """
+    axes = [np.zeros(3)]
+    axes += [sign * axis for axis in np.eye(3) for sign in (1, -1)]
+    axes += [np.array(signs) / np.sqrt(3)
+             for signs in itertools.product((1, -1), repeat=3)]
+    angle = np.radians(CHUNK_OFFSET_ANGLE)
+    offsets = []
+    for axis in axes:
+        # Rodrigues formula
+        cross = np.array([[0, -axis[2], axis[1]],
+                          [axis[2], 0, -axis[0]],
+                          [-axis[1], axis[0], 0]])
+        offsets.append(np.eye(3) + np.sin(angle) * cross
+                       + (1 - np.cos(angle)) * cross @ cross)
+    return np.array(offsets)
 
 
 class ProtZdockProtein(EMProtocol):
@@ -44,12 +91,336 @@ class ProtZdockProtein(EMProtocol):
                       pointerClass='AtomStruct',
                       label="ligand pdb", important=True,
                       help='The ligand pdb')
-        form.addParam('interactionType', EnumParam,
-                      choices=['Enzyme-Substrate', 'Antigen-Antibody', 'Unknown'],
-                      default=2,
-                      label="Type of interaction",
-                      help='Type of interaction')
+        form.addParam('denseSampling', BooleanParam, default=False,
+                      label="Dense rotational sampling?",
+                      help='Use the dense rotational sampling of ZDOCK '
+                           '(6 degrees, 54000 rotations) instead of the '
+                           'default one (15 degrees, 3600 rotations)')
+        form.addParam('splitSampling', BooleanParam, default=True,
+                      condition='denseSampling',
+                      label="Split the dense sampling in parallel searches?",
+                      help='ZDOCK runs on a single core. The dense sampling is '
+                           'split in 15 searches of the default sampling, each '
+                           'one with the ligand rotated by a different 6 '
+                           'degrees offset, and they run in parallel (one per '
+                           'thread, or as MPI jobs). Together they sample '
+                           '54000 rotations as the dense sampling does, though '
+                           'not the same ones. The predictions of all the '
+                           'searches are merged by score.')
+        form.addParam('numberOfPredictions', IntParam, default=2000,
+                      label="Number of predictions",
+                      help='Number of best scored predictions kept by '
+                           'ZDOCK')
+        form.addParam('numberOfPoses', IntParam, default=10,
+                      label="Number of output complexes",
+                      help='Number of best scored predictions written as '
+                           'receptor-ligand complexes')
+        form.addSection(label='Preprocessing')
+        form.addParam('receptorChains', StringParam, default='',
+                      label="Receptor chains",
+                      help='Chains of the receptor to dock, separated by '
+                           'commas, e.g. A, B. Leave empty to keep all of '
+                           'them.')
+        form.addParam('ligandChains', StringParam, default='',
+                      label="Ligand chains",
+                      help='Chains of the ligand to dock, separated by '
+                           'commas. Leave empty to keep all of them.')
+        form.addParam('keepHetero', BooleanParam, default=False,
+                      label="Keep hetero atoms?",
+                      help='Waters and alternate locations (but the most '
+                           'occupied one) are always removed before docking. Hetero '
+                           'atoms (ligands, ions...) are removed too unless '
+                           'this option is set.')
+        form.addSection(label='Restraints')
+        form.addParam('receptorResidues', StringParam, default='',
+                      label="Receptor interface residues",
+                      help='Known receptor residues at the interface, e.g. '
+                           'A:45-50, A:72. All the other receptor residues '
+                           'are blocked (ZDOCK atom type 19), so poses '
+                           'contacting them are penalized.')
+        form.addParam('ligandResidues', StringParam, default='',
+                      label="Ligand interface residues",
+                      help='Known ligand residues at the interface, e.g. '
+                           'H:100-110. All the other ligand residues are '
+                           'blocked.')
         form.addParallelSection(threads=4, mpi=1)
 
+    def __init__(self, **kwargs):
+        EMProtocol.__init__(self, **kwargs)
+        self.stepsExecutionMode = STEPS_PARALLEL
+
     def _insertAllSteps(self):
-        pass
+        markStepIds = []
+        for pdbKey, chainsParam in [('receptor', self.receptorChains),
+                                    ('ligand', self.ligandChains)]:
+            markStepIds.append(self._insertFunctionStep(self.markSurfaceStep, pdbKey,
+                                                        chainsParam.get() or '',
+                                                        self.keepHetero.get(),
+                                                        prerequisites=[]))
+        numberOfChunks = self._getNumberOfChunks()
+        searchStepIds = [self._insertFunctionStep(self.dockingSearchStep, chunk,
+                                                  numberOfChunks,
+                                                  prerequisites=markStepIds)
+                         for chunk in range(numberOfChunks)]
+        self._insertFunctionStep(self.createOutputStep, numberOfChunks,
+                                 prerequisites=searchStepIds)
+
+    @profileStep
+    def markSurfaceStep(self, pdbKey, chains, keepHetero):
+        """ Assign the ZDOCK atom types and mark the surface atoms of the
+        receptor or ligand with mark_sur. The structure is first reduced to
+        the docked atoms (see convert.preparePdb). """
+        print(pwutils.yellowStr('Marking the %s surface' % pdbKey), flush=True)
+        inputPath = self._getInputPdbPath(pdbKey)
+        pdbPath = self._getTmpPath(pdbKey + '.pdb')
+        numberOfAtoms, chainMap = preparePdb(inputPath, pdbPath,
+                                             chains=parseChains(chains),
+                                             keepHetero=keepHetero)
+        if not numberOfAtoms:
+            raise ValueError('No atoms left in %s after removing waters, '
+                             'hetero atoms and unselected chains' % inputPath)
+        for chain, newChain in chainMap.items():
+            print('Chain %s of %s is written as chain %s' % (chain, inputPath,
+                                                              newChain),
+                  flush=True)
+
+        # mark_sur reads uniCHARMM from its working directory
+        workingDir = self._getTmpPath(pdbKey)
+        pwutils.makePath(workingDir)
+        pwutils.createLink(self._getProgram(UNICHARMM),
+                           os.path.join(workingDir, UNICHARMM))
+        program, args = self.getMarkSurCommand(program=self._getProgram(MARK_SUR),
+                                               pdbFile=os.path.abspath(pdbPath),
+                                               outputFile=self._getMarkedPdbPath(pdbKey))
+        Plugin.runProgram(program, args, cwd=workingDir)
+
+        interfaceParam = (self.receptorResidues if pdbKey == 'receptor'
+                          else self.ligandResidues)
+        interface = parseResidues(interfaceParam.get() or '')
+        if interface:
+            self._blockResidues(pdbKey, interface)
+
+    @profileStep
+    def dockingSearchStep(self, chunk=0, numberOfChunks=1):
+        """ Run a ZDOCK search: over the whole rotational set, or one chunk
+        of the split dense sampling. """
+        ligandFile = self._getMarkedPdbPath('ligand')
+        if numberOfChunks > 1:
+            print(pwutils.yellowStr('Executing docking search %d of %d'
+                                    % (chunk + 1, numberOfChunks)), flush=True)
+            # The chunk ligand is rotated by its offset around its center
+            ligand = PdbTemplate(ligandFile)
+            center = getPoseCenter(ligandFile)
+            ligandFile = self._getChunkLigandPath(chunk)
+            with open(ligandFile, 'w') as f:
+                f.write(ligand.format((ligand.coords - center)
+                                      @ getChunkOffsets()[chunk].T + center))
+        else:
+            print(pwutils.yellowStr('Executing docking search'), flush=True)
+        program, args = self.getZdockCommand(program=self._getProgram(ZDOCK),
+                                             recFile=self._getMarkedPdbPath('receptor'),
+                                             ligFile=ligandFile,
+                                             denseSampling=(self.denseSampling.get()
+                                                            and numberOfChunks == 1),
+                                             outputFile=self._getZdockOutputPath(chunk,
+                                                                                 numberOfChunks))
+        if self.numberOfMpi.get() > 1:
+            # Let the Scipion steps executor place the search
+            with ProgramProfile(program):
+                self.runJob(program, ' '.join(str(arg) for arg in args),
+                            env=Plugin.getEnviron())
+        else:
+            Plugin.runProgram(program, args)
+
+    @profileStep
+    def createOutputStep(self, numberOfChunks=1):
+        headers, solutions, chunks = self._readSolutions(numberOfChunks)
+        # Raw predictions, each one in the frame of its search
+        writeSolutionsFile(self._getExtraPath('zdock.npz'), [solutions])
+        ligandCenter = getPoseCenter(self._getMarkedPdbPath('ligand'))
+        poses = solutions.copy()
+        offsets = getChunkOffsets()
+        for chunk, header in enumerate(headers):
+            selected = chunks == chunk
+            chunkPoses = zdockToPoses(header, solutions[selected], ligandCenter)
+            if numberOfChunks > 1:
+                # The ligand of the chunk was rotated by its offset first
+                chunkPoses['euler'] = matrixToEuler(eulerToMatrix(chunkPoses['euler'])
+                                                    @ offsets[chunk])
+            poses[selected] = chunkPoses
+        writeSolutionsFile(self._getExtraPath('zdock_poses.npz'), [poses])
+
+        outputSet = SetOfDockingSolutions.create(self._getPath(), prefix='docking_solutions')
+        outputSet.setReceptorFile(self._getMarkedPdbPath('receptor'))
+        outputSet.setLigandFile(self._getMarkedPdbPath('ligand'))
+        outputSet.setPosesFile(os.path.abspath(self._getExtraPath('zdock_poses.npz')))
+        solution = DockingSolution()
+        for row in solutions:
+            solution.setObjId(None)
+            solution.setRank(int(row['rank']))
+            solution.setEulerAngles(*row['euler'].tolist())
+            solution.setTranslation(*row['translation'].tolist())
+            solution.setScore(float(row['score']))
+            solution.setCluster(int(row['cluster']))
+            outputSet.append(solution)
+
+        numberOfPoses = self.numberOfPoses.get()
+        complexFiles = self._createComplexes(headers, solutions[:numberOfPoses],
+                                             chunks[:numberOfPoses])
+        complexesSet = SetOfAtomStructs.create(self._getPath(), prefix='complexes')
+        for complexFile in complexFiles:
+            complexesSet.append(AtomStruct(filename=complexFile))
+
+        self._defineOutputs(outputSolutions=outputSet,
+                            outputComplexes=complexesSet)
+        for output in [outputSet, complexesSet]:
+            self._defineSourceRelation(self.inputPdbReceptor, output)
+            self._defineSourceRelation(self.inputPdbLigand, output)
+
+    # --------------------------- INFO functions -----------------------------
+
+    def _summary(self):
+        return summarizeProfile(self._getExtraPath(PROFILE_FILE))
+
+    def _validate(self):
+        return Plugin.validateTools([ZDOCK, MARK_SUR, CREATE_PL, CREATE_LIG,
+                                     BLOCK_PL, UNICHARMM])
+
+    # -----------------------Utils functions-------------------------------
+
+    def _getInputPdbPath(self, pdbKey):
+        """ Return the absolute path of the receptor or ligand pdb. """
+        inputPdb = (self.inputPdbReceptor if pdbKey == 'receptor'
+                    else self.inputPdbLigand)
+        return os.path.abspath(inputPdb.get().getFileName())
+
+    def _getMarkedPdbPath(self, pdbKey):
+        """ Return the path of the pdb with the surface marked by mark_sur. """
+        fileName = getStructureName(self._getInputPdbPath(pdbKey))
+        if (pdbKey != 'receptor' and
+                fileName == getStructureName(self._getInputPdbPath('receptor'))):
+            # e.g. chains of the same structure docked against each other
+            fileName += '_' + pdbKey
+        return os.path.abspath(self._getExtraPath(fileName + '_m.pdb'))
+
+    def _blockResidues(self, pdbKey, interface):
+        """ Block all the residues of the marked pdb that are not in the
+        interface, with the ZDOCK block.pl script. """
+        markedPdbPath = self._getMarkedPdbPath(pdbKey)
+        blockFilePath = self._getTmpPath('%s_blocked.txt' % pdbKey)
+        with open(blockFilePath, 'w') as f:
+            for chain, number in listResidues(markedPdbPath):
+                if (chain, number) not in interface and ('', number) not in interface:
+                    f.write('%s %s\n' % (number, chain))
+
+        blockedPdbPath = self._getTmpPath('%s_blocked.pdb' % pdbKey)
+        program, args = self.getBlockCommand(program=self._getProgram(BLOCK_PL),
+                                             pdbFile=markedPdbPath,
+                                             blockFile=blockFilePath)
+        Plugin.runProgram(program, args, outputFile=blockedPdbPath)
+        os.replace(blockedPdbPath, markedPdbPath)
+
+    def _getNumberOfChunks(self):
+        """ Return the number of searches the rotational sampling is split
+        in. """
+        if self.denseSampling and self.splitSampling:
+            return len(getChunkOffsets())
+        return 1
+
+    def _getZdockOutputPath(self, chunk=0, numberOfChunks=1):
+        if numberOfChunks > 1:
+            return os.path.abspath(self._getExtraPath('zdock_%02d.out' % chunk))
+        return os.path.abspath(self._getExtraPath('zdock.out'))
+
+    def _getChunkLigandPath(self, chunk):
+        """ Return the marked ligand rotated by the offset of a chunk. """
+        return os.path.abspath(self._getExtraPath('ligand_chunk_%02d.pdb' % chunk))
+
+    def _getProgram(self, programName):
+        """ Return program binary. """
+        return Plugin.getProgram(programName)
+
+    def _readSolutions(self, numberOfChunks=1):
+        """ Merge the predictions of all the searches. Return the header of
+        every search output, the best predictions ranked by decreasing score
+        and the search each one comes from. """
+        headers = []
+        chunkSolutions = []
+        chunkIds = []
+        for chunk in range(numberOfChunks):
+            header, solutions = loadZdockOutput(self._getZdockOutputPath(chunk,
+                                                                         numberOfChunks))
+            headers.append(header)
+            chunkSolutions.append(solutions)
+            chunkIds.append(np.full(len(solutions), chunk, dtype=np.int32))
+        solutions = np.concatenate(chunkSolutions)
+        chunks = np.concatenate(chunkIds)
+
+        order = np.argsort(-solutions['score'],
+                           kind='stable')[:self.numberOfPredictions.get()]
+        solutions = solutions[order]
+        solutions['rank'] = np.arange(1, len(solutions) + 1)
+        return headers, solutions, chunks[order]
+
+    def _createComplexes(self, headers, solutions, chunks):
+        """ Generate the complexes of the given solutions with create.pl,
+        once per search since every search has its own ligand and header.
+        Return the complex files sorted by rank. """
+        complexesDir = self._getExtraPath('complexes')
+        pwutils.makePath(complexesDir)
+        complexFiles = {}
+        for chunk in np.unique(chunks):
+            chunkSolutions = solutions[chunks == chunk]
+            # create.pl calls create_lig from its working directory
+            workingDir = self._getTmpPath('create_%02d' % chunk)
+            pwutils.makePath(workingDir)
+            pwutils.createLink(self._getProgram(CREATE_LIG),
+                               os.path.join(workingDir, CREATE_LIG))
+            writeZdockOutput(os.path.join(workingDir, 'zdock.out'),
+                             headers[chunk], chunkSolutions)
+            program, args = self.getCreateCommand(program=self._getProgram(CREATE_PL),
+                                                  zdockFile='zdock.out')
+            Plugin.runProgram(program, args, cwd=workingDir)
+
+            for i, rank in enumerate(chunkSolutions['rank']):
+                complexFile = os.path.join(complexesDir, 'complex_%04d.pdb' % rank)
+                shutil.move(os.path.join(workingDir, 'complex.%d' % (i + 1)),
+                            complexFile)
+                complexFiles[rank] = complexFile
+        return [complexFiles[rank] for rank in sorted(complexFiles)]
+
+    def getMarkSurCommand(self, **kwargs):
+        program = kwargs.get('program')
+        pdbInputFile = kwargs.get('pdbFile')
+        outFile = kwargs.get('outputFile')
+
+        params = [pdbInputFile, outFile]
+        return program, params
+
+    def getBlockCommand(self, **kwargs):
+        program = kwargs.get('program')
+        pdbInputFile = kwargs.get('pdbFile')
+        blockFile = kwargs.get('blockFile')
+
+        params = [pdbInputFile, blockFile]
+        return program, params
+
+    def getZdockCommand(self, **kwargs):
+        program = kwargs.get('program')
+        recInputFile = kwargs.get('recFile')
+        ligInputFile = kwargs.get('ligFile')
+        denseSampling = kwargs.get('denseSampling', self.denseSampling.get())
+        outFile = kwargs.get('outputFile')
+
+        params = ['-R', recInputFile, '-L', ligInputFile,
+                  '-N', self.numberOfPredictions.get(), '-o', outFile]
+        if denseSampling:
+            params.append('-D')
+        return program, params
+
+    def getCreateCommand(self, **kwargs):
+        program = kwargs.get('program')
+        inputZdockFile = kwargs.get('zdockFile')
+
+        params = [inputZdockFile]
+        return program, params
@@ -24,31 +24,197 @@
 # *  e-mail address 'scipion@cnb.csic.es'
 # *
 # **************************************************************************
+import os
+
+import numpy as np
+
+from pwem.objects import AtomStruct, SetOfAtomStructs
 from pwem.protocols import EMProtocol
-from pyworkflow.protocol import PointerParam, EnumParam
+from pyworkflow.object import Float
+from pyworkflow.protocol import PointerParam, IntParam, STEPS_PARALLEL
+import pyworkflow.utils as pwutils
+
+from proteindocking import Plugin
+from proteindocking.constants import ZRANK
+from proteindocking.convert import loadZrankScores, writeComplexes
+from proteindocking.objects import DockingSolution, SetOfDockingSolutions
+from proteindocking.profiling import (PROFILE_FILE, ProgramProfile, profileStep,
+                                      summarizeProfile)
+from proteindocking.storage import SolutionsFile, writeSolutionsFile
+
+# Maximum number of complexes written at once by a ranking step
+CHUNK_SIZE = 500
 
 
 class ProtZrankProtein(EMProtocol):
     """
-    Protocol to perform protein-protein docking using the ZRANK docking tool
+    Protocol to re-rank docking solutions using the ZRANK scoring function.
+    The complexes are generated chunk by chunk in temporary folders and
+    removed once scored, so only the output complexes are kept.
     """
 
     def _defineParams(self, form):
         form.addSection(label='Input')
-        form.addParam('inputPdbReceptor', PointerParam,
-                      pointerClass='AtomStruct',
-                      label="Receptor pdb", important=True,
-                      help='The receptor pdb')
-        form.addParam('inputPdbLigand', PointerParam,
-                      pointerClass='AtomStruct',
-                      label="ligand pdb", important=True,
-                      help='The ligand pdb')
-        form.addParam('interactionType', EnumParam,
-                      choices=['Enzyme-Substrate', 'Antigen-Antibody', 'Unknown'],
-                      default=2,
-                      label="Type of interaction",
-                      help='Type of interaction')
+        form.addParam('inputSolutions', PointerParam,
+                      pointerClass='SetOfDockingSolutions',
+                      label="Docking solutions", important=True,
+                      help='Solutions of the ZDOCK or FRODOCK protocols')
+        form.addParam('maxPoses', IntParam, default=0,
+                      label="Number of scored solutions",
+                      help='Only the best ranked solutions are scored. Use 0 '
+                           'to score all of them.')
+        form.addParam('numberOfPoses', IntParam, default=10,
+                      label="Number of output complexes",
+                      help='Number of best ZRANK scored solutions written as '
+                           'receptor-ligand complexes')
         form.addParallelSection(threads=4, mpi=1)
 
+    def __init__(self, **kwargs):
+        EMProtocol.__init__(self, **kwargs)
+        self.stepsExecutionMode = STEPS_PARALLEL
+
     def _insertAllSteps(self):
-        pass
\ No newline at end of file
+        # The solutions are split in at least one chunk per thread, scored
+        # in parallel and merged at the end
+        numberOfSolutions = self.inputSolutions.get().getSize()
+        if self.maxPoses.get() > 0:
+            numberOfSolutions = min(numberOfSolutions, self.maxPoses.get())
+        numberOfChunks = max(1, min(numberOfSolutions,
+                                    max(self.numberOfThreads.get(),
+                                        -(-numberOfSolutions // CHUNK_SIZE))))
+        bounds = np.linspace(0, numberOfSolutions, numberOfChunks + 1).astype(int)
+        convertStepId = self._insertFunctionStep(self.convertInputStep,
+                                                 numberOfSolutions)
+        rankStepIds = [self._insertFunctionStep(self.rankingStep, chunk,
+                                                int(bounds[chunk]),
+                                                int(bounds[chunk + 1]),
+                                                prerequisites=[convertStepId])
+                       for chunk in range(numberOfChunks)]
+        self._insertFunctionStep(self.createOutputStep, numberOfChunks,
+                                 prerequisites=rankStepIds)
+
+    @profileStep
+    def convertInputStep(self, numberOfSolutions):
+        """ Store the best ranked solutions in the plugin pose convention. """
+        poses = self.inputSolutions.get().getPoses()
+        poses = poses[np.argsort(poses['rank'], kind='stable')][:numberOfSolutions]
+        writeSolutionsFile(self._getPosesPath(), [poses])
+
+    @profileStep
+    def rankingStep(self, chunk, first, last):
+        """ Write the complexes of a chunk of solutions in a temporary
+        folder, score them with ZRANK and remove them. """
+        print(pwutils.yellowStr('Scoring complexes of chunk %d' % chunk), flush=True)
+        inputSet = self.inputSolutions.get()
+        with SolutionsFile(self._getPosesPath()) as solutionsFile:
+            poses = solutionsFile.getAll()[first:last]
+        workingDir = os.path.abspath(self._getTmpPath('chunk_%02d' % chunk))
+        pwutils.cleanPath(workingDir)
+        pwutils.makePath(workingDir)
+        complexFiles = writeComplexes(inputSet.getReceptorFile(),
+                                      inputSet.getLigandFile(), poses,
+                                      os.path.join(workingDir, 'complex_%06d.pdb'))
+        listFile = os.path.join(workingDir, 'complexes.list')
+        with open(listFile, 'w') as f:
+            f.write('\n'.join(complexFiles) + '\n')
+
+        program, args = self.getZrankCommand(program=self._getProgram(ZRANK),
+                                             listFile=listFile)
+        if self.numberOfMpi.get() > 1:
+            # Let the Scipion MPI step executor place the job on a node
+            with ProgramProfile(program):
+                self.runJob(program, ' '.join(str(arg) for arg in args),
+                            env=Plugin.getEnviron(), cwd=workingDir)
+        else:
+            Plugin.runProgram(program, args, cwd=workingDir)
+        scores = loadZrankScores(listFile + '.zr.out')
+        with open(self._getChunkScoresPath(chunk), 'w') as f:
+            for index, complexFile in enumerate(complexFiles, first):
+                f.write('%d\t%.3f\n' % (index, scores[complexFile]))
+        pwutils.cleanPath(workingDir)
+
+    @profileStep
+    def createOutputStep(self, numberOfChunks):
+        inputSet = self.inputSolutions.get()
+        with SolutionsFile(self._getPosesPath()) as solutionsFile:
+            poses = solutionsFile.getAll()
+        scores = np.empty(len(poses))
+        for chunk in range(numberOfChunks):
+            chunkScores = np.loadtxt(self._getChunkScoresPath(chunk), ndmin=2)
+            scores[chunkScores[:, 0].astype(int)] = chunkScores[:, 1]
+
+        # ZRANK scores are energies, the lower the better
+        order = np.argsort(scores, kind='stable')
+        ranked = poses[order]
+        ranked['rank'] = np.arange(1, len(ranked) + 1)
+        scores = scores[order]
+        posesPath = os.path.abspath(self._getExtraPath('zrank_poses.npz'))
+        writeSolutionsFile(posesPath, [ranked])
+        with open(self._getExtraPath('zrank.txt'), 'w') as f:
+            f.write('# Rank\tInputRank\tZrankScore\n')
+            for rank, inputRank, score in zip(ranked['rank'], poses['rank'][order],
+                                              scores):
+                f.write('%d\t%d\t%.3f\n' % (rank, inputRank, score))
+
+        outputSet = SetOfDockingSolutions.create(self._getPath(), prefix='docking_solutions')
+        outputSet.setReceptorFile(inputSet.getReceptorFile())
+        outputSet.setLigandFile(inputSet.getLigandFile())
+        outputSet.setPosesFile(posesPath)
+        solution = DockingSolution()
+        for row, score in zip(ranked, scores):
+            solution.setObjId(None)
+            solution.setRank(int(row['rank']))
+            solution.setEulerAngles(*row['euler'].tolist())
+            solution.setTranslation(*row['translation'].tolist())
+            solution.setScore(float(row['score']))
+            solution.setCluster(int(row['cluster']))
+            solution._zrankScore = Float(float(score))
+            outputSet.append(solution)
+
+        complexesDir = self._getExtraPath('complexes')
+        pwutils.makePath(complexesDir)
+        complexFiles = writeComplexes(inputSet.getReceptorFile(),
+                                      inputSet.getLigandFile(),
+                                      ranked[:self.numberOfPoses.get()],
+                                      os.path.join(complexesDir, 'complex_%04d.pdb'))
+        complexesSet = SetOfAtomStructs.create(self._getPath(), prefix='complexes')
+        for complexFile, score in zip(complexFiles, scores):
+            atomStruct = AtomStruct(filename=complexFile)
+            atomStruct._zrankScore = Float(float(score))
+            complexesSet.append(atomStruct)
+
+        self._defineOutputs(outputSolutions=outputSet,
+                            outputComplexes=complexesSet)
+        for output in [outputSet, complexesSet]:
+            self._defineSourceRelation(self.inputSolutions, output)
+
+    # --------------------------- INFO functions -----------------------------
+
+    def _summary(self):
+        return summarizeProfile(self._getExtraPath(PROFILE_FILE))
+
+    def _validate(self):
+        errors = Plugin.validateTools([ZRANK])
+        if not self.inputSolutions.get().getLigandFile():
+            errors.append('The input solutions belong to several ligands. '
+                          'Please, select the solutions of a single ligand.')
+        return errors
+
+    # -----------------------Utils functions-------------------------------
+
+    def _getPosesPath(self):
+        return self._getExtraPath('poses.npz')
+
+    def _getChunkScoresPath(self, chunk):
+        return self._getExtraPath('zrank_%02d.txt' % chunk)
+
+    def _getProgram(self, programName):
+        """ Return program binary. """
+        return Plugin.getProgram(programName)
+
+    def getZrankCommand(self, **kwargs):
+        program = kwargs.get('program')
+        listFile = kwargs.get('listFile')
+
+        params = [listFile]
+        return program, params
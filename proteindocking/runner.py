@@ -0,0 +1,78 @@
+# **************************************************************************
+# *
+# * Authors: Yunior C. Fonseca Reyna    (cfonseca@cnb.csic.es)
+# *          Erney Ramirez Aportela     (eramirez@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+import os
+import subprocess
+import sys
+import time
+
+
+def runCommand(program, args, env=None, cwd=None, outputFile=None):
+    """
+    Run program with the list of arguments args without a shell. The output
+    of the program is streamed line by line to the current stdout (the run
+    log when called from a protocol) and an exception is raised if the
+    program exits with a non-zero status. If outputFile is given, the program
+    stdout is written to that file and only stderr goes to the log.
+    Return a dict with the wall time, cpu time (seconds), peak resident
+    memory and bytes read and written (block io) of the invocation.
+    """
+    cmd = [program] + [str(arg) for arg in args]
+    start = time.time()
+    if outputFile is None:
+        stdout, stderr = subprocess.PIPE, subprocess.STDOUT
+    else:
+        stdout, stderr = open(outputFile, 'w'), subprocess.PIPE
+    process = subprocess.Popen(cmd, env=env, cwd=cwd,
+                               stdout=stdout, stderr=stderr,
+                               universal_newlines=True, bufsize=1)
+    logPipe = process.stdout if outputFile is None else process.stderr
+    for line in logPipe:
+        sys.stdout.write(line)
+        sys.stdout.flush()
+    logPipe.close()
+    if outputFile is not None:
+        stdout.close()
+
+    # wait4 reports the resources used by this child only
+    _, status, usage = os.wait4(process.pid, 0)
+    if os.WIFSIGNALED(status):
+        process.returncode = -os.WTERMSIG(status)
+    else:
+        process.returncode = os.WEXITSTATUS(status)
+    stats = {'program': os.path.basename(program),
+             'wallTime': time.time() - start,
+             'cpuTime': usage.ru_utime + usage.ru_stime,
+             'maxRss': usage.ru_maxrss * 1024,
+             'readBytes': usage.ru_inblock * 512,
+             'writeBytes': usage.ru_oublock * 512}
+
+    if process.returncode != 0:
+        raise RuntimeError('%s failed with exit code %d. Command: %s'
+                           % (stats['program'], process.returncode,
+                              ' '.join(cmd)))
+    return stats
@@ -0,0 +1,139 @@
+# **************************************************************************
+# *
+# * Authors: Yunior C. Fonseca Reyna    (cfonseca@cnb.csic.es)
+# *          Erney Ramirez Aportela     (eramirez@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+import os
+import zipfile
+
+import numpy as np
+
+from .convert import SOLUTION_DTYPE
+
+# Columns stored for every block of solutions and their on-disk types
+COLUMNS = [('rank', np.int32), ('euler', np.float32),
+           ('translation', np.float32), ('score', np.float32),
+           ('cluster', np.int32)]
+
+
+def writeSolutionsFile(fileName, chunks, blockSize=65536):
+    """
+    Write docking solutions to a compressed columnar .npz file. The
+    solutions (iterable of SOLUTION_DTYPE arrays) are stored in blocks of
+    blockSize rows, every column of every block compressed as a separate
+    member, so they can be read block by block. Return the number of
+    solutions written.
+    """
+    blockSizes = []
+    isSorted = True
+    lastScore = np.inf
+    pending = np.empty(0, dtype=SOLUTION_DTYPE)
+    tmpFileName = fileName + '.tmp'
+
+    with zipfile.ZipFile(tmpFileName, 'w', compression=zipfile.ZIP_DEFLATED,
+                         allowZip64=True) as zf:
+        def writeBlock(block):
+            for column, dtype in COLUMNS:
+                with zf.open('%s_%06d.npy' % (column, len(blockSizes)), 'w',
+                             force_zip64=True) as f:
+                    np.lib.format.write_array(f, block[column].astype(dtype))
+            blockSizes.append(len(block))
+
+        for chunk in chunks:
+            if len(chunk):
+                scores = chunk['score']
+                isSorted = (isSorted and scores[0] <= lastScore and
+                            bool(np.all(scores[1:] <= scores[:-1])))
+                lastScore = scores[-1]
+            pending = np.concatenate([pending, chunk])
+            while len(pending) >= blockSize:
+                writeBlock(pending[:blockSize])
+                pending = pending[blockSize:]
+        if len(pending) or not blockSizes:
+            writeBlock(pending)
+
+        for name, value in [('blocks', np.array(blockSizes, dtype=np.int64)),
+                            ('sorted', np.array(isSorted))]:
+            with zf.open(name + '.npy', 'w') as f:
+                np.lib.format.write_array(f, value)
+
+    os.replace(tmpFileName, fileName)
+    return int(sum(blockSizes))
+
+
+class SolutionsFile:
+    """ Read access to the docking solutions stored by writeSolutionsFile.
+    Blocks are decompressed on demand, so reading the best solutions of a
+    sorted file only touches its first blocks. """
+    def __init__(self, fileName):
+        self._npz = np.load(fileName)
+        self._blockSizes = self._npz['blocks']
+        self.isSorted = bool(self._npz['sorted'])
+
+    def __len__(self):
+        return int(self._blockSizes.sum())
+
+    def close(self):
+        self._npz.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def getBlock(self, index):
+        """ Return the solutions of a block as a SOLUTION_DTYPE array. """
+        block = np.empty(self._blockSizes[index], dtype=SOLUTION_DTYPE)
+        for column, _ in COLUMNS:
+            block[column] = self._npz['%s_%06d' % (column, index)]
+        return block
+
+    def iterBlocks(self):
+        for index in range(len(self._blockSizes)):
+            yield self.getBlock(index)
+
+    def getTop(self, n):
+        """ Return the n best scored solutions, sorted by decreasing score. """
+        if self.isSorted:
+            blocks = []
+            for block in self.iterBlocks():
+                blocks.append(block)
+                if sum(len(b) for b in blocks) >= n:
+                    break
+            top = np.concatenate(blocks) if blocks else np.empty(0, SOLUTION_DTYPE)
+            return top[:n]
+
+        top = np.empty(0, dtype=SOLUTION_DTYPE)
+        for block in self.iterBlocks():
+            top = np.concatenate([top, block])
+            if len(top) > n:
+                top = top[np.argpartition(-top['score'], n)[:n]]
+        return top[np.argsort(-top['score'], kind='stable')]
+
+    def getAll(self):
+        """ Return all the solutions. """
+        blocks = list(self.iterBlocks())
+        return np.concatenate(blocks) if blocks else np.empty(0, SOLUTION_DTYPE)
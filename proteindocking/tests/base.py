@@ -0,0 +1,141 @@
+# **************************************************************************
+# *
+# * Authors: Yunior C. Fonseca Reyna    (cfonseca@cnb.csic.es)
+# *          Erney Ramirez Aportela     (eramirez@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+"""
+Base of the protocol tests: a test project where the docking engines are
+replaced by the stand-in programs (see standins.py), and checks of the
+protocol outputs.
+"""
+
+import os
+import tempfile
+
+import numpy as np
+from pwem.protocols import ProtImportPdb, ProtImportSetOfAtomStructs
+from pyworkflow.tests import BaseTest, setupTestOutput, setupTestProject
+
+from proteindocking import Plugin
+from proteindocking.constants import FRODOCK_MAPS_CACHE
+from proteindocking.convert import PdbTemplate, getPoseCenter, transformPoses
+from proteindocking.profiling import PROFILE_FILE, loadProfile
+from proteindocking.tests.standins import installStandIns, writeSyntheticPdb
+
+
+class DockingTest(BaseTest):
+    """ Protocol tests run with the stand-in programs. """
+    @classmethod
+    def setUpClass(cls):
+        setupTestProject(cls)
+        setupTestOutput(cls)
+        cls._setupMapCache()
+        cls._setupStandIns()
+
+    @classmethod
+    def _setupMapCache(cls):
+        """ Use an empty maps cache, so no map of other runs is reused. """
+        os.environ[FRODOCK_MAPS_CACHE] = tempfile.mkdtemp(prefix='maps-cache-')
+        Plugin._defineVariables()
+
+    @classmethod
+    def _setupStandIns(cls):
+        # The variables are read again by the protocol run processes
+        enginesDir = os.path.abspath(cls.proj.getTmpPath('engines'))
+        os.environ.update(installStandIns(enginesDir))
+        Plugin._defineVariables()
+
+    @classmethod
+    def _importPdb(cls, pdbFile):
+        protImport = cls.newProtocol(ProtImportPdb,
+                                     inputPdbData=ProtImportPdb.IMPORT_FROM_FILES,
+                                     pdbFile=pdbFile)
+        cls.launchProtocol(protImport)
+        return protImport.outputPdb
+
+    @classmethod
+    def _importSyntheticPdb(cls, name, numberOfResidues, chain='A', seed=0,
+                            center=(0.0, 0.0, 0.0)):
+        """ Import a made-up structure (see standins.writeSyntheticPdb). """
+        pdbFile = cls.proj.getTmpPath(name + '.pdb')
+        writeSyntheticPdb(pdbFile, numberOfResidues, chain, seed=seed,
+                          center=center)
+        return cls._importPdb(pdbFile)
+
+    @classmethod
+    def _importSyntheticSet(cls, name, numberOfResidues, chain='A', seeds=(0,)):
+        """ Import a set of made-up structures, one for every seed. """
+        pdbDir = cls.proj.getTmpPath(name)
+        os.makedirs(pdbDir)
+        for seed in seeds:
+            writeSyntheticPdb(os.path.join(pdbDir, '%s_%d.pdb' % (name, seed)),
+                              numberOfResidues, chain, seed=seed)
+        protImport = cls.newProtocol(ProtImportSetOfAtomStructs,
+                                     inputPdbData=ProtImportSetOfAtomStructs.IMPORT_FROM_FILES,
+                                     filesPath=pdbDir, filesPattern='*.pdb')
+        cls.launchProtocol(protImport)
+        return protImport.outputAtomStructs
+
+    def _countRuns(self, prot, program):
+        """ Return the number of times a program ran in a protocol. """
+        return sum(1 for record in loadProfile(prot._getExtraPath(PROFILE_FILE))
+                   if record['type'] == 'program' and record['program'] == program)
+
+    def _checkSolutions(self, prot, numberOfSolutions=None, maxSolutions=None,
+                        scoreAttr=None):
+        """ Check that the output solutions of a protocol are ranked from 1,
+        by decreasing docking score or by increasing scoreAttr. """
+        # Set iterations reuse the same item, values are read on the fly
+        ranks, scores = [], []
+        for solution in prot.outputSolutions:
+            ranks.append(solution.getRank())
+            scores.append(-solution.getScore() if scoreAttr is None
+                          else getattr(solution, scoreAttr).get())
+        if numberOfSolutions is not None:
+            self.assertEqual(len(ranks), numberOfSolutions)
+        self.assertGreater(len(ranks), 0)
+        if maxSolutions is not None:
+            self.assertLessEqual(len(ranks), maxSolutions)
+        self.assertEqual(ranks, list(range(1, len(ranks) + 1)))
+        self.assertEqual(scores, sorted(scores))
+
+    def _checkComplexes(self, prot, numberOfPoses):
+        """ Check that a protocol writes the complexes of its best solutions,
+        the first one being the receptor and the ligand moved to its pose. """
+        solutionsSet = prot.outputSolutions
+        poses = solutionsSet.getPoses()
+        complexFiles = [c.getFileName() for c in prot.outputComplexes]
+        self.assertEqual(len(complexFiles), min(numberOfPoses, len(poses)))
+
+        receptorCoords = PdbTemplate(solutionsSet.getReceptorFile()).coords
+        ligandFile = solutionsSet.getLigandFile()
+        expected = transformPoses(PdbTemplate(ligandFile).coords, poses[:1],
+                                  center=getPoseCenter(ligandFile))[0]
+        coords = PdbTemplate(complexFiles[0]).coords
+        self.assertEqual(len(coords), len(receptorCoords) + len(expected))
+        np.testing.assert_allclose(coords[:len(receptorCoords)], receptorCoords,
+                                   atol=1e-3)
+        # The pdb coordinates have three decimals
+        np.testing.assert_allclose(coords[len(receptorCoords):], expected,
+                                   atol=0.01)
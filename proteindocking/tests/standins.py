@@ -0,0 +1,404 @@
+# **************************************************************************
+# *
+# * Authors: Yunior C. Fonseca Reyna    (cfonseca@cnb.csic.es)
+# *          Erney Ramirez Aportela     (eramirez@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+"""
+Stand-ins for the FRODOCK, ZDOCK and ZRANK binaries and synthetic test
+structures. The stand-ins read and write the same files as the real
+programs, with cheap made-up contents, so the plugin orchestration,
+parsing and pose generation can be measured when the engines are not
+installed. This module only depends on NumPy: the stand-in launchers load
+it directly from its path, without importing the plugin.
+"""
+
+import hashlib
+import os
+import stat
+import sys
+
+import numpy as np
+
+FRODOCK_PROGRAMS = ['frodockgrid', 'frodock_gcc', 'frodock_mpi_gcc',
+                    'frodockcluster', 'frodockview']
+ZDOCK_PROGRAMS = ['zdock', 'mark_sur', 'create.pl', 'block.pl']
+ZRANK_PROGRAMS = ['zrank']
+# Data files that are only checked for existence
+DATA_FILES = [('frodock', 'bin/soap.bin'), ('zdock', 'uniCHARMM')]
+# Helpers only run by the real programs, installed as empty executables
+HELPERS = [('zdock', 'create_lig')]
+
+RESIDUE_NAMES = ['ALA', 'ARG', 'ASN', 'ASP', 'CYS', 'GLN', 'GLU', 'GLY',
+                 'HIS', 'ILE', 'LEU', 'LYS', 'MET', 'PHE', 'PRO', 'SER',
+                 'THR', 'TRP', 'TYR', 'VAL']
+BACKBONE = [('N', (-1.2, 0.6, 0.0)), ('CA', (0.0, 0.0, 0.0)),
+            ('C', (1.3, 0.7, 0.0)), ('O', (1.4, 1.9, 0.3))]
+
+LAUNCHER = """#!%(python)s
+import importlib.util
+import sys
+
+spec = importlib.util.spec_from_file_location('standins', %(module)r)
+standins = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(standins)
+sys.exit(standins.main(%(program)r, sys.argv[1:]))
+"""
+
+
+def installStandIns(rootDir):
+    """ Install the stand-in programs under rootDir. Return the plugin
+    variables (homes of the three packages) pointing to them. """
+    # Only the test process imports the plugin, never the launchers
+    from proteindocking.constants import (FRODOCK_VERSION, ZDOCK_VERSION,
+                                          ZRANK_VERSION)
+    # The homes are named like the packages, which the plugin checks
+    homes = {'frodock': os.path.join(rootDir, 'frodock3-' + FRODOCK_VERSION),
+             'zdock': os.path.join(rootDir, 'zdock-' + ZDOCK_VERSION),
+             'zrank': os.path.join(rootDir, 'zrank-' + ZRANK_VERSION)}
+    programs = ([('frodock', 'bin/' + p) for p in FRODOCK_PROGRAMS] +
+                [('zdock', p) for p in ZDOCK_PROGRAMS] +
+                [('zrank', p) for p in ZRANK_PROGRAMS])
+    for package, program in programs:
+        fileName = os.path.join(homes[package], program)
+        os.makedirs(os.path.dirname(fileName), exist_ok=True)
+        with open(fileName, 'w') as f:
+            f.write(LAUNCHER % {'python': sys.executable,
+                                'module': os.path.abspath(__file__),
+                                'program': os.path.basename(program)})
+        os.chmod(fileName, os.stat(fileName).st_mode | stat.S_IXUSR)
+    for package, dataFile in DATA_FILES + HELPERS:
+        fileName = os.path.join(homes[package], dataFile)
+        os.makedirs(os.path.dirname(fileName), exist_ok=True)
+        open(fileName, 'w').close()
+    for package, helper in HELPERS:
+        fileName = os.path.join(homes[package], helper)
+        os.chmod(fileName, os.stat(fileName).st_mode | stat.S_IXUSR)
+
+    return {'PROTEIN_DOCKING_HOME': homes['frodock'],
+            'PROTEIN_ZDOCK_HOME': homes['zdock'],
+            'PROTEIN_ZRANK_HOME': homes['zrank']}
+
+
+def writeSyntheticPdb(fileName, numberOfResidues, chain='A', seed=0,
+                      center=(0.0, 0.0, 0.0)):
+    """ Write a compact made-up protein of numberOfResidues backbone
+    residues: a random CA walk with 3.8 A steps folded inside a sphere. """
+    rng = np.random.default_rng(seed)
+    radius = 3.0 * numberOfResidues ** (1 / 3.0)
+    positions = np.zeros((numberOfResidues, 3))
+    for i in range(1, numberOfResidues):
+        step = rng.normal(size=3)
+        step *= 3.8 / np.linalg.norm(step)
+        position = positions[i - 1] + step
+        if np.linalg.norm(position) > radius:
+            position = positions[i - 1] - step
+        positions[i] = position
+    positions += np.asarray(center) - positions.mean(axis=0)
+
+    serial = 1
+    with open(fileName, 'w') as f:
+        for i, ca in enumerate(positions):
+            resName = RESIDUE_NAMES[rng.integers(len(RESIDUE_NAMES))]
+            for atomName, offset in BACKBONE:
+                x, y, z = ca + offset
+                f.write('ATOM  %5d  %-3s %3s %s%4d    %8.3f%8.3f%8.3f'
+                        '  1.00  0.00           %s\n'
+                        % (serial, atomName, resName, chain, i + 1, x, y, z,
+                           atomName[0]))
+                serial += 1
+        f.write('TER\nEND\n')
+
+
+# ------------------------ Stand-in programs ------------------------------
+
+def _getArg(args, flag, default=None):
+    return args[args.index(flag) + 1] if flag in args else default
+
+
+def _getRng(*values):
+    """ Random generator seeded with the given values, so that the same
+    inputs always give the same results. """
+    digest = hashlib.sha256(repr(values).encode()).digest()
+    return np.random.default_rng(int.from_bytes(digest[:8], 'little'))
+
+
+def _readAtoms(fileName):
+    """ Return the ATOM lines and their coordinates. """
+    with open(fileName) as f:
+        lines = [line for line in f if line.startswith(('ATOM', 'HETATM'))]
+    coords = np.array([[float(line[30:38]), float(line[38:46]),
+                        float(line[46:54])] for line in lines]).reshape(-1, 3)
+    return lines, coords
+
+
+def _eulerToMatrix(psi, theta, phi):
+    c1, s1 = np.cos(psi), np.sin(psi)
+    c2, s2 = np.cos(theta), np.sin(theta)
+    c3, s3 = np.cos(phi), np.sin(phi)
+    return np.array([[c1 * c3 - c2 * s1 * s3, -c1 * s3 - c2 * c3 * s1, s1 * s2],
+                     [c3 * s1 + c1 * c2 * s3, c1 * c2 * c3 - s1 * s3, -c1 * s2],
+                     [s2 * s3, c3 * s2, c2]])
+
+
+def _readFileLine(line):
+    """ Return the file name and the center of a ZDOCK header line. """
+    fields = line.split()
+    return fields[0], np.array(fields[1:4], dtype=np.float64)
+
+
+def _writeAtoms(f, lines, coords):
+    for line, (x, y, z) in zip(lines, coords):
+        f.write('%s%8.3f%8.3f%8.3f%s' % (line[:30], x, y, z, line[54:]))
+
+
+def _writeCcp4(fileName, data, origin, voxelSize):
+    """ Write a float32 CCP4 map. """
+    nz, ny, nx = data.shape
+    header = np.zeros(256, dtype=np.int32)
+    floats = header.view(np.float32)
+    header[0:3] = nx, ny, nz
+    header[3] = 2
+    header[4:7] = np.round(np.asarray(origin) / voxelSize)
+    header[7:10] = nx, ny, nz
+    floats[10:13] = nx * voxelSize, ny * voxelSize, nz * voxelSize
+    floats[13:16] = 90.0
+    header[16:19] = 1, 2, 3
+    floats[19:22] = data.min(), data.max(), data.mean()
+    header[22] = 1
+    floats[49:52] = origin
+    header[52] = int.from_bytes(b'MAP ', 'little')
+    header[53] = int.from_bytes(b'DA\x00\x00', 'little')
+    floats[54] = data.std()
+    with open(fileName, 'wb') as f:
+        f.write(header.tobytes())
+        f.write(data.astype(np.float32).tobytes())
+
+
+def _writeDat(fileName, table):
+    """ Stand-in binary results: number of rows and float32 rows of euler
+    angles (3), translation (3) and score. """
+    with open(fileName, 'wb') as f:
+        f.write(np.int64(len(table)).tobytes())
+        f.write(table.astype(np.float32).tobytes())
+
+
+def _readDat(fileName):
+    with open(fileName, 'rb') as f:
+        n = int(np.frombuffer(f.read(8), dtype=np.int64)[0])
+        return np.frombuffer(f.read(), dtype=np.float32).reshape(n, 7)
+
+
+def frodockgrid(args):
+    pdbFile, outputFile = args[0], _getArg(args, '-o')
+    lines, coords = _readAtoms(pdbFile)
+    voxelSize = float(_getArg(args, '-s', 1.0))
+    size = int(_getArg(args, '-w', 128))
+    origin = coords.mean(axis=0) - size * voxelSize / 2.0
+    density, _ = np.histogramdd(coords[:, ::-1], bins=size,
+                                range=[(o, o + size * voxelSize)
+                                       for o in origin[::-1]])
+    _writeCcp4(outputFile, density, origin, voxelSize)
+    # Like frodockgrid, the _ASA.pdb file is written next to the input pdb
+    asaFile = os.path.join(os.path.dirname(pdbFile),
+                           os.path.basename(pdbFile).split('.')[0] + '_ASA.pdb')
+    with open(asaFile, 'w') as f:
+        f.writelines(lines)
+
+
+def frodock(args):
+    _, recCoords = _readAtoms(args[0])
+    _, ligCoords = _readAtoms(args[1])
+    outputFile = _getArg(args, '-o')
+    position = _getArg(args, '-p')
+    if position is not None:
+        n = 1000
+        center = np.array([float(x) for x in position.split(',')])
+        spread = float(_getArg(args, '--rd', 4.0))
+    else:
+        n = 2000 if '--bw' in args else 20000
+        center = recCoords.mean(axis=0)
+        spread = (np.linalg.norm(recCoords - center, axis=1).max() +
+                  np.linalg.norm(ligCoords - ligCoords.mean(axis=0), axis=1).max())
+
+    rng = _getRng(len(recCoords), len(ligCoords), position, n)
+    table = np.empty((n, 7))
+    table[:, 0] = rng.uniform(0, 2 * np.pi, n)
+    table[:, 1] = rng.uniform(0, np.pi, n)
+    table[:, 2] = rng.uniform(0, 2 * np.pi, n)
+    directions = rng.normal(size=(n, 3))
+    directions /= np.linalg.norm(directions, axis=1)[:, None]
+    table[:, 3:6] = center + directions * spread * rng.uniform(0.5, 1.0, (n, 1))
+    table[:, 6] = np.sort(rng.gamma(4.0, 300.0, n))[::-1]
+    _writeDat(outputFile, table)
+
+
+def frodockcluster(args):
+    table = _readDat(args[0])
+    numberOfClusters = int(_getArg(args, '--nc', 100))
+    radius = float(_getArg(args, '-d', 5.0))
+    table = table[np.argsort(-table[:, 6], kind='stable')]
+    representatives = []
+    for row in table:
+        if len(representatives) == numberOfClusters:
+            break
+        if not representatives or np.min(np.linalg.norm(
+                np.array(representatives)[:, 3:6] - row[3:6], axis=1)) > radius:
+            representatives.append(row)
+    _writeDat(_getArg(args, '-o'), np.array(representatives).reshape(-1, 7))
+
+
+def frodockview(args):
+    table = _readDat(args[0])
+    out = sys.stdout
+    out.write('Solutions listing of %s\n' % args[0])
+    for rank, row in enumerate(table, 1):
+        out.write('%6d %8.4f %8.4f %8.4f %9.3f %9.3f %9.3f %10.3f\n'
+                  % ((rank,) + tuple(row)))
+
+
+def mark_sur(args):
+    if not os.path.exists('uniCHARMM'):
+        sys.stderr.write('uniCHARMM not found in the working directory\n')
+        return 1
+    lines, coords = _readAtoms(args[0])
+    with open(args[1], 'w') as f:
+        _writeAtoms(f, lines, coords)
+
+
+def block(args):
+    lines, coords = _readAtoms(args[0])
+    _writeAtoms(sys.stdout, lines, coords)
+
+
+def zdock(args):
+    recFile, ligFile = _getArg(args, '-R'), _getArg(args, '-L')
+    n = int(_getArg(args, '-N', 2000))
+    seed = int(_getArg(args, '-S', 0))
+    _, recCoords = _readAtoms(recFile)
+    _, ligCoords = _readAtoms(ligFile)
+    gridSize, spacing = (128, 1.2) if '-D' in args else (92, 1.2)
+    rng = _getRng(len(recCoords), len(ligCoords), seed, n, gridSize)
+    # As ZDOCK, the larger molecule is docked as receptor
+    switched = len(ligCoords) > len(recCoords)
+    molecules = [(recFile, recCoords), (ligFile, ligCoords)]
+    if switched:
+        molecules.reverse()
+    initialAngles = rng.uniform(0, np.pi, (2, 3))
+    rotations = [_eulerToMatrix(*angles) for angles in initialAngles]
+    centers = [(coords @ rotation.T).mean(axis=0)
+               for (_, coords), rotation in zip(molecules, rotations)]
+    ligCenter = ligCoords.mean(axis=0)
+    with open(_getArg(args, '-o'), 'w') as f:
+        f.write('%d\t%.1f\t%d\n' % (gridSize, spacing, switched))
+        for angles in initialAngles:
+            f.write('%.6f\t%.6f\t%.6f\n' % tuple(angles))
+        for (fileName, _), center in zip(molecules, centers):
+            f.write('%s\t%.3f\t%.3f\t%.3f\n' % ((fileName,) + tuple(center)))
+        scores = np.sort(rng.gamma(4.0, 3.0, n))[::-1]
+        for score in scores:
+            angles = rng.uniform(0, 2 * np.pi, 3)
+            # Ligands are placed around their input position
+            if switched:
+                shift = _eulerToMatrix(*angles) @ (rotations[1] @ ligCenter
+                                                   - centers[1])
+            else:
+                shift = centers[0] - rotations[0] @ ligCenter
+            translation = (np.round(shift / spacing).astype(int)
+                           + rng.integers(-12, 13, 3)) % gridSize
+            f.write('%.6f\t%.6f\t%.6f\t%d\t%d\t%d\t%.2f\n'
+                    % (tuple(angles) + tuple(translation) + (score,)))
+
+
+def create(args):
+    if not os.path.exists('create_lig'):
+        sys.stderr.write('create_lig not found in the working directory\n')
+        return 1
+    with open(args[0]) as f:
+        fields = f.readline().split()
+        gridSize, spacing, switched = float(fields[0]), float(fields[1]), int(fields[2])
+        recRotation = _eulerToMatrix(*[float(x) for x in f.readline().split()])
+        ligRotation = _eulerToMatrix(*[float(x) for x in f.readline().split()])
+        recFile, recCenter = _readFileLine(f.readline())
+        ligFile, ligCenter = _readFileLine(f.readline())
+        predictions = np.loadtxt(f, ndmin=2)
+    # The ZDOCK receptor is fixed unless ZDOCK switched the molecules
+    staticFile, mobileFile = (ligFile, recFile) if switched else (recFile, ligFile)
+    staticLines, staticCoords = _readAtoms(staticFile)
+    mobileLines, mobileCoords = _readAtoms(mobileFile)
+    for i, row in enumerate(predictions, 1):
+        # As create_lig: the mobile molecule rotated and centered, moved by
+        # the prediction, or by its inverse if switched, and placed in the
+        # frame of the unrotated static molecule
+        translation = row[3:6].copy()
+        translation[translation >= gridSize / 2] -= gridSize
+        translation *= -spacing
+        rotation = _eulerToMatrix(*row[0:3])
+        if switched:
+            coords = (mobileCoords @ recRotation.T - recCenter - translation) @ rotation
+            coords = (coords + ligCenter) @ ligRotation
+        else:
+            coords = (mobileCoords @ ligRotation.T - ligCenter) @ rotation.T
+            coords = (coords + translation + recCenter) @ recRotation
+        with open('complex.%d' % i, 'w') as f:
+            _writeAtoms(f, staticLines, staticCoords)
+            f.write('TER\n')
+            _writeAtoms(f, mobileLines, coords)
+            f.write('END\n')
+
+
+def zrank(args):
+    with open(args[0]) as f:
+        complexFiles = [line.strip() for line in f if line.strip()]
+    with open(args[0] + '.zr.out', 'w') as out:
+        for complexFile in complexFiles:
+            with open(complexFile) as f:
+                text = f.read()
+            receptor, _, ligand = text.partition('TER\n')
+            # Contacts of the CA atoms, cheap enough for thousands of poses
+            coords = []
+            for part in [receptor, ligand]:
+                coords.append(np.array([[float(line[30:38]), float(line[38:46]),
+                                         float(line[46:54])]
+                                        for line in part.splitlines()
+                                        if line.startswith('ATOM') and
+                                        line[12:16] == ' CA ']).reshape(-1, 3))
+            distances = np.linalg.norm(coords[0][:, None] - coords[1][None], axis=2)
+            out.write('%s\t%.3f\n' % (complexFile, -np.count_nonzero(distances < 10.0)))
+
+
+PROGRAMS = {'frodockgrid': frodockgrid,
+            'frodock_gcc': frodock,
+            'frodock_mpi_gcc': frodock,
+            'frodockcluster': frodockcluster,
+            'frodockview': frodockview,
+            'mark_sur': mark_sur,
+            'block.pl': block,
+            'zdock': zdock,
+            'create.pl': create,
+            'zrank': zrank}
+
+
+def main(program, args):
+    """ Run the stand-in of program with the command line arguments args. """
+    return PROGRAMS[program](args) or 0
@@ -0,0 +1,63 @@
+# **************************************************************************
+# *
+# * Authors: Yunior C. Fonseca Reyna    (cfonseca@cnb.csic.es)
+# *          Erney Ramirez Aportela     (eramirez@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+import re
+
+from proteindocking.protocols import ProtFrodockBatch
+from proteindocking.tests.base import DockingTest
+
+
+class TestFrodockBatch(DockingTest):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.receptor = cls._importSyntheticPdb('receptor', 60, 'A', seed=0)
+        cls.ligands = cls._importSyntheticSet('ligand', 30, 'B', seeds=[1, 2])
+
+    def testBatch(self):
+        """ Every ligand is docked with its share of the threads and its
+        solutions and complexes are tagged with its id. """
+        prot = self.newProtocol(ProtFrodockBatch, inputPdbReceptor=self.receptor,
+                                inputPdbLigand=self.ligands, numberOfThreads=5,
+                                useMapCache=False, numberOfPoses=3)
+        self.launchProtocol(prot)
+
+        # Four executor threads run the two searches, two threads each
+        with open(prot.getStdoutLog()) as f:
+            searches = re.findall(r'frodock_gcc .* --th (\d+)', f.read())
+        self.assertEqual(searches, ['2', '2'])
+
+        ligandIds = [ligand.getObjId() for ligand in self.ligands]
+        solutionIds = [s._ligandId.get() for s in prot.outputSolutions]
+        self.assertEqual(sorted(set(solutionIds)), ligandIds)
+        complexIds = [c._ligandId.get() for c in prot.outputComplexes]
+        self.assertEqual(sorted(complexIds), sorted(ligandIds * 3))
+        for ligandId in ligandIds:
+            # The solutions of every ligand are ranked on their own
+            ranks = [s.getRank() for s in prot.outputSolutions
+                     if s._ligandId.get() == ligandId]
+            self.assertEqual(ranks, list(range(1, len(ranks) + 1)))
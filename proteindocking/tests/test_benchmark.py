@@ -0,0 +1,214 @@
+# **************************************************************************
+# *
+# * Authors: Yunior C. Fonseca Reyna    (cfonseca@cnb.csic.es)
+# *          Erney Ramirez Aportela     (eramirez@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+"""
+Docking benchmark. The FRODOCK, ZDOCK and ZRANK protocols are run on a
+small fixed set of synthetic complexes and, for every step, the wall time,
+cpu time and peak memory of the step and the programs it runs (from the
+protocol profile report) and the size of the files it writes are compared
+with the stored baselines. The outputs are checked too: ranked solutions
+and complexes matching their poses.
+
+Stand-in programs (see standins.py) replace the docking engines when they
+are not installed, or when PROTEIN_DOCKING_BENCHMARK_STANDINS=1, so the
+plugin overheads can be measured anywhere. Baselines are kept per engine
+kind in benchmark_baseline.json, steps without baseline are not compared.
+Every run writes its measurements, merged with the baselines, to
+benchmark_results.json in the test output directory: copy it over
+benchmark_baseline.json to record new baselines.
+PROTEIN_DOCKING_BENCHMARK_UPDATE=1 skips the comparison, e.g. when
+recording baselines on a new machine. PROTEIN_DOCKING_BENCHMARK_TOLERANCE
+sets the allowed slowdown factor.
+"""
+
+import copy
+import json
+import os
+
+from pyworkflow.tests import setupTestOutput, setupTestProject
+
+from proteindocking import Plugin
+from proteindocking.constants import PROTEIN_DOCKING_HOME, FRODOCK
+from proteindocking.profiling import PROFILE_FILE, loadProfile
+from proteindocking.protocols import (ProtFrodockProtein, ProtZdockProtein,
+                                      ProtZrankProtein)
+from proteindocking.tests.base import DockingTest
+
+# Complexes: name, receptor residues and ligand residues
+BENCHMARK_COMPLEXES = [('small', 60, 30),
+                       ('medium', 250, 80),
+                       ('large', 700, 150)]
+
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), 'benchmark_baseline.json')
+RESULTS_FILE = 'benchmark_results.json'
+
+TOLERANCE = float(os.environ.get('PROTEIN_DOCKING_BENCHMARK_TOLERANCE', 2.0))
+# Absolute slack added to the baselines, so tiny steps do not fail on noise
+SLACK = {'wallTime': 2.0, 'cpuTime': 1.0, 'maxRss': 50 * 1024 ** 2,
+         'outputSize': 4096}
+
+
+class TestDockingBenchmark(DockingTest):
+    @classmethod
+    def setUpClass(cls):
+        setupTestProject(cls)
+        setupTestOutput(cls)
+        cls.engine = cls._setupEngines()
+        cls.baselines = {}
+        if os.path.exists(BASELINE_FILE):
+            with open(BASELINE_FILE) as f:
+                cls.baselines = json.load(f)
+        cls.measurements = {}
+
+        cls.complexes = {}
+        for i, (name, receptorSize, ligandSize) in enumerate(BENCHMARK_COMPLEXES):
+            cls.complexes[name] = (
+                cls._importSyntheticPdb('%s_receptor' % name, receptorSize, 'A',
+                                        seed=2 * i),
+                cls._importSyntheticPdb('%s_ligand' % name, ligandSize, 'B',
+                                        seed=2 * i + 1))
+
+    @classmethod
+    def tearDownClass(cls):
+        results = copy.deepcopy(cls.baselines)
+        results.setdefault(cls.engine, {}).update(cls.measurements)
+        resultsFile = cls.getOutputPath(RESULTS_FILE)
+        with open(resultsFile, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print('Benchmark measurements written to %s' % resultsFile)
+
+    @classmethod
+    def _setupEngines(cls):
+        """ Use the stand-in programs if frodock is not installed. Return
+        the engine kind. """
+        cls._setupMapCache()
+        frodock = os.path.join(Plugin.getVar(PROTEIN_DOCKING_HOME), 'bin', FRODOCK)
+        if (os.environ.get('PROTEIN_DOCKING_BENCHMARK_STANDINS') == '1' or
+                not os.path.exists(frodock)):
+            cls._setupStandIns()
+            return 'standin'
+        return 'real'
+
+    # ------------------------------ Tests ------------------------------------
+
+    def testFrodock(self):
+        for name, (receptor, ligand) in self.complexes.items():
+            prot = self._benchmark('frodock', name, ProtFrodockProtein,
+                                   inputPdbReceptor=receptor, inputPdbLigand=ligand,
+                                   useMapCache=False)
+            self._checkSolutions(prot, maxSolutions=prot.numberOfClusters.get())
+            self._checkComplexes(prot, prot.numberOfPoses.get())
+
+    def testFrodockCoarseToFine(self):
+        for name, (receptor, ligand) in self.complexes.items():
+            prot = self._benchmark('frodock_coarse', name, ProtFrodockProtein,
+                                   inputPdbReceptor=receptor, inputPdbLigand=ligand,
+                                   searchMode=1, numberOfRegions=4, clusteringMode=1,
+                                   useMapCache=False)
+            self._checkSolutions(prot, maxSolutions=prot.numberOfClusters.get())
+            self._checkComplexes(prot, prot.numberOfPoses.get())
+
+    def testZdockZrank(self):
+        for name, (receptor, ligand) in self.complexes.items():
+            protZdock = self._benchmark('zdock', name, ProtZdockProtein,
+                                        inputPdbReceptor=receptor,
+                                        inputPdbLigand=ligand,
+                                        numberOfPredictions=2000,
+                                        numberOfPoses=50)
+            self._checkSolutions(protZdock, numberOfSolutions=2000)
+            self._checkComplexes(protZdock, 50)
+            protZrank = self._benchmark('zrank', name, ProtZrankProtein,
+                                        inputSolutions=protZdock.outputSolutions)
+            # Every ZDOCK solution is scored, the lowest energies first
+            self._checkSolutions(protZrank, numberOfSolutions=2000,
+                                 scoreAttr='_zrankScore')
+            self._checkComplexes(protZrank, protZrank.numberOfPoses.get())
+
+    # ------------------------------ Utils ------------------------------------
+
+    def _benchmark(self, protocolKey, complexName, protocolClass, **kwargs):
+        """ Run a protocol on one thread, so that its steps do not overlap,
+        and compare its step measurements with the baseline. """
+        prot = self.newProtocol(protocolClass, objLabel='%s %s'
+                                % (protocolKey, complexName),
+                                numberOfThreads=1, numberOfMpi=1, **kwargs)
+        self.launchProtocol(prot)
+
+        key = '%s/%s' % (protocolKey, complexName)
+        steps = self._measureSteps(prot)
+        self.measurements[key] = steps
+        baseline = self.baselines.get(self.engine, {}).get(key)
+        if baseline and os.environ.get('PROTEIN_DOCKING_BENCHMARK_UPDATE') != '1':
+            regressions = self._compare(steps, baseline)
+            self.assertFalse(regressions, '%s regressions:\n%s'
+                             % (key, '\n'.join(regressions)))
+        return prot
+
+    def _measureSteps(self, prot):
+        """ Return the measurements of every step of a finished protocol,
+        from its profile report: wall time, cpu time and peak memory of the
+        step and the programs it ran, and the size of the files it wrote. """
+        measurements = {}
+        windows = []
+        for record in loadProfile(prot._getExtraPath(PROFILE_FILE)):
+            stepKey = '%s(%s)' % (record['step'], ', '.join(record['args']))
+            stats = measurements.setdefault(stepKey, {'wallTime': 0.0,
+                                                      'cpuTime': 0.0,
+                                                      'maxRss': 0,
+                                                      'outputSize': 0})
+            stats['cpuTime'] += record['cpuTime']
+            stats['maxRss'] = max(stats['maxRss'], record['maxRss'])
+            if record['type'] == 'step':
+                stats['wallTime'] = record['wallTime']
+                windows.append((record['start'],
+                                record['start'] + record['wallTime'], stepKey))
+
+        # Every output file belongs to the step running when it was last
+        # modified, or the closest one: file times come from a coarser clock
+        for root, _, files in os.walk(prot._getExtraPath()):
+            for fileName in files:
+                filePath = os.path.join(root, fileName)
+                mtime = os.path.getmtime(filePath)
+                if windows:
+                    _, _, owner = min(windows, key=lambda w: max(w[0] - mtime,
+                                                                 mtime - w[1], 0))
+                    measurements[owner]['outputSize'] += os.path.getsize(filePath)
+        return measurements
+
+    @staticmethod
+    def _compare(steps, baseline):
+        """ Return the measurements exceeding their baseline. """
+        regressions = []
+        for stepKey, stats in sorted(steps.items()):
+            if stepKey not in baseline:
+                continue
+            for metric, value in sorted(stats.items()):
+                limit = baseline[stepKey][metric] * TOLERANCE + SLACK[metric]
+                if value > limit:
+                    regressions.append('  %s %s: %s (baseline %s)'
+                                       % (stepKey, metric, value,
+                                          baseline[stepKey][metric]))
+        return regressions
@@ -0,0 +1,114 @@
+# **************************************************************************
+# *
+# * Authors: Yunior C. Fonseca Reyna    (cfonseca@cnb.csic.es)
+# *          Erney Ramirez Aportela     (eramirez@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+import filecmp
+import os
+
+from pyworkflow.tests import BaseTest, setupTestOutput
+
+from proteindocking.cache import MapCache
+from proteindocking.protocols import ProtFrodockProtein
+from proteindocking.tests.base import DockingTest
+
+
+class TestMapCache(BaseTest):
+    @classmethod
+    def setUpClass(cls):
+        setupTestOutput(cls)
+
+    def setUp(self):
+        self.cache = MapCache(self.getOutputPath('cache_%s' % self._testMethodName),
+                              maxSize=250)
+
+    def _writeFile(self, fileName, data):
+        fileName = self.getOutputPath(fileName)
+        with open(fileName, 'wb') as f:
+            f.write(data)
+        return fileName
+
+    def testKey(self):
+        """ The key changes with the pdb contents, the arguments and the
+        version, and only with them. """
+        pdbFile = self._writeFile('key.pdb', b'ATOM 1\n')
+        key = MapCache.getKey(pdbFile, ['-m', '1'], 'frodock3-3.12')
+        self.assertEqual(MapCache.getKey(pdbFile, ['-m', '1'], 'frodock3-3.12'), key)
+        self.assertNotEqual(MapCache.getKey(pdbFile, ['-m', '3'], 'frodock3-3.12'), key)
+        self.assertNotEqual(MapCache.getKey(pdbFile, ['-m', '1'], 'frodock3-3.11'), key)
+        self._writeFile('key.pdb', b'ATOM 2\n')
+        self.assertNotEqual(MapCache.getKey(pdbFile, ['-m', '1'], 'frodock3-3.12'), key)
+
+    def testFetchStore(self):
+        """ A stored map is fetched unchanged and does not change when the
+        run file it came from is rewritten. """
+        mapFile = self._writeFile('store.ccp4', b'm' * 100)
+        asaFile = self._writeFile('store_ASA.pdb', b'a' * 10)
+        fetchedMap = self.getOutputPath('fetch.ccp4')
+        fetchedAsa = self.getOutputPath('fetch_ASA.pdb')
+        self.assertFalse(self.cache.fetch('key', fetchedMap, fetchedAsa))
+        self.cache.store('key', mapFile, asaFile)
+        self._writeFile('store.ccp4', b'x' * 100)
+        self.assertTrue(self.cache.fetch('key', fetchedMap, fetchedAsa))
+        with open(fetchedMap, 'rb') as f:
+            self.assertEqual(f.read(), b'm' * 100)
+        self.assertTrue(filecmp.cmp(fetchedAsa, asaFile, shallow=False))
+
+    def testLeastRecentlyUsed(self):
+        """ The least recently used entries are evicted when the cache is
+        larger than its maximum size. """
+        mapFile = self._writeFile('lru.ccp4', b'm' * 100)
+        for key, accessTime in [('a', 1000), ('b', 2000)]:
+            self.cache.store(key, mapFile)
+            os.utime(os.path.join(self.cache.path, key), (accessTime, accessTime))
+        self.assertTrue(self.cache.fetch('a', self.getOutputPath('lru_a.ccp4'), ''))
+        self.cache.store('c', mapFile)
+        self.assertEqual(sorted(os.listdir(self.cache.path)), ['a', 'c'])
+
+
+class TestMapCacheProtocol(DockingTest):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.receptor = cls._importSyntheticPdb('receptor', 60, 'A', seed=0)
+        cls.ligand = cls._importSyntheticPdb('ligand', 30, 'B', seed=1)
+
+    def _dock(self):
+        prot = self.newProtocol(ProtFrodockProtein, inputPdbReceptor=self.receptor,
+                                inputPdbLigand=self.ligand, useMapCache=True)
+        self.launchProtocol(prot)
+        return prot
+
+    def testSharedMaps(self):
+        """ A second run takes all its maps from the cache. """
+        first = self._dock()
+        self.assertEqual(self._countRuns(first, 'frodockgrid'), 4)
+        second = self._dock()
+        self.assertEqual(self._countRuns(second, 'frodockgrid'), 0)
+        for suffix in ['_W.ccp4', '_E.ccp4', '_DS.ccp4']:
+            self.assertTrue(filecmp.cmp(first._getPdbOutputPath('receptor', suffix),
+                                        second._getPdbOutputPath('receptor', suffix),
+                                        shallow=False))
+        self._checkSolutions(second)
@@ -0,0 +1,79 @@
+# **************************************************************************
+# *
+# * Authors: Yunior C. Fonseca Reyna    (cfonseca@cnb.csic.es)
+# *          Erney Ramirez Aportela     (eramirez@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+import os
+
+from proteindocking.campaign import PROFILE_FILE, RESULT_FILE, loadManifest
+from proteindocking.profiling import loadProfile
+from proteindocking.protocols import ProtFrodockCampaign
+from proteindocking.protocols.protocol_frodock_campaign import EXECUTOR_LOCAL
+from proteindocking.tests.base import DockingTest
+
+
+class TestFrodockCampaign(DockingTest):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.receptors = cls._importSyntheticSet('receptor', 60, 'A', seeds=[0, 3])
+        cls.ligands = cls._importSyntheticSet('ligand', 30, 'B', seeds=[1, 2])
+
+    def _countTaskRuns(self, task, program):
+        return sum(1 for record in loadProfile(os.path.join(task['dir'], PROFILE_FILE))
+                   if record['type'] == 'program' and record['program'] == program)
+
+    def testLocalExecutor(self):
+        """ Every pair is docked by a local task, the maps of every molecule
+        are computed once, and only unfinished tasks run again. """
+        prot = self.newProtocol(ProtFrodockCampaign, inputReceptors=self.receptors,
+                                inputLigands=self.ligands, numberOfThreads=3,
+                                executor=EXECUTOR_LOCAL, useMapCache=False)
+        self.launchProtocol(prot)
+
+        tasks = loadManifest(prot._getManifestPath())['tasks']
+        self.assertEqual(len(tasks), 4)
+        self.assertEqual(sum(self._countTaskRuns(task, 'frodock_gcc')
+                             for task in tasks), 4)
+        # Three maps of every receptor and one of every ligand
+        self.assertEqual(sum(self._countTaskRuns(task, 'frodockgrid')
+                             for task in tasks), 8)
+
+        pairs, scores = [], []
+        for complexStruct in prot.outputComplexes:
+            pairs.append((complexStruct._receptorName.get(),
+                          complexStruct._ligandName.get()))
+            scores.append(complexStruct._dockingScore.get())
+        self.assertEqual(sorted(pairs), [(r, l) for r in ['receptor_0', 'receptor_3']
+                                         for l in ['ligand_1', 'ligand_2']])
+        self.assertEqual(scores, sorted(scores, reverse=True))
+
+        resultFiles = [os.path.join(task['dir'], RESULT_FILE) for task in tasks]
+        mtimes = [os.stat(f).st_mtime_ns for f in resultFiles]
+        os.remove(resultFiles[1])
+        prot.runTasksStep(EXECUTOR_LOCAL)
+        self.assertEqual(self._countTaskRuns(tasks[1], 'frodock_gcc'), 2)
+        self.assertEqual([os.stat(f).st_mtime_ns for i, f in enumerate(resultFiles)
+                          if i != 1], mtimes[:1] + mtimes[2:])
@@ -0,0 +1,144 @@
+# **************************************************************************
+# *
+# * Authors: Yunior C. Fonseca Reyna    (cfonseca@cnb.csic.es)
+# *          Erney Ramirez Aportela     (eramirez@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+import numpy as np
+from pyworkflow.tests import BaseTest
+
+from proteindocking.clustering import (clusterSolutions, filterRestrainedSolutions,
+                                       filterSymmetricSolutions)
+from proteindocking.convert import matrixToEuler, transformPoses
+from proteindocking.tests.test_convert import randomSolutions
+
+
+def greedyClusters(solutions, coords, radius, maxClusters, center):
+    """ Reference greedy clustering, comparing every solution with every
+    representative. """
+    poses = transformPoses(coords, solutions, center)
+    representatives = []
+    for i in np.argsort(-solutions['score'], kind='stable'):
+        msd = ((poses[representatives] - poses[i]) ** 2).sum(axis=2).mean(axis=1)
+        if np.all(msd >= radius ** 2):
+            representatives.append(i)
+            if len(representatives) == maxClusters:
+                break
+    return representatives
+
+
+class TestClustering(BaseTest):
+    def setUp(self):
+        rng = np.random.default_rng(1)
+        self.ligand = rng.normal(0.0, 6.0, (120, 3)) + (5.0, -3.0, 2.0)
+        self.coords = self.ligand[::6]
+        self.center = self.ligand.mean(axis=0)
+        # Noisy copies of a few poses, so many solutions share a cluster
+        self.solutions = randomSolutions(3000, sortByScore=False)
+        poses = randomSolutions(60, seed=2)
+        copies = rng.integers(0, len(poses), len(self.solutions))
+        self.solutions['euler'] = (poses['euler'][copies] +
+                                   rng.normal(0.0, 0.05, (len(copies), 3)))
+        self.solutions['translation'] = (poses['translation'][copies] +
+                                         rng.normal(0.0, 1.5, (len(copies), 3)))
+
+    def _check(self, clusters, maxClusters, radius=5.0):
+        expected = greedyClusters(self.solutions, self.coords, radius,
+                                  maxClusters, self.center)
+        self.assertEqual(len(clusters), len(expected))
+        np.testing.assert_array_equal(clusters['score'],
+                                      self.solutions['score'][expected])
+        np.testing.assert_array_equal(clusters['rank'],
+                                      np.arange(1, len(clusters) + 1))
+        np.testing.assert_array_equal(clusters['cluster'], clusters['rank'])
+
+    def testGreedyClustering(self):
+        """ The clusters are the greedy RMSD clusters by decreasing score,
+        the poses rotating around the full ligand center. """
+        # Chunks must come in score order
+        order = np.argsort(-self.solutions['score'], kind='stable')
+        chunks = [self.solutions[order[i:i + 700]] for i in range(0, 3000, 700)]
+        clusters = clusterSolutions(chunks, self.coords, 5.0, 3000,
+                                    center=self.center, batchSize=256)
+        self.assertLess(len(clusters), 3000)
+        self._check(clusters, 3000)
+
+    def testMaxClusters(self):
+        order = np.argsort(-self.solutions['score'], kind='stable')
+        clusters = clusterSolutions([self.solutions[order]], self.coords, 5.0, 25,
+                                    center=self.center)
+        self.assertEqual(len(clusters), 25)
+        self._check(clusters, 25)
+
+
+def axisRotation(axis, angle):
+    """ Return the matrix rotating angle degrees around axis. """
+    axis = np.asarray(axis, dtype=np.float64) / np.linalg.norm(axis)
+    cross = np.array([[0.0, -axis[2], axis[1]],
+                      [axis[2], 0.0, -axis[0]],
+                      [-axis[1], axis[0], 0.0]])
+    angle = np.radians(angle)
+    return (np.eye(3) + np.sin(angle) * cross +
+            (1 - np.cos(angle)) * cross @ cross)
+
+
+class TestSymmetricFilter(BaseTest):
+    def testCyclicSolutions(self):
+        """ Only the rotations of 360/n degrees around an axis, without a
+        screw along it, are kept, with any axis position and direction. """
+        center = np.array([5.0, -3.0, 2.0])
+        axis, point = np.array([1.0, 2.0, 2.0]) / 3.0, np.array([12.0, 4.0, -7.0])
+        motions = [(180.0, 0.0, True), (172.0, 0.0, True), (180.0, 2.5, True),
+                   (165.0, 0.0, False), (180.0, 4.0, False),
+                   (120.0, 0.0, False), (90.0, 0.0, False)]
+        solutions = randomSolutions(len(motions), sortByScore=False)
+        for i, (angle, screw, _) in enumerate(motions):
+            rotation = axisRotation(axis, angle)
+            solutions['euler'][i] = matrixToEuler(rotation[None])[0]
+            # x' = R (x - point) + point + screw axis, written as a pose
+            # R (x - center) + translation
+            solutions['translation'][i] = (rotation @ (center - point) + point +
+                                           screw * axis)
+        kept = filterSymmetricSolutions(solutions, center, order=2)
+        np.testing.assert_array_equal(kept['rank'],
+                                      solutions['rank'][[m[2] for m in motions]])
+        # A C3 ring needs turns of 120 degrees
+        kept = filterSymmetricSolutions(solutions, center, order=3)
+        np.testing.assert_array_equal(kept['rank'], solutions['rank'][[5]])
+
+
+class TestRestraintFilter(BaseTest):
+    def testEpitopeDistance(self):
+        """ Only the poses placing the ligand epitope close to the receptor
+        site are kept, the poses rotating around the ligand center. """
+        solutions = randomSolutions(2000, sortByScore=False)
+        rng = np.random.default_rng(3)
+        solutions['translation'] = rng.uniform(-30.0, 30.0, (len(solutions), 3))
+        center = np.array([5.0, -3.0, 2.0])
+        epitope, siteCenter = np.array([4.0, 0.0, -3.0]), np.array([2.0, 8.0, -1.0])
+        positions = transformPoses((center + epitope)[None], solutions, center)[:, 0]
+        close = np.linalg.norm(positions - siteCenter, axis=1) <= 20.0
+        self.assertTrue(0 < close.sum() < len(solutions))
+        kept = filterRestrainedSolutions(solutions, siteCenter, epitope, 20.0)
+        np.testing.assert_array_equal(kept['rank'], solutions['rank'][close])
@@ -0,0 +1,108 @@
+# **************************************************************************
+# *
+# * Authors: Yunior C. Fonseca Reyna    (cfonseca@cnb.csic.es)
+# *          Erney Ramirez Aportela     (eramirez@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+from pyworkflow.tests import BaseTest
+
+from proteindocking.consensus import ConsensusRanker
+from proteindocking.protocols import (ProtDockingConsensus, ProtFrodockProtein,
+                                      ProtZdockProtein)
+from proteindocking.tests.base import DockingTest
+
+
+def interface(*residues):
+    return frozenset(('A', str(r)) for r in residues)
+
+
+class TestConsensusRanker(BaseTest):
+    def testRankFusion(self):
+        """ Overlapping poses of two engines are one consensus pose, scored
+        with the best vote 1 / (k + rank) of every engine, and represented
+        by its best voted pose. """
+        ranker = ConsensusRanker(overlap=0.5, k=60)
+        ranker.addStreams([[(1, interface(1, 2, 3, 4), 'a1'),
+                            (2, interface(20, 21, 22), 'a2'),
+                            (3, interface(40, 41, 42, 43), 'a3'),
+                            (4, interface(1, 2, 3), 'a4')],
+                           [(1, interface(41, 42, 43), 'b1'),
+                            (2, interface(2, 3, 4, 5), 'b2')]])
+        top = ranker.top(5)
+        self.assertEqual([pose for _, _, pose in top], ['a1', 'b1', 'a2'])
+        self.assertEqual([votes for _, votes, _ in top], [2, 2, 1])
+        for (score, _, _), expected in zip(top, [1 / 61 + 1 / 62,
+                                                 1 / 63 + 1 / 61, 1 / 62]):
+            self.assertAlmostEqual(score, expected)
+
+    def testMaxCandidates(self):
+        """ Dropping the lowest scored candidates keeps the best ones. """
+        ranker = ConsensusRanker(k=60, maxCandidates=3)
+        ranker.addStreams([[(rank, interface(rank), rank)
+                            for rank in range(1, 20)]])
+        # Candidates are dropped once they are twice the maximum
+        self.assertLessEqual(len(ranker.top(20)), 6)
+        self.assertEqual([pose for _, _, pose in ranker.top(3)], [1, 2, 3])
+
+
+class TestConsensusProtocol(DockingTest):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.receptor = cls._importSyntheticPdb('receptor', 60, 'A', seed=0)
+        cls.ligand = cls._importSyntheticPdb('ligand', 30, 'B', seed=1)
+        cls.otherLigand = cls._importSyntheticPdb('other_ligand', 30, 'B', seed=2)
+
+    def _dock(self, protClass, ligand, **kwargs):
+        prot = self.newProtocol(protClass, inputPdbReceptor=self.receptor,
+                                inputPdbLigand=ligand, **kwargs)
+        self.launchProtocol(prot)
+        return prot.outputSolutions
+
+    def testConsensus(self):
+        """ The solutions of FRODOCK and ZDOCK for the same structures are
+        fused, those of another ligand are rejected. """
+        frodockSolutions = self._dock(ProtFrodockProtein, self.ligand,
+                                      useMapCache=False)
+        zdockSolutions = self._dock(ProtZdockProtein, self.ligand,
+                                    numberOfPredictions=200)
+        prot = self.newProtocol(ProtDockingConsensus, topK=10)
+        for solutions in [frodockSolutions, zdockSolutions]:
+            prot.inputSolutions.append(solutions)
+        self.launchProtocol(prot)
+        scores = [c._consensusScore.get() for c in prot.outputComplexes]
+        self.assertEqual(len(scores), 10)
+        self.assertEqual(scores, sorted(scores, reverse=True))
+        votes = [c._consensusVotes.get() for c in prot.outputComplexes]
+        self.assertTrue(set(votes) <= {1, 2})
+
+        otherSolutions = self._dock(ProtZdockProtein, self.otherLigand,
+                                    numberOfPredictions=200)
+        prot = self.newProtocol(ProtDockingConsensus)
+        for solutions in [frodockSolutions, otherSolutions]:
+            prot.inputSolutions.append(solutions)
+        errors = prot.validate()
+        self.assertEqual(len(errors), 1)
+        self.assertIn('input 2 dock another receptor or ligand than those of '
+                      'input 1', errors[0])
@@ -0,0 +1,292 @@
+# **************************************************************************
+# *
+# * Authors: Yunior C. Fonseca Reyna    (cfonseca@cnb.csic.es)
+# *          Erney Ramirez Aportela     (eramirez@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+import os
+
+import numpy as np
+from pyworkflow.tests import BaseTest, setupTestOutput
+
+from proteindocking.convert import (SOLUTION_DTYPE, eulerToMatrix, iterAtomRecords,
+                                    iterDockingSolutions, matrixToEuler,
+                                    parseResidues, preparePdb, readCaAtoms,
+                                    readResidueCoordinates, transformPoses,
+                                    writeDockingSolutions, zdockToPoses)
+
+
+def randomSolutions(n, seed=0, sortByScore=True):
+    """ Return n random docking solutions, by decreasing score if
+    sortByScore. """
+    rng = np.random.default_rng(seed)
+    solutions = np.empty(n, dtype=SOLUTION_DTYPE)
+    solutions['rank'] = np.arange(1, n + 1)
+    solutions['euler'] = rng.uniform(-np.pi, np.pi, (n, 3))
+    solutions['euler'][:, 1] = rng.uniform(0, np.pi, n)
+    solutions['translation'] = rng.uniform(-20, 20, (n, 3))
+    solutions['score'] = rng.uniform(0, 1000, n)
+    if sortByScore:
+        solutions['score'] = np.sort(solutions['score'])[::-1]
+    solutions['cluster'] = -1
+    return solutions
+
+
+def _zRotation(angle):
+    c, s = np.cos(angle), np.sin(angle)
+    return np.array([[c, -s, 0], [s, c, 0], [0, 0, 1]])
+
+
+def _xRotation(angle):
+    c, s = np.cos(angle), np.sin(angle)
+    return np.array([[1, 0, 0], [0, c, -s], [0, s, c]])
+
+
+def _zdockRotation(angles):
+    """ Rotation of ZDOCK angles, applied from the last to the first. """
+    return _zRotation(angles[0]) @ _xRotation(angles[1]) @ _zRotation(angles[2])
+
+
+def _createLig(header, prediction, coords):
+    """ Reference port of the ZDOCK create_lig transform of the mobile
+    molecule for one prediction, atom by atom. """
+    gridSize, spacing, switched = [float(x) for x in header[0].split()]
+    recRotation = _zdockRotation([float(x) for x in header[1].split()])
+    ligRotation = _zdockRotation([float(x) for x in header[2].split()])
+    recCenter = np.array(header[3].split()[1:], dtype=float)
+    ligCenter = np.array(header[4].split()[1:], dtype=float)
+    rotation = _zdockRotation(prediction[0:3])
+    translation = np.array([gridSize - t if t >= gridSize / 2 else -t
+                            for t in prediction[3:6]]) * spacing
+    docked = []
+    for atom in coords:
+        if switched:
+            origin = recRotation @ atom - recCenter
+            atom = rotation.T @ (origin - translation) + ligCenter
+            docked.append(ligRotation.T @ atom)
+        else:
+            origin = ligRotation @ atom - ligCenter
+            atom = rotation @ origin + translation + recCenter
+            docked.append(recRotation.T @ atom)
+    return np.array(docked)
+
+
+def _atomLine(serial, name, altLoc, resSeq, x, occupancy='  1.00',
+              bFactor=' 20.00'):
+    """ Return a pdb ATOM line of chain A, with the occupancy and B-factor
+    columns given as text so they may be blank or missing. """
+    return ('ATOM  %5d  %-3s%1sALA A%4d    %8.3f%8.3f%8.3f%s%s'
+            % (serial, name, altLoc, resSeq, x, 0.0, 0.0, occupancy, bFactor))
+
+
+class TestPdbAtoms(BaseTest):
+    @classmethod
+    def setUpClass(cls):
+        setupTestOutput(cls)
+
+    def setUp(self):
+        self.pdbFile = os.path.join(self.getOutputPath(), 'atoms.pdb')
+
+    def _readAtoms(self, lines):
+        with open(self.pdbFile, 'w') as f:
+            f.write('\n'.join(lines) + '\nEND\n')
+        return [atom for chunk in iterAtomRecords(self.pdbFile)
+                for atom in chunk]
+
+    def testBlankOccupancy(self):
+        """ Blank or missing occupancy and B-factor columns take the default
+        values. """
+        atoms = self._readAtoms([_atomLine(1, 'N', '', 1, 1.0),
+                                 _atomLine(2, 'CA', '', 1, 2.0, '      ', '      '),
+                                 _atomLine(3, 'C', '', 1, 3.0, '', ''),
+                                 _atomLine(4, 'O', '', 1, 4.0, '  0.50', '')])
+        self.assertEqual([a['name'] for a in atoms], [b'N', b'CA', b'C', b'O'])
+        self.assertEqual([a['occupancy'] for a in atoms], [1.0, 1.0, 1.0, 0.5])
+        self.assertEqual([a['bFactor'] for a in atoms], [20.0, 0.0, 0.0, 0.0])
+
+    def testAltLocsPerAtom(self):
+        """ Every atom keeps its most occupied alternate location, chosen
+        independently in every residue. """
+        atoms = self._readAtoms([_atomLine(1, 'N', '', 1, 0.0),
+                                 _atomLine(2, 'CA', 'A', 1, 1.0, '  0.30'),
+                                 _atomLine(3, 'CA', 'B', 1, 2.0, '  0.70'),
+                                 _atomLine(4, 'CA', 'A', 2, 3.0, '  0.60'),
+                                 _atomLine(5, 'CA', 'B', 2, 4.0, '  0.40'),
+                                 _atomLine(6, 'CB', 'A', 2, 5.0, '  0.50'),
+                                 _atomLine(7, 'CB', 'B', 2, 6.0, '  0.50')])
+        self.assertEqual([(a['resSeq'], a['name'], a['coords'][0]) for a in atoms],
+                         [(1, b'N', 0.0), (1, b'CA', 2.0),
+                          (2, b'CA', 3.0), (2, b'CB', 5.0)])
+
+    def testCifChains(self):
+        """ mmCIF chain ids longer than one character are written as free
+        single character ids. """
+        cifFile = os.path.join(self.getOutputPath(), 'atoms.cif')
+        columns = ['group_PDB', 'id', 'type_symbol', 'label_atom_id',
+                   'label_comp_id', 'label_asym_id', 'label_seq_id',
+                   'Cartn_x', 'Cartn_y', 'Cartn_z', 'occupancy',
+                   'B_iso_or_equiv', 'auth_seq_id', 'auth_asym_id',
+                   'pdbx_PDB_model_num']
+        chains = ['A', 'AA', 'B', 'BBB', 'AA']
+        with open(cifFile, 'w') as f:
+            f.write('data_test\nloop_\n')
+            f.writelines('_atom_site.%s\n' % column for column in columns)
+            for i, chain in enumerate(chains):
+                f.write('ATOM %d C CA ALA %s %d %d.0 0.0 0.0 1.00 20.00 %d %s 1\n'
+                        % (i + 1, chain, i + 1, i, i + 1, chain))
+            f.write('#\n')
+        numberOfAtoms, chainMap = preparePdb(cifFile, self.pdbFile)
+        self.assertEqual(numberOfAtoms, 5)
+        self.assertEqual(chainMap, {'AA': 'C', 'BBB': 'D'})
+        keys, _ = readCaAtoms(self.pdbFile)
+        self.assertEqual(keys, [('A', '1'), ('C', '2'), ('B', '3'), ('D', '4'),
+                                ('C', '5')])
+
+    def testResidueKeys(self):
+        """ The CA atoms and the selected residues use the same residue
+        numbers, insertion codes aside. """
+        lines = [_atomLine(1, 'CA', '', 52, 1.0), _atomLine(2, 'CB', '', 52, 2.0),
+                 _atomLine(3, 'CA', '', 52, 3.0), _atomLine(4, 'CA', '', 53, 4.0)]
+        # Residue 52A
+        lines[2] = lines[2][:26] + 'A' + lines[2][27:]
+        self._readAtoms(lines)
+        keys, coords = readCaAtoms(self.pdbFile)
+        self.assertEqual(keys, [('A', '52'), ('A', '52'), ('A', '53')])
+        np.testing.assert_array_equal(
+            readResidueCoordinates(self.pdbFile, {keys[0]})[:, 0], [1.0, 2.0, 3.0])
+        np.testing.assert_array_equal(
+            readResidueCoordinates(self.pdbFile, parseResidues('A:53')), coords[2:])
+
+
+class TestDockingSolutions(BaseTest):
+    @classmethod
+    def setUpClass(cls):
+        setupTestOutput(cls)
+
+    def testFrodockviewListing(self):
+        """ A frodockview listing is read after its header, in chunks of
+        lines, with no cluster column. """
+        solutions = randomSolutions(500)
+        fileName = self.getOutputPath('dock.txt')
+        with open(fileName, 'w') as f:
+            f.write('Solutions listing of dock.dat\n')
+            for row in solutions:
+                f.write('%6d %8.4f %8.4f %8.4f %9.3f %9.3f %9.3f %10.3f\n'
+                        % ((row['rank'],) + tuple(row['euler']) +
+                           tuple(row['translation']) + (row['score'],)))
+
+        chunks = list(iterDockingSolutions(fileName, chunkSize=4096))
+        self.assertGreater(len(chunks), 1)
+        listed = np.concatenate(chunks)
+        self.assertEqual(len(listed), len(solutions))
+        np.testing.assert_array_equal(listed['rank'], solutions['rank'])
+        np.testing.assert_allclose(listed['euler'], solutions['euler'], atol=1e-4)
+        np.testing.assert_allclose(listed['translation'], solutions['translation'],
+                                   atol=1e-3)
+        np.testing.assert_allclose(listed['score'], solutions['score'], atol=1e-3)
+        self.assertTrue(np.all(listed['cluster'] == -1))
+
+    def testClusterColumn(self):
+        """ Tables written by writeDockingSolutions keep the clusters. """
+        solutions = randomSolutions(20)
+        solutions['cluster'] = np.arange(20) // 4
+        fileName = self.getOutputPath('clusters.txt')
+        writeDockingSolutions(fileName, solutions)
+        listed = np.concatenate(list(iterDockingSolutions(fileName)))
+        np.testing.assert_array_equal(listed['cluster'], solutions['cluster'])
+
+    def testMalformedListing(self):
+        fileName = self.getOutputPath('malformed.txt')
+        with open(fileName, 'w') as f:
+            f.write('1 0.1 0.2 0.3 1.0 2.0 3.0 50.0\n2 0.1 0.2\n')
+        with self.assertRaises(ValueError):
+            list(iterDockingSolutions(fileName))
+
+
+class TestEulerAngles(BaseTest):
+    def testRotations(self):
+        """ The matrices are proper rotations and the angles round-trip,
+        also in the gimbal lock of a zero second angle. """
+        euler = randomSolutions(200)['euler'].astype(np.float64)
+        euler[:3, 1] = 0.0
+        matrices = eulerToMatrix(euler)
+        identity = np.broadcast_to(np.eye(3), matrices.shape)
+        np.testing.assert_allclose(matrices @ matrices.transpose(0, 2, 1),
+                                   identity, atol=1e-12)
+        np.testing.assert_allclose(np.linalg.det(matrices), 1.0)
+        np.testing.assert_allclose(eulerToMatrix(matrixToEuler(matrices)),
+                                   matrices, atol=1e-9)
+        np.testing.assert_allclose(matrixToEuler(matrices)[3:], euler[3:],
+                                   atol=1e-9)
+
+    def testZxzConvention(self):
+        """ ZXZ angles: the first and last rotate around z, the second
+        around x. """
+        quarter = np.pi / 2
+        np.testing.assert_allclose(eulerToMatrix([quarter, 0, 0])[0],
+                                   [[0, -1, 0], [1, 0, 0], [0, 0, 1]], atol=1e-12)
+        np.testing.assert_allclose(eulerToMatrix([0, quarter, 0])[0],
+                                   [[1, 0, 0], [0, 0, -1], [0, 1, 0]], atol=1e-12)
+
+    def testTransformPoses(self):
+        """ Poses rotate the ligand around its center and move the center
+        to the translation. """
+        coords = np.array([[1.0, 0.0, 0.0], [3.0, 0.0, 0.0], [2.0, 2.0, 0.0]])
+        solutions = randomSolutions(1)
+        solutions['euler'] = (np.pi / 2, 0, 0)
+        solutions['translation'] = (10.0, 0.0, 0.0)
+        center = np.array([2.0, 0.0, 0.0])
+        poses = transformPoses(coords, solutions, center=center)
+        np.testing.assert_allclose(poses[0], [[10, -1, 0], [10, 1, 0], [8, 0, 0]],
+                                   atol=1e-6)
+
+
+class TestZdockPoses(BaseTest):
+    def _checkPoses(self, switched):
+        rng = np.random.default_rng(int(switched))
+        ligand = rng.normal(30.0, 8.0, (40, 3))
+        header = ['92\t1.2\t%d\n' % switched,
+                  '%.6f\t%.6f\t%.6f\n' % tuple(rng.uniform(0, np.pi, 3)),
+                  '%.6f\t%.6f\t%.6f\n' % tuple(rng.uniform(0, np.pi, 3)),
+                  'rec.pdb\t%.3f\t%.3f\t%.3f\n' % tuple(rng.uniform(-40, 40, 3)),
+                  'lig.pdb\t%.3f\t%.3f\t%.3f\n' % tuple(rng.uniform(-40, 40, 3))]
+        solutions = randomSolutions(20, seed=int(switched))
+        solutions['translation'] = rng.integers(0, 92, (20, 3))
+        center = ligand.mean(axis=0)
+        poses = zdockToPoses(header, solutions, center)
+        docked = transformPoses(ligand, poses, center=center)
+        for solution, coords in zip(solutions, docked):
+            prediction = np.concatenate([solution['euler'],
+                                         solution['translation']])
+            np.testing.assert_allclose(coords, _createLig(header, prediction, ligand),
+                                       atol=1e-4)
+
+    def testPoses(self):
+        """ Poses place the ligand as create_lig does. """
+        self._checkPoses(switched=False)
+
+    def testSwitchedPoses(self):
+        """ If ZDOCK switched the molecules, create_lig moves the input
+        ligand, the ZDOCK receptor, by the inverse transform. """
+        self._checkPoses(switched=True)
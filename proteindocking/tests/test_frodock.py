@@ -0,0 +1,160 @@
+# **************************************************************************
+# *
+# * Authors: Yunior C. Fonseca Reyna    (cfonseca@cnb.csic.es)
+# *          Erney Ramirez Aportela     (eramirez@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+import os
+
+import numpy as np
+import pyworkflow.utils as pwutils
+
+from proteindocking.convert import getPoseCenter, transformPoses
+from proteindocking.profiling import PROFILE_FILE, loadProfile
+from proteindocking.protocols import ProtFrodockProtein
+from proteindocking.protocols.protocol_frodock import (CLUSTERING_IN_PROCESS,
+                                                       SEARCH_COARSE_TO_FINE)
+from proteindocking.runner import runCommand
+from proteindocking.tests.base import DockingTest
+
+
+class TestFrodockSteps(DockingTest):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.receptor = cls._importSyntheticPdb('receptor', 60, 'A', seed=0)
+        cls.ligand = cls._importSyntheticPdb('ligand', 30, 'B', seed=1)
+
+    def _dock(self, **kwargs):
+        kwargs.setdefault('inputPdbLigand', self.ligand)
+        kwargs.setdefault('numberOfThreads', 1)
+        prot = self.newProtocol(ProtFrodockProtein, inputPdbReceptor=self.receptor,
+                                useMapCache=False, **kwargs)
+        self.launchProtocol(prot)
+        return prot
+
+    def testSearchFingerprint(self):
+        """ The search runs again when a desolvation map changes, and only
+        then. """
+        prot = self._dock()
+        searchArgs = ('ligand', True, prot._getRestraintParams())
+        self.assertEqual(self._countRuns(prot, 'frodock_gcc'), 1)
+        prot.dockingSearchStep(*searchArgs)
+        self.assertEqual(self._countRuns(prot, 'frodock_gcc'), 1)
+
+        # e.g. a map regenerated or fetched from the cache with other contents
+        with open(prot._getPdbOutputPath('ligand', '_DS.ccp4'), 'r+b') as f:
+            f.seek(-4, 2)
+            f.write(b'\x00\x00\x80\x3f')
+        prot.dockingSearchStep(*searchArgs)
+        self.assertEqual(self._countRuns(prot, 'frodock_gcc'), 2)
+
+    def testListKeptResults(self):
+        """ The results kept for frodockcluster are listed, not searched
+        again, when the clustering changes to the in-process one. """
+        prot = self._dock()
+        dockFilePath = os.path.join(prot._getOutputDir('ligand'), 'dock.dat')
+        self.assertTrue(os.path.exists(dockFilePath))
+        prot.dockingSearchStep('ligand', False, prot._getRestraintParams())
+        self.assertEqual(self._countRuns(prot, 'frodock_gcc'), 1)
+        self.assertEqual(self._countRuns(prot, 'frodockview'), 2)
+        self.assertFalse(os.path.exists(dockFilePath))
+        self.assertTrue(os.path.exists(prot._getListingPath(dockFilePath)))
+
+    def testMpiProfile(self):
+        """ The MPI search, run by the protocol runJob, is in the profile
+        like the other programs. """
+        prot = self._dock()
+        # Run by this process, without mpirun
+        prot.runJob = lambda program, arguments, **kwargs: runCommand(
+            program, arguments.split(), env=kwargs['env'])
+        prot.numberOfMpi.set(2)
+        prot.dockingSearchStep('ligand', True, prot._getRestraintParams())
+        records = [record for record in loadProfile(prot._getExtraPath(PROFILE_FILE))
+                   if record['type'] == 'program' and
+                   record['program'] == 'frodock_mpi_gcc']
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]['step'], 'dockingSearchStep')
+        self.assertGreater(records[0]['wallTime'], 0)
+        self.assertGreater(records[0]['cpuTime'], 0)
+
+    def testRestraint(self):
+        """ The search is centered at the receptor site and only the poses
+        placing the ligand epitope near the site are kept. """
+        prot = self._dock(receptorResidues='A:10-14', ligandResidues='B:3-5',
+                          clusteringMode=CLUSTERING_IN_PROCESS)
+        siteCenter, epitope, maxDistance, searchRadius = prot._getRestraint('ligand')
+        with open(prot.getStdoutLog()) as f:
+            self.assertIn('-p %s --rd %.3f'
+                          % (','.join('%.3f' % x for x in siteCenter), searchRadius),
+                          f.read())
+        ligandFile = prot.outputSolutions.getLigandFile()
+        center = getPoseCenter(ligandFile)
+        positions = transformPoses((center + epitope)[None],
+                                   prot.outputSolutions.getPoses(), center)[:, 0]
+        self.assertGreater(len(positions), 0)
+        self.assertTrue(np.all(np.linalg.norm(positions - siteCenter, axis=1)
+                               <= maxDistance + 1e-3))
+
+    def _countEarlyComplexes(self, prot):
+        earlyDir = prot._getEarlyComplexesDir('ligand')
+        return sum(1 for fileName in os.listdir(earlyDir)
+                   if fileName.startswith('complex_'))
+
+    def testPipelinedClustering(self):
+        """ The pipelined clustering writes the complexes of the top clusters
+        once they are stable, and gives the same outputs, which link them. """
+        kwargs = dict(searchMode=SEARCH_COARSE_TO_FINE, numberOfRegions=4,
+                      clusteringMode=CLUSTERING_IN_PROCESS, numberOfPoses=5,
+                      numberOfThreads=3)
+        prot = self._dock(pipelined=True, **kwargs)
+        reference = self._dock(pipelined=False, **kwargs)
+        np.testing.assert_array_equal(prot.outputSolutions.getPoses(),
+                                      reference.outputSolutions.getPoses())
+        complexes = [c.getFileName() for c in prot.outputComplexes]
+        self.assertEqual(len(complexes), 5)
+        for complexFile, referenceFile in zip(complexes,
+                                              [c.getFileName() for c in
+                                               reference.outputComplexes]):
+            self.assertTrue(os.path.islink(complexFile))
+            with open(complexFile) as f, open(referenceFile) as g:
+                self.assertEqual(f.read(), g.read())
+
+        # Replay the updates as the refinements finish, one at a time
+        pwutils.cleanPath(prot._getEarlyComplexesDir('ligand'))
+        listings = [prot._getListingPath(prot._getRefinedFilePath('ligand', region))
+                    for region in range(4)]
+        for listing in listings[1:]:
+            os.rename(listing, listing + '.pending')
+        prot._updatePipeline('ligand', 4)
+        # Nothing is written until the top clusters survive an update
+        self.assertEqual(self._countEarlyComplexes(prot), 0)
+        prot._updatePipeline('ligand', 4)
+        self.assertEqual(self._countEarlyComplexes(prot), 5)
+        for listing in listings[1:]:
+            os.rename(listing + '.pending', listing)
+        prot._updatePipeline('ligand', 4)
+        earlyPoses = {prot._getEarlyPosePath('ligand', solution)
+                      for solution in prot.outputSolutions.getPoses()[:5]}
+        self.assertTrue(all(os.path.exists(posePath) for posePath in earlyPoses))
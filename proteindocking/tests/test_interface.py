@@ -0,0 +1,79 @@
+# **************************************************************************
+# *
+# * Authors: Yunior C. Fonseca Reyna    (cfonseca@cnb.csic.es)
+# *          Erney Ramirez Aportela     (eramirez@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+import numpy as np
+
+from proteindocking.protocols import ProtDockingInterface, ProtFrodockProtein
+from proteindocking.tests.base import DockingTest
+
+
+class TestDockingInterface(DockingTest):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.receptor = cls._importSyntheticPdb('receptor', 60, 'A', seed=0)
+        cls.ligand = cls._importSyntheticPdb('ligand', 30, 'B', seed=1)
+        prot = cls.newProtocol(ProtFrodockProtein, inputPdbReceptor=cls.receptor,
+                               inputPdbLigand=cls.ligand, useMapCache=False)
+        cls.launchProtocol(prot)
+        cls.solutions = prot.outputSolutions
+
+    def _analyze(self, **kwargs):
+        prot = self.newProtocol(ProtDockingInterface,
+                                inputSolutions=self.solutions,
+                                numberOfPoses=100, **kwargs)
+        self.launchProtocol(prot)
+        ranks = np.loadtxt(prot._getExtraPath('interface.txt'), usecols=0,
+                           dtype=int, ndmin=1)
+        return prot, ranks, np.load(prot._getExtraPath('interface.npy'))
+
+    def testFilters(self):
+        """ Only the analyzed poses passing every filter are kept. """
+        prot, ranks, interface = self._analyze()
+        self.assertEqual(len(interface), 100)
+        self.assertEqual(prot.outputSolutions.getSize(), 100)
+
+        contacts = interface['contacts']
+        clashes = interface['clashes']
+        buriedArea = interface['buriedArea']
+        minContacts = int(np.median(contacts))
+        maxClashes = int(np.median(clashes))
+        minBuriedArea = float(np.percentile(buriedArea, 25))
+        prot, _, _ = self._analyze(minContacts=minContacts, maxClashes=maxClashes,
+                                minBuriedArea=minBuriedArea)
+        keep = ((contacts >= minContacts) & (clashes <= maxClashes) &
+                (buriedArea >= minBuriedArea))
+        self.assertTrue(0 < keep.sum() < len(keep))
+        kept = [solution.clone() for solution in prot.outputSolutions]
+        self.assertEqual(sorted(s.getRank() for s in kept),
+                         sorted(ranks[keep].tolist()))
+        for solution in kept:
+            self.assertGreaterEqual(solution._interfaceContacts.get(), minContacts)
+            self.assertLessEqual(solution._interfaceClashes.get(), maxClashes)
+            self.assertGreaterEqual(solution._buriedArea.get(), minBuriedArea)
+        self.assertIn('%d poses kept after the interface filters' % keep.sum(),
+                      prot.summary())
@@ -0,0 +1,82 @@
+# **************************************************************************
+# *
+# * Authors: Yunior C. Fonseca Reyna    (cfonseca@cnb.csic.es)
+# *          Erney Ramirez Aportela     (eramirez@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+import numpy as np
+from pyworkflow.tests import BaseTest, setupTestOutput
+
+from proteindocking.storage import SolutionsFile, writeSolutionsFile
+from proteindocking.tests.test_convert import randomSolutions
+
+
+class TestSolutionsFile(BaseTest):
+    @classmethod
+    def setUpClass(cls):
+        setupTestOutput(cls)
+
+    def _write(self, fileName, chunks, blockSize):
+        fileName = self.getOutputPath(fileName)
+        self.assertEqual(writeSolutionsFile(fileName, chunks, blockSize=blockSize),
+                         sum(len(chunk) for chunk in chunks))
+        return fileName
+
+    def testBlocks(self):
+        """ Chunks of any size are stored in blocks of blockSize rows and
+        read back unchanged. """
+        solutions = randomSolutions(1000)
+        fileName = self._write('sorted.npz', [solutions[:10], solutions[10:777],
+                                              solutions[777:]], blockSize=300)
+        with SolutionsFile(fileName) as solutionsFile:
+            self.assertEqual(len(solutionsFile), 1000)
+            self.assertTrue(solutionsFile.isSorted)
+            self.assertEqual([len(b) for b in solutionsFile.iterBlocks()],
+                             [300, 300, 300, 100])
+            np.testing.assert_array_equal(solutionsFile.getAll(), solutions)
+            np.testing.assert_array_equal(solutionsFile.getBlock(1),
+                                          solutions[300:600])
+
+    def testTop(self):
+        """ The best solutions are the same whether the file is sorted by
+        score or not. """
+        solutions = randomSolutions(1000, sortByScore=False)
+        fileName = self._write('unsorted.npz', [solutions], blockSize=128)
+        expected = solutions[np.argsort(-solutions['score'], kind='stable')]
+        with SolutionsFile(fileName) as solutionsFile:
+            self.assertFalse(solutionsFile.isSorted)
+            np.testing.assert_array_equal(solutionsFile.getTop(50), expected[:50])
+
+        fileName = self._write('sorted.npz', [expected], blockSize=128)
+        with SolutionsFile(fileName) as solutionsFile:
+            self.assertTrue(solutionsFile.isSorted)
+            np.testing.assert_array_equal(solutionsFile.getTop(50), expected[:50])
+            np.testing.assert_array_equal(solutionsFile.getTop(5000), expected)
+
+    def testEmpty(self):
+        fileName = self._write('empty.npz', [], blockSize=128)
+        with SolutionsFile(fileName) as solutionsFile:
+            self.assertEqual(len(solutionsFile), 0)
+            self.assertEqual(len(solutionsFile.getAll()), 0)
+            self.assertEqual(len(solutionsFile.getTop(10)), 0)
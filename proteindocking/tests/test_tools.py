@@ -0,0 +1,69 @@
+# **************************************************************************
+# *
+# * Authors: Yunior C. Fonseca Reyna    (cfonseca@cnb.csic.es)
+# *          Erney Ramirez Aportela     (eramirez@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+import os
+import stat
+
+from pyworkflow.tests import BaseTest, setupTestOutput
+
+from proteindocking.constants import FRODOCK, FRODOCK_VERSION, PROTEIN_DOCKING_HOME
+from proteindocking.tools import ToolNotFoundError, ToolRegistry
+
+
+class TestToolRegistry(BaseTest):
+    @classmethod
+    def setUpClass(cls):
+        setupTestOutput(cls)
+
+    def _install(self, package):
+        """ Install an empty frodock under the home directory package and
+        return the home. """
+        home = self.getOutputPath(package)
+        fileName = os.path.join(home, 'bin', FRODOCK)
+        os.makedirs(os.path.dirname(fileName), exist_ok=True)
+        open(fileName, 'w').close()
+        os.chmod(fileName, os.stat(fileName).st_mode | stat.S_IXUSR)
+        return home
+
+    def testVersion(self):
+        """ A tool is found only in the expected version of its package, and
+        is validated once for every home. """
+        variables = {PROTEIN_DOCKING_HOME: self._install('frodock3-' + FRODOCK_VERSION)}
+        registry = ToolRegistry(variables.get)
+        path = registry.getTool(FRODOCK)
+        self.assertEqual(path, os.path.join(variables[PROTEIN_DOCKING_HOME],
+                                            'bin', FRODOCK))
+        # Served from memory
+        os.remove(path)
+        self.assertEqual(registry.getTool(FRODOCK), path)
+
+        variables[PROTEIN_DOCKING_HOME] = self._install('frodock3-3.0')
+        with self.assertRaisesRegex(ToolNotFoundError,
+                                    'frodock3 %s is required, .* has version 3.0\\.'
+                                    % FRODOCK_VERSION):
+            registry.getTool(FRODOCK)
+        self.assertEqual(len(registry.validate([FRODOCK])), 1)
@@ -0,0 +1,111 @@
+# **************************************************************************
+# *
+# * Authors: Yunior C. Fonseca Reyna    (cfonseca@cnb.csic.es)
+# *          Erney Ramirez Aportela     (eramirez@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+import os
+
+import numpy as np
+import pyworkflow.utils as pwutils
+
+from proteindocking.convert import loadZdockOutput, parseResidues
+from proteindocking.profiling import PROFILE_FILE, loadProfile
+from proteindocking.protocols import ProtZdockProtein
+from proteindocking.protocols.protocol_zdock import getChunkOffsets
+from proteindocking.tests.base import DockingTest
+
+
+class TestZdockChunks(DockingTest):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.receptor = cls._importSyntheticPdb('receptor', 80, 'A', seed=0)
+        cls.ligand = cls._importSyntheticPdb('ligand', 30, 'B', seed=1)
+
+    def _dock(self, **kwargs):
+        prot = self.newProtocol(ProtZdockProtein, inputPdbReceptor=self.receptor,
+                                inputPdbLigand=self.ligand, denseSampling=True,
+                                numberOfPredictions=300, numberOfPoses=5,
+                                **kwargs)
+        self.launchProtocol(prot)
+        self._checkSolutions(prot, numberOfSolutions=300)
+        self._checkComplexes(prot, 5)
+        return prot
+
+    def testOffsets(self):
+        """ The offsets are distinct rotations of the chunk angle. """
+        offsets = getChunkOffsets()
+        self.assertEqual(len(offsets), 15)
+        np.testing.assert_allclose(offsets @ offsets.transpose(0, 2, 1),
+                                   np.broadcast_to(np.eye(3), offsets.shape),
+                                   atol=1e-12)
+        angles = np.degrees(np.arccos((np.trace(offsets, axis1=1, axis2=2) - 1) / 2))
+        np.testing.assert_allclose(angles, [0] + [6] * 14, atol=1e-6)
+
+    def testSplitDenseSampling(self):
+        """ The dense sampling runs as 15 concurrent searches whose best
+        predictions are merged by score. """
+        prot = self._dock(numberOfThreads=4)
+        scores = []
+        for chunk in range(15):
+            outputFile = prot._getExtraPath('zdock_%02d.out' % chunk)
+            header, solutions = loadZdockOutput(outputFile)
+            # Every chunk samples the default rotational set (the stand-in
+            # uses a larger grid with -D)
+            self.assertEqual(header[0].split()[0], '92')
+            scores.append(solutions['score'])
+        best = np.sort(np.concatenate(scores))[::-1][:300]
+        np.testing.assert_allclose(sorted((s.getScore() for s in prot.outputSolutions),
+                                          reverse=True), best, atol=1e-3)
+
+        searches = [(r['start'], r['start'] + r['wallTime'])
+                    for r in loadProfile(prot._getExtraPath(PROFILE_FILE))
+                    if r['type'] == 'step' and r['step'] == 'dockingSearchStep']
+        self.assertEqual(len(searches), 15)
+        searches.sort()
+        self.assertTrue(any(start < end for (_, end), (start, _)
+                            in zip(searches, searches[1:])),
+                        'The searches did not run concurrently')
+
+    def testSingleDenseSearch(self):
+        prot = self._dock(splitSampling=False)
+        header, _ = loadZdockOutput(prot._getExtraPath('zdock.out'))
+        self.assertEqual(header[0].split()[0], '128')
+        self.assertFalse(os.path.exists(prot._getExtraPath('zdock_00.out')))
+
+    def testRestraint(self):
+        """ Only the receptor residues outside the interface are blocked. """
+        prot = self.newProtocol(ProtZdockProtein, inputPdbReceptor=self.receptor,
+                                inputPdbLigand=self.ligand, numberOfPredictions=50,
+                                receptorResidues='A:10-14, A:20')
+        self.launchProtocol(prot)
+        self.assertEqual(self._countRuns(prot, 'block.pl'), 1)
+        # The block file is only kept in the temporary folder of the run
+        pwutils.makePath(prot._getTmpPath())
+        prot._blockResidues('receptor', parseResidues('A:10-14, A:20'))
+        with open(prot._getTmpPath('receptor_blocked.txt')) as f:
+            blocked = [line.split() for line in f]
+        self.assertEqual(blocked, [[str(number), 'A'] for number in range(1, 81)
+                                   if not 10 <= number <= 14 and number != 20])
@@ -0,0 +1,125 @@
+# **************************************************************************
+# *
+# * Authors: Yunior C. Fonseca Reyna    (cfonseca@cnb.csic.es)
+# *          Erney Ramirez Aportela     (eramirez@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+import os
+
+from .constants import (PROTEIN_DOCKING_HOME, ZDOCK_DOCKING_HOME,
+                        ZRANK_DOCKING_HOME, FRODOCKGRID, ZRANK, ZDOCK,
+                        MARK_SUR, CREATE_PL, CREATE_LIG, BLOCK_PL, UNICHARMM,
+                        FRODOCKCLUSTER, FRODOCK, FRODOCK_MPI, FRODOCKVIEW, SOAP,
+                        FRODOCK_VERSION, ZDOCK_VERSION, ZRANK_VERSION)
+
+# Home variable, package name and relative path of every tool
+TOOLS = {FRODOCKGRID: (PROTEIN_DOCKING_HOME, 'frodock3', 'bin'),
+         FRODOCK: (PROTEIN_DOCKING_HOME, 'frodock3', 'bin'),
+         FRODOCK_MPI: (PROTEIN_DOCKING_HOME, 'frodock3', 'bin'),
+         FRODOCKCLUSTER: (PROTEIN_DOCKING_HOME, 'frodock3', 'bin'),
+         FRODOCKVIEW: (PROTEIN_DOCKING_HOME, 'frodock3', 'bin'),
+         SOAP: (PROTEIN_DOCKING_HOME, 'frodock3', 'bin'),
+         ZDOCK: (ZDOCK_DOCKING_HOME, 'zdock', ''),
+         MARK_SUR: (ZDOCK_DOCKING_HOME, 'zdock', ''),
+         CREATE_PL: (ZDOCK_DOCKING_HOME, 'zdock', ''),
+         CREATE_LIG: (ZDOCK_DOCKING_HOME, 'zdock', ''),
+         BLOCK_PL: (ZDOCK_DOCKING_HOME, 'zdock', ''),
+         UNICHARMM: (ZDOCK_DOCKING_HOME, 'zdock', ''),
+         ZRANK: (ZRANK_DOCKING_HOME, 'zrank', '')}
+
+# Version expected of every package
+VERSIONS = {'frodock3': FRODOCK_VERSION,
+            'zdock': ZDOCK_VERSION,
+            'zrank': ZRANK_VERSION}
+
+# Tools that are data files instead of executables
+DATA_FILES = {SOAP, UNICHARMM}
+
+
+class ToolNotFoundError(Exception):
+    pass
+
+
+def getVersion(home):
+    """ Return the version of a package, from the name of its home
+    directory (e.g. frodock3-3.12 -> 3.12). """
+    home = os.path.basename(os.path.normpath(home))
+    return home.rsplit('-', 1)[1] if '-' in home else ''
+
+
+class ToolRegistry:
+    """
+    Paths of the frodock, zdock and zrank tools. Every tool is resolved and
+    validated, including the version of its package, the first time it is
+    requested and then served from memory, until the home directory of its
+    package changes.
+    """
+    def __init__(self, getVar):
+        """
+        :param getVar: function returning the value of a plugin variable
+        """
+        self._getVar = getVar
+        self._tools = {}
+
+    def getTool(self, name):
+        """ Return the path of a tool or raise ToolNotFoundError. """
+        if name not in TOOLS:
+            raise ToolNotFoundError('Unknown docking tool: %s' % name)
+        homeVar, package, subdir = TOOLS[name]
+        home = self._getVar(homeVar)
+        cached = self._tools.get(name)
+        if cached is not None and cached[0] == home:
+            return cached[1]
+
+        if not home or not os.path.isdir(home):
+            raise ToolNotFoundError('%s not found: the %s home %s (%s) does not '
+                                    'exist. Install it with "scipion3 installb '
+                                    '%s" or set %s.' % (name, package, home,
+                                                        homeVar, package,
+                                                        homeVar))
+        version = getVersion(home)
+        if version != VERSIONS[package]:
+            raise ToolNotFoundError('%s %s is required, but %s has version %s. '
+                                    'Install it with "scipion3 installb %s" or '
+                                    'set %s.' % (package, VERSIONS[package],
+                                                 home, version or 'unknown',
+                                                 package, homeVar))
+        path = os.path.join(home, subdir, name)
+        if not os.path.exists(path):
+            raise ToolNotFoundError('%s not found in the %s installation: %s '
+                                    'does not exist' % (name, package, path))
+        if name not in DATA_FILES and not os.access(path, os.X_OK):
+            raise ToolNotFoundError('%s is not executable' % path)
+        self._tools[name] = (home, path)
+        return path
+
+    def validate(self, names):
+        """ Return the error messages of the tools that are not available. """
+        errors = []
+        for name in names:
+            try:
+                self.getTool(name)
+            except ToolNotFoundError as e:
+                errors.append(str(e))
+        return errors
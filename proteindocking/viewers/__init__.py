@@ -24,3 +24,23 @@
 # *  e-mail address 'scipion@cnb.csic.es'
 # *
 # **************************************************************************
+
+import importlib
+
+# Viewer classes and the modules defining them, imported on first access
+_VIEWERS = {'FrodockMapsViewer': 'viewer_maps'}
+
+__all__ = list(_VIEWERS)
+
+
+def __getattr__(name):
+    if name not in _VIEWERS:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    module = importlib.import_module('.' + _VIEWERS[name], __name__)
+    viewer = getattr(module, name)
+    globals()[name] = viewer
+    return viewer
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_VIEWERS))
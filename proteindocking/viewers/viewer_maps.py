@@ -0,0 +1,128 @@
+# **************************************************************************
+# *
+# * Authors: Yunior C. Fonseca Reyna    (cfonseca@cnb.csic.es)
+# *          Erney Ramirez Aportela     (eramirez@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+import numpy as np
+
+from pwem.objects import Volume, SetOfVolumes
+from pwem.viewers.plotter import EmPlotter
+from pyworkflow.protocol.params import EnumParam, IntParam, LabelParam
+from pyworkflow.viewer import ProtocolViewer, DESKTOP_TKINTER
+
+from proteindocking.ccp4 import Ccp4Map
+from proteindocking.protocols.protocol_frodock import ProtFrodockProtein
+
+AXES = ['x', 'y', 'z']
+
+
+class FrodockMapsViewer(ProtocolViewer):
+    """
+    Visualize the potential maps of the FRODOCK protocols: slices of a map
+    and the histogram and statistics of its values. Maps are memory mapped,
+    so only the shown slice is read.
+    """
+    _label = 'potential maps viewer'
+    _targets = [ProtFrodockProtein]
+    _environments = [DESKTOP_TKINTER]
+
+    def _defineParams(self, form):
+        form.addSection(label='Visualization')
+        form.addParam('mapName', EnumParam, choices=self._getMapNames() or ['-'],
+                      default=0,
+                      label="Potential map",
+                      help='Map of the receptor or a ligand')
+        form.addParam('axis', EnumParam, choices=AXES, default=2,
+                      display=EnumParam.DISPLAY_HLIST,
+                      label="Slice axis")
+        form.addParam('sliceIndex', IntParam, default=-1,
+                      label="Slice",
+                      help='Index of the slice along the axis. Use -1 for '
+                           'the central slice.')
+        form.addParam('displaySlice', LabelParam,
+                      label="Show the slice")
+        form.addParam('displayStatistics', LabelParam,
+                      label="Show the histogram and statistics")
+
+    def _getVisualizeDict(self):
+        return {'displaySlice': self._showSlice,
+                'displayStatistics': self._showStatistics}
+
+    def _getMapNames(self):
+        return [name for name, _ in self._getMapFiles()]
+
+    def _getMapFiles(self):
+        """ Return the name and the file of every map output. The maps of
+        the ligands of a batch are sets, named after the ligand ids. """
+        maps = [(name, volume.getFileName())
+                for name, volume in self.protocol.iterOutputAttributes(Volume)]
+        for name, volumes in self.protocol.iterOutputAttributes(SetOfVolumes):
+            maps.extend(('%s (ligand %s)' % (name, volume._ligandId.get()),
+                         volume.getFileName()) for volume in volumes)
+        return maps
+
+    def _getMap(self):
+        """ Return the name and the memory mapped file of the selected map. """
+        maps = self._getMapFiles()
+        if not maps:
+            return None, None
+        name, fileName = maps[self.mapName.get()]
+        return name, Ccp4Map(fileName.split(':')[0])
+
+    def _showSlice(self, paramName=None):
+        name, ccp4Map = self._getMap()
+        if ccp4Map is None:
+            return [self.errorMessage('The protocol has no potential maps')]
+        axis = AXES[self.axis.get()]
+        size = ccp4Map.getDimensions()[AXES.index(axis)]
+        index = self.sliceIndex.get()
+        if index < 0:
+            index = size // 2
+        if index >= size:
+            return [self.errorMessage('The map has %d slices along %s'
+                                      % (size, axis))]
+
+        plotter = EmPlotter(windowTitle=name)
+        xLabel, yLabel = [a for a in AXES if a != axis]
+        ax = plotter.createSubPlot('%s, %s = %d' % (name, axis, index),
+                                   xLabel, yLabel)
+        image = ax.imshow(ccp4Map.getSlice(axis, index), origin='lower',
+                          cmap='viridis')
+        plotter.getFigure().colorbar(image, ax=ax)
+        return [plotter]
+
+    def _showStatistics(self, paramName=None):
+        name, ccp4Map = self._getMap()
+        if ccp4Map is None:
+            return [self.errorMessage('The protocol has no potential maps')]
+        minimum, maximum, mean, std = ccp4Map.getStatistics()
+        counts, edges = ccp4Map.getHistogram()
+
+        plotter = EmPlotter(windowTitle=name)
+        ax = plotter.createSubPlot('min %0.3g, max %0.3g, mean %0.3g, std %0.3g'
+                                   % (minimum, maximum, mean, std),
+                                   'Value', 'Voxels')
+        ax.bar(edges[:-1], counts, width=np.diff(edges), align='edge')
+        ax.set_yscale('log')
+        return [plotter]
@@ -170,7 +170,7 @@ setup(
     # MANIFEST.in as well.
     # include_package_data=True,
     package_data={  # Optional
-       'proteindocking': ['protocols.conf'],
+       'proteindocking': ['protocols.conf', 'tests/benchmark_baseline.json'],
     },
 
     # Although 'package_data' is the preferred approach, in some case you may